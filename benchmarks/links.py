@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compare src.links.parse_links to the regex searches the issue classes used before it, over generated issue
+descriptions with a Unito footer at the end. Run from the repository root:
+
+    python -m benchmarks.links --count 50000
+"""
+
+import argparse
+import random
+import re
+import time
+
+from src.links import parse_links
+
+WORDS = ('the', 'pipeline', 'fails', 'when', 'a', 'sample', 'is', 'uploaded', 'to', 'staging', 'bucket', 'see',
+         'logs', 'for', 'details', 'expected', 'output', 'matches', 'metadata', 'schema', 'version', 'release')
+
+
+def make_descriptions(count: int, size: int, seed: int = 0) -> tuple:
+    """
+    Return Jira descriptions and GitHub bodies of about the given size, each ending with a Unito footer
+    :param count: Number of descriptions of each kind
+    :param size: Average number of characters of text before the footer
+    """
+    rand = random.Random(seed)
+    texts = [' '.join(rand.choice(WORDS) for _ in range(rand.randint(size // 14, size // 5)))
+             for _ in range(100)]  # About 7 characters per word, with the space
+    jira, github = [], []
+    for i in range(count):
+        text = texts[i % len(texts)]
+        jira.append(f'{text}\r\n\r\n┆{{color:#707070}}Issue is synchronized with a [GitHub issue|'
+                    f'https://github.com/org/repo/issues/{i}]{{color}}\r\n'
+                    f'┆{{color:#707070}}Repository Name: repo{{color}}\r\n'
+                    f'┆{{color:#707070}}Milestone: Sprint {i % 20}{{color}}\r\n'
+                    f'┆{{color:#707070}}Issue Number: {i}{{color}}\r\n')
+        github.append(f'{text}\n\n┆Issue is synchronized with this [Jira Story](https://org.atlassian.net/browse/'
+                      f'TEST-{i})\n┆Issue Number: TEST-{i}\n')
+    return jira, github
+
+
+def regex_searches(description: str) -> tuple:
+    """The searches JiraIssue.get_github_equivalent made before parse_links"""
+
+    match_obj1 = re.search(r'(?<=Repository Name: )(.*?)(?={color})', description)
+    match_obj2 = re.search(r'(?<=Issue Number: )(.*?)(?={color})', description)
+    match_obj3 = re.search(r'(?<=Milestone: )(.*?)(?={color})', description)
+    match_obj4 = re.search(r'(?<=github.com/)(.*?)(?=/)', description)
+    return tuple(m.group(0) if m else None for m in (match_obj1, match_obj2, match_obj3, match_obj4))
+
+
+def jira_key_search(body: str) -> str:
+    """The search GitHubIssue.get_jira_equivalent made before parse_links"""
+
+    match_obj = re.search(r'Issue Number: ([\w-]+)', body)
+    return match_obj.group(1) if match_obj else ''
+
+
+def timed(name: str, parse, descriptions: list) -> float:
+    started = time.perf_counter()
+    for description in descriptions:
+        parse(description)
+    elapsed = time.perf_counter() - started
+    print(f'{name:<40} {elapsed:8.3f} s {len(descriptions) / elapsed:12,.0f} per second')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing the Unito footer of issue descriptions')
+    parser.add_argument('--count', type=int, default=50000, help='Number of descriptions of each kind')
+    parser.add_argument('--size', type=int, default=4000, help='Average characters of text before the footer')
+    args = parser.parse_args()
+
+    jira, github = make_descriptions(args.count, args.size)
+    for description in jira[:100]:  # Both find the same link
+        link = parse_links(description)
+        assert regex_searches(description) == (link.repo, link.issue_number, link.milestone, link.org)
+    for body in github[:100]:
+        assert jira_key_search(body) == parse_links(body).jira_key
+
+    print(f'{args.count} descriptions of {sum(map(len, jira)) // len(jira)} characters on average')
+    before = timed('Jira: four regex searches', regex_searches, jira)
+    after = timed('Jira: parse_links', parse_links, jira)
+    print(f'{"":<40} {before / after:8.1f} x')
+    before = timed('GitHub: regex search', jira_key_search, github)
+    after = timed('GitHub: parse_links', parse_links, github)
+    print(f'{"":<40} {before / after:8.1f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Compare the parsing in src.timestamps to the way the issue classes parsed timestamps before it, over generated
+timestamps as Jira, GitHub and ZenHub give them. Run from the repository root:
+
+    python -m benchmarks.timestamps --count 100000
+"""
+
+import argparse
+import datetime
+import pytz
+import random
+import time
+
+from src.timestamps import parse_jira_timestamp, parse_utc_timestamp
+
+
+def make_timestamps(count: int, seed: int = 0) -> tuple:
+    """Return Jira timestamps with UTC offsets, and GitHub and ZenHub timestamps in UTC"""
+
+    rand = random.Random(seed)
+    start = datetime.datetime(2018, 1, 1)
+    jira, github, zenhub = [], [], []
+    for _ in range(count):
+        moment = start + datetime.timedelta(seconds=rand.randrange(3 * 365 * 24 * 3600))
+        jira.append(f"{moment:%Y-%m-%dT%H:%M:%S}.{rand.randrange(1000):03d}{rand.choice(('-0800', '-0700', '+0000'))}")
+        github.append(f'{moment:%Y-%m-%dT%H:%M:%S}Z')
+        zenhub.append(f'{moment:%Y-%m-%dT%H:%M:%S}.{rand.randrange(1000):03d}Z')
+    return jira, github, zenhub
+
+
+def strptime_jira(timestamp: str) -> datetime.datetime:
+    """JiraIssue.parse_timestamp and get_utc_offset before src.timestamps"""
+
+    offset_direction = timestamp[-5]  # A plus or minus sign
+    offset_hours = int(timestamp[-4:-2])
+    offset_minutes = int(timestamp[-2:])
+    offset_seconds = offset_hours * 3600 + offset_minutes * 60
+    offset = datetime.timezone(datetime.timedelta(seconds=int(offset_direction + str(offset_seconds))))
+    return datetime.datetime.strptime(timestamp.split('.')[0], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=offset)
+
+
+def strptime_github(timestamp: str) -> datetime.datetime:
+    """GitHubIssue.__init__ before src.timestamps"""
+
+    default_tz = pytz.timezone('UTC')
+    return default_tz.localize(datetime.datetime.strptime(timestamp.split('Z')[0], '%Y-%m-%dT%H:%M:%S'))
+
+
+def strptime_zenhub(timestamp: str) -> datetime.datetime:
+    """ZenHubIssue.get_most_recent_event before src.timestamps"""
+
+    default_tz = pytz.timezone('UTC')
+    return default_tz.localize(datetime.datetime.strptime(timestamp.split('.')[0], '%Y-%m-%dT%H:%M:%S'))
+
+
+def timed(name: str, parse, timestamps: list) -> float:
+    started = time.perf_counter()
+    for timestamp in timestamps:
+        parse(timestamp)
+    elapsed = time.perf_counter() - started
+    print(f'{name:<30} {elapsed:8.3f} s {len(timestamps) / elapsed:12,.0f} per second')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing Jira, GitHub and ZenHub timestamps')
+    parser.add_argument('--count', type=int, default=100000, help='Number of timestamps of each kind')
+    args = parser.parse_args()
+
+    jira, github, zenhub = make_timestamps(args.count)
+    for name, before, after, timestamps in (('Jira', strptime_jira, parse_jira_timestamp, jira),
+                                            ('GitHub', strptime_github, parse_utc_timestamp, github),
+                                            ('ZenHub', strptime_zenhub, parse_utc_timestamp, zenhub)):
+        for timestamp in timestamps[:100]:  # Both give the same time
+            assert before(timestamp) == after(timestamp)
+        elapsed_before = timed(f'{name}: strptime', before, timestamps)
+        elapsed_after = timed(f'{name}: src.timestamps', after, timestamps)
+        print(f'{"":<30} {elapsed_before / elapsed_after:8.1f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,13 @@
 
 number_of_retries = 3  # Set the number of retries allowed when syncing in case the API rate limit is reached
 
-urls = dict(  # GitHub base URL
-    github_api='https://api.github.com/repos/'
+urls = dict(  # GitHub base URLs
+    github_api='https://api.github.com/repos/',
+    github_graphql='https://api.github.com/graphql'
 )
 
+github_page_size = 100  # Number of issues per request when listing all issues in a GitHub repo. 100 is the maximum.
+
 url_mgmnt_sys = dict(  # Jira and ZenHub base URLs
     jira_alt_url='https://%s.atlassian.net/rest/agile/1.0/',  # alternative URL, e.g. to add issues to a sprint
     jira_url='https://%s.atlassian.net/rest/api/latest/',  # string format character included to be replaced with org
@@ -14,9 +17,33 @@ url_mgmnt_sys = dict(  # Jira and ZenHub base URLs
 token_path = dict(  # Locations of API token files
     api_token_jira='~/.sync-agile-board-jira_config',
     api_token_zenhub='~/.sync-agile-board-zenhub_config',
-    api_token_github='~/.sync-agile-board-github_config'
+    api_token_github='~/.sync-agile-board-github_config',
+    webhook_secret='~/.sync-agile-board-webhook_config'  # Shared secret that webhooks are verified with
+    )
+
+rate_budgets = {  # (requests, seconds) allowed per host, shared by all repo pairs that are synced in parallel
+    'api.github.com': (5000, 3600),  # GitHub's limit per token
+    'api.zenhub.io': (100, 60),  # ZenHub's limit per token
+    'atlassian.net': (600, 60)  # Jira Cloud has no fixed limit; this keeps a burst of syncs from being throttled
+    }
+
+state_path = dict(  # Locations of files holding state that is kept between synchronization runs
+    fingerprints='~/.sync-agile-board-fingerprints.json',
+    high_water_marks='~/.sync-agile-board-high-water-marks.json',
+    journal='~/.sync-agile-board-journal-%s.jsonl',  # One per pair of repos, e.g. ucsc-cgl-TEST-ucsc-cgp-sync-test
+    checkpoint='~/.sync-agile-board-checkpoint-%s.jsonl',  # One per repo being loaded, e.g. jira-ucsc-cgl-TEST
+    mirror='~/.sync-agile-board-mirror.sqlite3',
+    writes='~/.sync-agile-board-writes.json',
+    snapshots='~/.sync-agile-board-snapshots.json'
     )
 
+checkpoint_max_age = 60 * 60  # Seconds for which a restarted run reuses the responses checkpointed while loading a repo
+
+webhook_debounce = 30  # Seconds the daemon waits for an issue pair to stop changing before syncing it
+webhook_max_delay = 5 * 60  # Seconds after which an issue pair that keeps changing is synced anyway
+
+poll_intervals = (10, 15 * 60)  # Shortest and longest seconds between polls of a repo pair, for busy and idle pairs
+
 transitions = {  # Jira API uses these codes to identify status changes
     'To Do': 11,
     'In Progress': 21,
@@ -11,7 +11,8 @@ def get_access_params(mgmnt_sys: str) -> dict:
     """
     Get authorization parameters.
 
-    :parameter mgmnt_sys: string to indicate the management systems, either 'zen', 'zenhub', 'jira', or 'atlassian'
+    :parameter mgmnt_sys: string to indicate the management systems, either 'zen', 'zenhub', 'jira', or 'atlassian', or
+                          'webhook' for the secret that webhooks sent to the daemon are verified with
     :return: dict containing management system URL and API token to authenticate
     """
 
@@ -30,6 +31,9 @@ def get_access_params(mgmnt_sys: str) -> dict:
         options = {'server': urls['github_api']}
         path_to_token = token_path['api_token_github']
         # logging.info('Accessing GitHub')
+    elif mgmnt_sys == 'webhook':
+        options = {}
+        path_to_token = token_path['webhook_secret']
     else:
         raise ValueError(f'{mgmnt_sys} not a valid input.')
 
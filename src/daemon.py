@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+from collections import deque
+import hashlib
+import hmac
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from settings import webhook_debounce, webhook_max_delay
+from src.jira import JiraRepo
+from src.state import SnapshotStore, WriteLog
+from src.sync import Sync
+from src.zenhub import ZenHubIssue, ZenHubRepo
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookDaemon:
+
+    def __init__(self, commands: list, secret: str, debounce: float = webhook_debounce):
+        """
+        Keep pairs of repos in sync by syncing each issue pair as soon as a webhook reports a change to either issue.
+        GitHub issue webhooks, Jira issue webhooks and ZenHub webhooks are accepted, at the paths /github, /jira and
+        /zenhub. Webhooks are received in threads of their own and synced one after another by a single worker thread.
+        :param commands: argparse Namespace objects holding the parsed arguments of each repo pair, e.g. the commands of
+                         a config file. Only the repos and the sync direction of each are used.
+        :param secret: Shared secret that webhooks are verified with. GitHub signs its payloads with it; Jira and ZenHub
+                       don't sign theirs, so their webhook URLs must end in ?secret=<secret>.
+        :param debounce: Optional. Seconds to wait for an issue pair to stop changing before syncing it; see
+                         DebounceQueue
+        """
+        if not secret:  # Anyone could make the daemon sync, and use up the rate limits
+            raise ValueError('A webhook secret is needed to verify webhooks; see token_path in settings.py')
+        self.commands = commands
+        self.secret = secret
+        self.repos = dict()  # JiraRepo and ZenHubRepo of each command by position, loaded without issues when needed
+        self.events = DebounceQueue(debounce)  # (command, side, key) of each issue that changed, by issue pair
+        self.pairs = dict()  # Key of each synced issue pair by the (command number, side, key) of its Jira issue
+        self.writes = dict()  # WriteLog of each mirror sync command by position, so its own writes aren't synced back
+        self.snapshots = dict()  # SnapshotStore of each mirror sync command by position, to merge changes against
+
+    def receive(self, source: str, headers: dict, body: bytes, query: str = '') -> int:
+        """
+        Handle a webhook: verify it, find the issue pairs it is about and queue them to be synced
+        :param source: 'github', 'jira' or 'zenhub', from the path the webhook was sent to
+        :param headers: The HTTP headers of the request
+        :param body: The payload
+        :param query: The query string of the URL the webhook was sent to
+        :return: The HTTP status code to answer with
+        """
+        if source not in ('github', 'jira', 'zenhub'):
+            return 404
+        if not self.verify(source, headers, body, query):
+            logger.warning(f'Rejecting a {source} webhook that could not be verified')
+            return 401
+        try:
+            events = self.parse(source, headers, body)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Rejecting a {source} webhook that could not be read: {repr(e)}')
+            return 400
+
+        for event in events:
+            self.events.put(self.pair(*event), event)
+        logger.info(f'Received a {source} webhook about {len(events)} synchronized issues')
+        return 202 if events else 200
+
+    def pair(self, command: 'Namespace', side: str, key: str) -> tuple:
+        """
+        Return the key of the issue pair an issue belongs to, so that changes to either issue of a pair are coalesced.
+        Pairs are known once they have been synced; until then, each issue is its own pair.
+        """
+        issue = (self.commands.index(command), side, key)
+        return self.pairs.get(issue, issue)
+
+    def verify(self, source: str, headers: dict, body: bytes, query: str) -> bool:
+        """Return whether a webhook was sent by someone who knows the shared secret"""
+
+        if source == 'github':
+            signature = 'sha256=' + hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+            return hmac.compare_digest(signature, headers.get('X-Hub-Signature-256', ''))
+        return hmac.compare_digest(self.secret, parse_qs(query).get('secret', [''])[0])
+
+    def parse(self, source: str, headers: dict, body: bytes) -> list:
+        """
+        Find the issues a webhook is about in the repo pairs being synced
+        :return: (command, side, key) of each, where side is 'jira' or 'zenhub'
+        """
+        if source == 'github':
+            if headers.get('X-GitHub-Event') != 'issues':  # e.g. the 'ping' sent when the webhook is set up
+                return []
+            payload = json.loads(body)
+            zenhub, key = payload['repository']['full_name'], str(payload['issue']['number'])
+            return [(command, 'zenhub', key) for command in self.commands if command.zenhub == zenhub]
+
+        if source == 'zenhub':  # ZenHub sends form fields rather than JSON
+            payload = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            zenhub, key = f"{payload['organization']}/{payload['repo']}", payload['issue_number']
+            return [(command, 'zenhub', key) for command in self.commands if command.zenhub == zenhub]
+
+        payload = json.loads(body)
+        issue = payload['issue']
+        org = urlsplit(issue['self']).hostname.split('.')[0]  # e.g. ucsc-cgl in https://ucsc-cgl.atlassian.net/...
+        jira = f"{org}/{issue['fields']['project']['key']}"
+        return [(command, 'jira', issue['key']) for command in self.commands if command.jira == jira]
+
+    def sync(self, command: 'Namespace', side: str, key: str) -> dict or None:
+        """
+        Retrieve an issue that changed and its counterpart again and sync the pair in the command's direction
+        :param command: argparse Namespace object holding the parsed arguments of the repo pair
+        :param side: 'jira' or 'zenhub', the side of the issue that changed
+        :param key: Key of the issue that changed
+        :return: dict with the number of issue pairs that were processed and skipped and the keys of those that failed,
+                 as returned by Sync, or None if the issue has no counterpart
+        """
+        jira_repo, zenhub_repo = self._repos(command)
+        jira_key, github_key = (key, None) if side == 'jira' else (None, key)
+        if side == 'jira':
+            jira_repo.issues.pop(key, None)
+            jira_repo.get_issues([key])
+            if key in jira_repo.issues:
+                github_key = jira_repo.issues[key].github_key
+
+        if github_key:
+            zenhub_repo.issues.pop(github_key, None)
+            zenhub_repo.github_equivalent.issues.pop(github_key, None)  # So that the GitHub side is retrieved again
+            zenhub_repo.issues[github_key] = ZenHubIssue(repo=zenhub_repo, key=github_key)
+
+        if side == 'zenhub' and zenhub_repo.issues[key].jira_key:
+            jira_key = zenhub_repo.issues[key].jira_key
+            jira_repo.issues.pop(jira_key, None)
+            jira_repo.get_issues([jira_key])
+
+        if jira_key not in jira_repo.issues or github_key not in zenhub_repo.issues:
+            logger.warning(f'Skipping {side} issue {key} of {command.jira} {command.zenhub}: no counterpart found')
+            return None
+
+        pair = (self.commands.index(command), 'zenhub', github_key)
+        self.pairs[(pair[0], 'jira', jira_key)] = pair  # Later changes to either issue are coalesced
+        jira_view, zenhub_view = jira_repo.view([jira_key]), zenhub_repo.view([github_key])
+        if command.j:
+            return Sync.sync_board(source=jira_view, dest=zenhub_view)
+        elif command.z:
+            return Sync.sync_board(source=zenhub_view, dest=jira_view)
+        if pair[0] not in self.writes:
+            self.writes[pair[0]] = WriteLog(pair=f'{command.jira} {command.zenhub}')
+            self.snapshots[pair[0]] = SnapshotStore(pair=f'{command.jira} {command.zenhub}')
+        return Sync.mirror_sync(jira_repo=jira_view, zenhub_repo=zenhub_view, writes=self.writes[pair[0]],
+                                snapshots=self.snapshots[pair[0]])
+
+    def _repos(self, command: 'Namespace') -> tuple:
+        """Return the JiraRepo and ZenHubRepo of a command, made without any issues the first time"""
+
+        number = self.commands.index(command)
+        if number not in self.repos:
+            j_org_name, j_repo_name = command.jira.split('/')
+            z_org_name, z_repo_name = command.zenhub.split('/')
+            self.repos[number] = (JiraRepo(j_repo_name, j_org_name, empty=True),
+                                  ZenHubRepo(z_repo_name, z_org_name, issues=[]))
+        return self.repos[number]
+
+    def work(self):
+        """Sync the queued issue pairs one after another, forever"""
+
+        while True:
+            task = self.events.get()
+            command, side, key = task['item']
+            try:
+                counts = self.sync(command, side, key)
+                if counts:
+                    logger.info(f"Synced {side} issue {key} of {command.jira} {command.zenhub} after "
+                                f"{task['events']} events: {counts['processed']} processed, "
+                                f"{len(counts['failed'])} failed")
+            except Exception:  # One issue failing shouldn't stop the daemon
+                logger.exception(f'Failed to sync {side} issue {key} of {command.jira} {command.zenhub}')
+            finally:
+                self.events.done(task)
+                logger.debug(f'Webhook queue: {self.events.stats()}')
+
+    def server(self, host: str, port: int) -> 'HTTPServer':
+        """Make an HTTP server that passes the webhooks it receives to this daemon. Port 0 picks a free port."""
+
+        server = _ThreadingHTTPServer((host, port), _WebhookHandler)
+        server.webhooks = self
+        return server
+
+    def serve(self, host: str, port: int):
+        """Receive webhooks on the given address and sync the issue pairs they are about, until interrupted"""
+
+        threading.Thread(target=self.work, name='webhook-worker', daemon=True).start()
+        with self.server(host, port) as server:
+            logger.info(f'Listening for webhooks on {host}:{server.server_address[1]}')
+            server.serve_forever()
+
+
+class DebounceQueue:
+
+    def __init__(self, window: float = webhook_debounce, max_delay: float = webhook_max_delay):
+        """
+        A queue of tasks that waits for events about the same thing to stop coming before handing out a task for them.
+        A sprint planning session changes the status, estimate, sprint and epic of an issue one after another, and each
+        change sends webhooks from more than one system, so the events about an issue pair are merged into one sync.
+        :param window: Seconds without a new event after which a task is handed out
+        :param max_delay: Seconds after its first event after which a task is handed out even if events keep coming
+        """
+        self.window = window
+        self.max_delay = max_delay
+        self.pending = dict()  # Tasks that are waiting, by key, in the order of their first event
+        self.condition = threading.Condition()
+        self.received = 0  # Number of events put in the queue
+        self.handed_out = 0  # Number of tasks taken out of the queue
+        self.merged = 0  # Number of events merged into the tasks taken out of the queue
+        self.latencies = deque(maxlen=1000)  # Seconds from the first event of each task until it was done
+
+    def put(self, key, item):
+        """
+        Add an event. If a task for the key is already waiting, the event is merged into it, and the task keeps the item
+        of its first event.
+        :param key: What the event is about, e.g. an issue pair
+        :param item: What the task is given, e.g. the issue that changed
+        """
+        now = time.monotonic()
+        with self.condition:
+            self.received += 1
+            task = self.pending.setdefault(key, {'item': item, 'first': now, 'events': 0})
+            task['last'] = now
+            task['events'] += 1
+            self.condition.notify()
+
+    def get(self) -> dict:
+        """
+        Wait for a task that is due and take it out of the queue
+        :return: dict with the 'item' of the task's first event and the number of 'events' merged into it, to be
+                 passed to done() once the task is done
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                due = {key: min(task['last'] + self.window, task['first'] + self.max_delay)
+                       for key, task in self.pending.items()}
+                ready = [key for key, at in due.items() if at <= now]
+                if ready:
+                    task = self.pending.pop(ready[0])
+                    self.handed_out += 1
+                    self.merged += task['events']
+                    return task
+                self.condition.wait(min(due.values()) - now if due else None)
+
+    def done(self, task: dict):
+        """Record how long after its first event a task was done"""
+
+        with self.condition:
+            self.latencies.append(time.monotonic() - task['first'])
+
+    def stats(self) -> dict:
+        """
+        Return the number of tasks waiting, the number of events and tasks so far, the number of events merged into each
+        task that was handed out, and the mean and longest seconds from the first event of a task until it was done
+        """
+        with self.condition:
+            return {'depth': len(self.pending), 'events': self.received, 'tasks': self.handed_out,
+                    'coalescing_ratio': self.merged / self.handed_out if self.handed_out else None,
+                    'mean_latency': sum(self.latencies) / len(self.latencies) if self.latencies else None,
+                    'max_latency': max(self.latencies, default=None)}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server that handles each request in a thread of its own, as http.server.ThreadingHTTPServer does"""
+
+    daemon_threads = True
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Passes each POST request to the WebhookDaemon of the server, and answers GET /stats with its queue's stats"""
+
+    def do_GET(self):
+        if urlsplit(self.path).path.strip('/') != 'stats':
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.webhooks.events.stats()).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status = self.server.webhooks.receive(url.path.strip('/'), self.headers, body, url.query)
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, format: str, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
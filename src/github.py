@@ -1,23 +1,28 @@
 import datetime
 import logging
 import pytz
-import re
 import requests
 
+from settings import github_page_size, urls
 from src.access import get_access_params
 from src.issue import Issue, Repo
+from src.links import parse_links
+from src.timestamps import parse_utc_timestamp
 
 logger = logging.getLogger(__name__)
 
 
 class GitHubRepo(Repo):
 
-    def __init__(self, repo_name: str = None, org: str = None, issues: list = None):
+    def __init__(self, repo_name: str = None, org: str = None, issues: list = None,
+                 updated_since: datetime.datetime = None, per_page: int = github_page_size):
         """
         Create a GitHub Repo object from a repo name and organization
         :param repo_name: Name of the repo in GitHub
         :param org: Organization this repo belongs to in GitHub
         :param issues: Optional. If specified, only retrieve information for this set of issues
+        :param updated_since: Optional. If specified, only retrieve issues that were updated at or after this time
+        :param per_page: Optional. Number of issues to get per request when listing all issues in the repo
         """
 
         super().__init__()
@@ -26,18 +31,84 @@ class GitHubRepo(Repo):
 
         self.name = repo_name
         self.org = org
+        self.use_graphql = True  # Set to False if the GraphQL API turns out to be unavailable
 
         if issues is not None:  # Get certain specified issues
-            for i in issues:
-                self.issues[i] = GitHubIssue(repo=self, key=i)
+            self.get_issues(issues)
         else:  # Get all issues in the repo_name
-            content = self.api_call(requests.get, url_head='https://api.github.com/',
-                                    url_tail=f'search/issues?q=repo:{self.org}/{self.name}&page=', page=1)
-
-            for issue_dict in content['items']:
+            # The issues listing is used rather than the search API, which returns at most 1000 results and has a
+            # lower rate limit
+            if updated_since:
+                updated_filter = '&since=' + updated_since.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            else:
+                updated_filter = ''
+            with self.checkpointed(f'github {self.org}/{self.name}'):
+                content = self.api_call(requests.get, f'{self.name}/issues?state=all&per_page={per_page}'
+                                                      f'{updated_filter}&page=', page=1)
+
+            for issue_dict in content:
+                if 'pull_request' in issue_dict:  # GitHub lists pull requests as issues too
+                    continue
                 self.issues[str(issue_dict['number'])] = GitHubIssue(key=issue_dict['number'], repo=self,
                                                                      content=issue_dict)
 
+    def get_issues(self, keys: list):
+        """
+        Retrieve the given issues and add them to this repo. Issues are fetched 100 at a time through the GraphQL API
+        if it is available, otherwise one at a time through the REST API. Issues already in this repo are skipped, and
+        issues that aren't found are logged and left out.
+        :param keys: Numbers of the issues to retrieve
+        """
+        keys = [k for k in keys if k not in self.issues]
+        # Issue numbers are integers; anything else can only be looked up (and reported as not found) through REST
+        numbers = [k for k in keys if str(k).isdigit()]
+
+        for i in range(0, len(numbers) if self.use_graphql else 0, 100):
+            contents = self._get_issues_graphql(numbers[i:i + 100])
+            if contents is None:  # GraphQL is unavailable, e.g. because of the token's permissions
+                self.use_graphql = False
+                break
+            for key, content in contents.items():
+                self.issues[key] = GitHubIssue(key=key, repo=self, content=content)
+
+        for key in keys:
+            if key not in self.issues:
+                try:
+                    self.issues[key] = GitHubIssue(key=key, repo=self)
+                except ValueError as e:  # One missing issue shouldn't stop the rest from being retrieved
+                    logger.warning(f'Cannot get information for issue {key}: {e}')
+
+    def _get_issues_graphql(self, numbers: list) -> dict or None:
+        """
+        Get the fields of up to 100 issues that are used for synchronization in one GraphQL query, which aliases one
+        issue lookup per number. Return them in the format of the REST API, keyed by issue number, or None if the
+        GraphQL API can't be used. Numbers that don't match an issue, e.g. pull requests, are left out.
+        :param numbers: Numbers of the issues to get
+        """
+        lookups = ' '.join(f'i{n}: issue(number: {int(n)}) {{ ...fields }}' for n in numbers)
+        query = (f'query {{ repository(owner: "{self.org}", name: "{self.name}") {{ {lookups} }} }} '
+                 'fragment fields on Issue { number title body updatedAt milestone { title number } '
+                 'assignees(first: 10) { nodes { login } } }')
+        try:
+            content = self.api_call(requests.post, url_head=urls['github_graphql'], url_tail='',
+                                    json={'query': query}, json_response=True)
+        except requests.RequestException as e:
+            logger.warning(f'GraphQL request failed, using the REST API instead: {repr(e)}')
+            return None
+
+        if not content or not content.get('data') or not content['data'].get('repository'):
+            logger.warning(f'GraphQL API unavailable, using the REST API instead: {content}')
+            return None
+
+        issues = dict()
+        for n in numbers:
+            node = content['data']['repository'].get(f'i{n}')
+            if node:
+                issues[n] = {'number': node['number'], 'title': node['title'], 'body': node['body'],
+                             'updated_at': node['updatedAt'], 'milestone': node['milestone'],
+                             'assignees': node['assignees']['nodes'], 'assignee': None}
+        return issues
+
 
 class GitHubIssue(Issue):
 
@@ -63,12 +134,11 @@ class GitHubIssue(Issue):
         self.summary = content['title']
         self.jira_key = self.get_jira_equivalent()
 
-        # Get datetime objects from timestamp strings and adjust for time zone
-        default_tz = pytz.timezone('UTC')  # GitHub timestamps are all in UTC time
-        self.created = default_tz.localize(datetime.datetime.strptime(content['created_at'].split('Z')[0],
-                                                                      '%Y-%m-%dT%H:%M:%S'))
-        self.updated = default_tz.localize(datetime.datetime.strptime(content['updated_at'].split('Z')[0],
-                                                                      '%Y-%m-%dT%H:%M:%S'))
+        # Get datetime objects from timestamp strings, which GitHub gives in UTC time
+        self.created = None
+        if 'created_at' in content:  # Issues retrieved through GraphQL don't include this
+            self.created = parse_utc_timestamp(content['created_at'])
+        self.updated = parse_utc_timestamp(content['updated_at'])
 
         if content['milestone']:
             self.milestone_name = content['milestone']['title']
@@ -88,10 +158,10 @@ class GitHubIssue(Issue):
         """Find the equivalent Jira issue key if it is listed in the issue text. Issues synced by unito-bot will have
         this information."""
 
-        match_obj = re.search(r'Issue Number: ([\w-]+)', self.description)  # search in the issue description
+        jira_key = parse_links(self.description).jira_key
 
-        if match_obj:
-            return match_obj.group(1)
+        if jira_key:
+            return jira_key
         else:
             logging.warning(f'No Jira key was found in the description of issue {self.github_key}')
             return ''
@@ -99,29 +169,34 @@ class GitHubIssue(Issue):
     def open(self):
         """Set this issue's state to open"""
 
-        self.repo.api_call(requests.patch, f'{self.repo.name}/issues/{self.github_key}', json={"state": "open"})
+        self.write('issue', {"state": "open"})
 
     def add_to_milestone(self, milestone_id):
         """
-        Add this issue to a milestone.
+        Add this issue to a milestone, replacing any milestone it is already in.
         :param milestone_id: ZenHub/GitHub ID of milestone to add to
         """
         logger.debug(f'Adding issue {self.github_key} to milestone {milestone_id}')
-        self.repo.api_call(requests.patch, f'{self.repo.name}/issues/{self.github_key}',
-                           json={"milestone": milestone_id})
+        self.write('issue', {"milestone": milestone_id})
 
     def remove_from_milestone(self):
         """Remove this issue from any milestone it may be in."""
 
         logger.debug(f'Removing issue {self.github_key} from milestone')
-        self.repo.api_call(requests.patch, f'{self.repo.name}/issues/{self.github_key}', json={"milestone": None})
+        self.write('issue', {"milestone": None})
+
+    def send_writes(self, writes: dict):
+        """Update the remote issue's state and milestone in one request"""
+
+        self.repo.api_call(requests.patch, f'{self.repo.name}/issues/{self.github_key}', json=writes['issue'])
 
     def get_milestone_id(self, milestone_name: str) -> int or None:
         """
-        Look up the ID for a milestone given its name
+        Look up the ID for a milestone given its name. The repo's milestones are remembered for the rest of the run.
         :param milestone_name: Name of milestone to search for
         """
-        content = self.repo.api_call(requests.get, f'{self.repo.name}/milestones')
+        content = self.repo.lookup(('milestones',),
+                                   lambda: self.repo.api_call(requests.get, f'{self.repo.name}/milestones'))
         for milestone in content:
             if milestone['title'] == milestone_name:
                 return milestone['number']
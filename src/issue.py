@@ -1,7 +1,13 @@
 #! /usr/bin/env python3
 
+from contextlib import contextmanager
+import copy
 import logging
 import requests
+import threading
+
+from src import ratelimit
+from src.state import Checkpoint
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +27,14 @@ class Issue:
         self.story_points = None  # int
         self.summary = None  # str
         self.updated = None  # datetime object
+        self.field_updated = dict()  # datetime each synchronized field was last modified at, where it is known
 
         self.sprint_name = None  # str, when synchronized this should be the same in Jira and ZenHub
         self.sprint_id = None  # str, unique to Jira
         self.milestone_name = None  # str
         self.milestone_id = None  # int, unique to GitHub/ZenHub
         self.repo = None  # Repo object, the repo in which this issue lives
+        self.pending_writes = None  # dict of writes held back by batch_writes, keyed by resource
 
     def update_from(self, source: 'Issue'):
         """
@@ -36,13 +44,74 @@ class Issue:
         """
 
         # Headers, url, and token are specific to the issue being in Jira or ZenHub.
-        self.__dict__.update({k: v for k, v in source.__dict__.items() if v and k not in ['repo', 'description']})
+        self.__dict__.update({k: v for k, v in source.__dict__.items()
+                              if v and k not in ['repo', 'description', 'pending_writes', 'field_updated',
+                                                 'remote_status']})
 
         # The ZenHub story point value cannot be set to None. If it's being updated from a Jira issue with no story
         # point value, set the story points to 0.
         if source.__class__.__name__ == 'JiraIssue' and source.story_points is None:
             self.story_points = 0
 
+    @contextmanager
+    def batch_writes(self):
+        """
+        Hold back writes to this issue made inside a with block and send them when it ends, merging writes to the same
+        resource into one request. Writes made outside a with block are sent right away. If the block raises an
+        exception, the writes that are still held back are dropped.
+        """
+        self.pending_writes = {}
+        try:
+            yield self
+            self.flush_writes()
+        finally:
+            self.pending_writes = None
+
+    def write(self, resource: str, fields: dict):
+        """
+        Write fields of this issue, or hold them back if inside batch_writes
+        :param resource: Names the request the fields are written by, e.g. 'issue'. Fields written to the same resource
+                         are merged, later values replacing earlier ones.
+        :param fields: The fields to write
+        """
+        if self.pending_writes is None:
+            self.send_writes({resource: fields})
+        else:
+            self.pending_writes.setdefault(resource, {}).update(fields)
+
+    def flush_writes(self):
+        """Send the writes held back so far, e.g. because a following request depends on them"""
+
+        if self.pending_writes:
+            writes = self.pending_writes
+            self.pending_writes = {}
+            self.send_writes(writes)
+
+    def send_writes(self, writes: dict):
+        """
+        Make the requests for the given writes. Subclasses that call write() implement this.
+        :param writes: Fields keyed by resource, as passed to write()
+        """
+        raise NotImplementedError(f'{self.__class__.__name__} has no writable resources')
+
+    def sync_fields(self) -> dict:
+        """
+        Return the fields of this issue that are synchronized, e.g. to tell whether the issue has changed. Values are
+        normalized the way they are compared between Jira and ZenHub: only whether an issue is an epic is synced, not
+        its exact type, and story points may come back from Jira as a float.
+        """
+        return {'epic': self.issue_type == 'Epic', 'status': self.status, 'pipeline': self.pipeline,
+                'story_points': None if self.story_points is None else float(self.story_points),
+                'sprint_name': self.sprint_name, 'milestone_name': self.milestone_name}
+
+    def modified(self, field: str) -> 'datetime.datetime':
+        """
+        Return when a synchronized field of this issue was last modified, or when the issue was last updated if that
+        isn't known
+        :param field: A field of sync_fields() that this issue holds in its own management system, e.g. 'status'
+        """
+        return self.field_updated.get(field, self.updated)
+
     def print(self):
         """Print out all fields for this issue. For testing purposes"""
         for attribute, value in self.__dict__.items():
@@ -59,9 +128,64 @@ class Repo:
         self.url = None
         self.headers = None
         self.id = None
+        self.lookups = dict()  # Answers to lookups that don't change during a run, e.g. sprint IDs by name
+        self.lookups_lock = threading.Lock()
+        self.plan = None  # Plan that changes to issues are added to instead of being made, if only planning
+        self.checkpoint = None  # Checkpoint of the responses to GET requests, while the repo is being loaded
+
+    def view(self, keys: list = None) -> 'Repo':
+        """
+        Return a copy of this repo that shares its connection details, lookups and Issue objects but holds only some of
+        its issues. This lets a repo that was loaded once be synced by several commands that each need part of it.
+        :param keys: Optional. Keys of the issues to include. Keys this repo doesn't hold are left out. If not given,
+                     include all issues.
+        """
+        view = copy.copy(self)
+        view.issues = dict(self.issues) if keys is None else {k: self.issues[k] for k in keys if k in self.issues}
+        return view
+
+    @contextmanager
+    def checkpointed(self, name: str):
+        """
+        Checkpoint the responses to GET requests made inside a with block, reusing any that an interrupted run
+        checkpointed; see Checkpoint. The checkpoint is removed when the block finishes, and kept if it raises.
+        :param name: Name of the repo being loaded, e.g. 'jira ucsc-cgl/TEST'
+        """
+        self.checkpoint = Checkpoint.open(name)
+        try:
+            yield
+            if self.checkpoint:
+                self.checkpoint.clear()
+        finally:
+            self.checkpoint = None
+
+    def planned(self, kind: str, key: str, value=None) -> bool:
+        """
+        If this repo is being planned rather than synced, add a change to an issue to the plan instead of making it
+        :param kind: The kind of change, e.g. 'transition'; see src.plan.PHASES
+        :param key: Key of the issue
+        :param value: The new value
+        :return: Whether the change was planned, in which case the caller doesn't make it
+        """
+        if self.plan is None:
+            return False
+        self.plan.add(self, kind, key, value)
+        return True
+
+    def lookup(self, key: tuple, get):
+        """
+        Return the answer to a lookup, calling get() only the first time it is asked for during this run. Issue pairs
+        may be synced in several threads at once, so the lock keeps two threads from making the same request.
+        :param key: Identifies the lookup, e.g. ('sprint', 'Sprint 3')
+        :param get: Function that makes the lookup
+        """
+        with self.lookups_lock:
+            if key not in self.lookups:
+                self.lookups[key] = get()
+            return self.lookups[key]
 
     def api_call(self, action, url_tail: str, url_head: str = None, json: dict = None, page: int = '',
-                 success_code: int = 200) -> dict:
+                 success_code: int = 200, json_response: bool = False) -> dict:
         """
         Method to handle all API calls
         :param action: A requests method to call, e.g. requests.get or requests.post
@@ -69,30 +193,45 @@ class Repo:
         :param url_head: Defaults to self.repo.url, e.g. 'https://api.zenhub.io/p1/repositories/'. Can be set to
                          another value, like for using the old API version.
         :param json: The dictionary-formatted payload to send with the request.
-        :param page: For paginated responses, the page/response number upon which to make the next call. This should
-                     always be called with either 0 or 1 depending on the API being used. It will then make recursive
-                     calls incrementing the page number each time until there are no more pages.
+        :param page: For paginated GitHub responses, the number of the first page, i.e. 1. Further calls are then made,
+                     incrementing the page number each time, until there are no more pages. They are followed in a loop
+                     rather than recursively, since a large repo can have more pages than the recursion limit allows.
+                     Jira pages are requested one at a time by JiraRepo.
         :param success_code: The HTTP response code that should be returned on success. Defaults to 200; may need to be
                              set to 204 for some cases.
+        :param json_response: Decode the response content of a request that isn't a GET, e.g. a GraphQL query
         """
 
+        checkpoint_key = None
+        if self.checkpoint and action == requests.get:  # Reuse the response an interrupted run got while loading
+            checkpoint_key = f'{url_head or self.url}{url_tail}{page}'
+            content = self.checkpoint.get(checkpoint_key)
+            if content is not None:
+                return content
+
+        ratelimit.take(f'{url_head or self.url}{url_tail}')
         response = action(f'{url_head or self.url}{url_tail}{page}', headers=self.headers, json=json)
 
         if response.status_code == success_code:
-            if action == requests.get:
+            if action == requests.get or json_response:
                 content = response.json()
             else:
                 content = {}  # Some other requests return blank json content and decoding them causes an error
 
-            if page:  # Need to check if there is another page of results to get
-                if 'total' and 'maxResults' in content.keys():  # For Jira
-                    if content['total'] >= page + content['maxResults']:  # There could be another page of results
-                        content.update(self.api_call(action, url_tail, url_head=url_head, json=json,
-                                                     page=page + content['maxResults'], success_code=success_code))
-
-                elif 'rel="next"' in response.headers['Link']:  # For GitHub, update the 'items' list with the next page
-                    content['items'].extend(self.api_call(action, url_tail, url_head=url_head, json=json, page=page + 1,
-                                                          success_code=success_code)['items'])
+            if page:  # For GitHub, add on the following pages of results one at a time
+                while 'rel="next"' in response.headers.get('Link', ''):
+                    page += 1
+                    ratelimit.take(f'{url_head or self.url}{url_tail}')
+                    response = action(f'{url_head or self.url}{url_tail}{page}', headers=self.headers, json=json)
+                    if response.status_code != success_code:
+                        raise RuntimeError(f'Failed to get page {page} of {url_tail}: {response.status_code}')
+                    if isinstance(content, list):  # Listings are a list of items
+                        content.extend(response.json())
+                    else:  # Search results hold their list in 'items'
+                        content['items'].extend(response.json()['items'])
+
+            if checkpoint_key:
+                self.checkpoint.put(checkpoint_key, content)
             return content
 
         elif response.json():  # we don't want to raise an error, but deal with it locally
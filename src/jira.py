@@ -1,13 +1,17 @@
+from collections import defaultdict, deque
 import datetime
 import logging
 from more_itertools import first
 import re
 import requests
+import threading
 from tqdm import tqdm
 
 from settings import transitions
 from src.access import get_access_params
 from src.issue import Repo, Issue
+from src.links import parse_links
+from src.timestamps import parse_jira_timestamp
 from src.utilities import CustomFieldNames, get_zenhub_pipeline
 
 logger = logging.getLogger(__name__)
@@ -15,13 +19,15 @@ logger = logging.getLogger(__name__)
 
 class JiraRepo(Repo):
 
-    def __init__(self, repo_name: str, jira_org: str, jql: str = None, empty: bool = False):
+    def __init__(self, repo_name: str, jira_org: str, jql: str = None, empty: bool = False,
+                 updated_since: datetime.datetime = None):
         """Create a Project storing all issues belonging to the provided project key
         :param repo_name: Required. The repo to work with e.g. TEST
         :param jira_org: Required. The organization the repo belongs to, e.g. ucsc-cgl
         :param jql: Optional. If not specified, all issues in the repo will be retrieved. If specified, only will
         retrieve issues that match this Jira Query Language filter
         :param empty: Optional. If true, initialize this repo without any issues
+        :param updated_since: Optional. If specified, only retrieve issues that were updated at or after this time
         """
 
         super().__init__()
@@ -31,6 +37,10 @@ class JiraRepo(Repo):
 
         self.name = repo_name
         self.org = jira_org
+        self.sprint_assignments = defaultdict(list)  # Keys of issues waiting to be added to each sprint, by sprint ID
+        self.failed_sprint_assignments = []  # Keys of issues that couldn't be added to their sprint
+        self.sprint_assignments_lock = threading.Lock()
+        self.transition_fields = True  # Whether fields can be set along with a transition, until Jira refuses it
 
         if empty:
             return
@@ -40,11 +50,171 @@ class JiraRepo(Repo):
         else:
             jql_filter = ''  # otherwise do not filter
 
-        # By default, get all issues
-        content = self.api_call(requests.get, f'search?jql=project={self.name}{jql_filter}&startAt=', page=0)
-        for issue in tqdm(content['issues'], desc='getting Jira issues'):  # progress bar
+        if updated_since:
+            jql_filter += self._updated_filter(updated_since)
+
+        self._get_project_issues(jql_filter)  # By default, get all issues
+
+    def get_updated_issues(self, since: datetime.datetime):
+        """
+        Retrieve the issues of this project that were updated at or after the given time and add them to this repo, e.g.
+        to refresh a repo that is kept between polls
+        """
+        self._get_project_issues(self._updated_filter(since))
+
+    def _get_project_issues(self, jql_filter: str):
+        """
+        Retrieve the issues of this project that match a filter and add them to this repo
+        :param jql_filter: JQL to add to the project filter, starting with ' AND ', or '' for all issues
+        """
+        with self.checkpointed(f'jira {self.org}/{self.name}'):
+            issues = self._search(f'project={self.name}{jql_filter}')
+        if issues is None:
+            raise RuntimeError(f'Failed to search for the issues of Jira project {self.name}')
+        for issue in tqdm(issues, desc='getting Jira issues'):  # progress bar
             self.issues[issue['key']] = JiraIssue(content=issue, repo=self)
 
+    @staticmethod
+    def _updated_filter(since: datetime.datetime) -> str:
+        """Return a JQL filter for issues updated at or after the given time, to add to the project filter"""
+
+        # JQL interprets absolute dates in the timezone of the user's profile, so use a relative time instead.
+        # Round up to whole minutes so no issue updated at the boundary is missed.
+        elapsed = datetime.datetime.now(datetime.timezone.utc) - since
+        return f' AND updated >= -{int(elapsed.total_seconds() // 60) + 1}m'
+
+    def _search(self, jql: str) -> list or None:
+        """
+        Return all issues that match a JQL query, requesting one page of results after another. The changelog of each
+        issue is included, so that it is known when each field was last modified.
+        :param jql: The query, e.g. 'project=TEST'
+        :return: The issues as returned by the API, or None if the query was rejected
+        """
+        issues, start = [], 0
+        while True:
+            content = self.api_call(requests.get, f'search?jql={jql}&expand=changelog&startAt={start}')
+            if 'issues' not in content:
+                return None
+            issues.extend(content['issues'])
+            start += content['maxResults']
+            if not content['issues'] or start >= content['total']:
+                return issues
+
+    def get_issues(self, keys: list):
+        """
+        Retrieve the given issues and add them to this repo, searching for up to 50 keys per request
+        :param keys: Jira keys of the issues to retrieve, e.g. ['TEST-1', 'TEST-2']
+        """
+        keys = [k for k in keys if k]
+        for i in range(0, len(keys), 50):  # Keep the request URL short
+            issues = self._search(f'key in ({",".join(keys[i:i + 50])})')
+            if issues is None:  # One of the keys doesn't exist, so the whole search was rejected
+                for key in keys[i:i + 50]:  # Get the issues one at a time instead
+                    try:
+                        self.issues[key] = JiraIssue(repo=self, key=key)
+                    except ValueError as e:
+                        logger.warning(f'Cannot get information for issue {key}: {e}')
+                continue
+            for issue in issues:
+                self.issues[issue['key']] = JiraIssue(content=issue, repo=self)
+
+    def add_to_sprint_later(self, sprint_id: int, key: str):
+        """
+        Hold back adding an issue to a sprint, so that issues going to the same sprint can be added together. Once 50
+        issues are waiting for a sprint, the most the API accepts in one request, they are added right away. Call
+        flush_sprint_assignments to add the rest.
+        :param sprint_id: Jira ID of the sprint to add the issue to
+        :param key: Key of the issue
+        """
+        with self.sprint_assignments_lock:
+            waiting = self.sprint_assignments[sprint_id]
+            waiting.append(key)
+            if len(waiting) < 50:
+                return
+            del self.sprint_assignments[sprint_id]
+        self._add_to_sprint(sprint_id, waiting)
+
+    def flush_sprint_assignments(self, keys=None) -> list:
+        """
+        Add all issues that are waiting to be added to a sprint. Views of this repo share the issues that are waiting.
+        :param keys: Optional. Only report failures for these issue keys, and keep the others for whoever flushes them
+        :return: Keys of the issues that couldn't be added to their sprint since the last flush
+        """
+        with self.sprint_assignments_lock:
+            waiting = dict(self.sprint_assignments)
+            self.sprint_assignments.clear()
+        for sprint_id, waiting_keys in waiting.items():
+            self._add_to_sprint(sprint_id, waiting_keys)
+
+        with self.sprint_assignments_lock:
+            failed = [key for key in self.failed_sprint_assignments if keys is None or key in keys]
+            self.failed_sprint_assignments[:] = [key for key in self.failed_sprint_assignments if key not in failed]
+        return failed
+
+    def _add_to_sprint(self, sprint_id: int, keys: list):
+        """Add up to 50 issues to a sprint in one request, and remember the ones that couldn't be added"""
+
+        logger.debug(f'Adding Jira issues {keys} to sprint {sprint_id}')
+        if self._post_to_sprint(sprint_id, keys):
+            return
+
+        # One issue that can't be added fails the whole request, so add them one at a time to find out which it was
+        failed = keys if len(keys) == 1 else [key for key in keys if not self._post_to_sprint(sprint_id, [key])]
+        for key in failed:
+            logger.warning(f'Cannot add Jira issue {key} to sprint {sprint_id}')
+        with self.sprint_assignments_lock:
+            self.failed_sprint_assignments.extend(failed)
+
+    def get_transitions(self, issue: 'JiraIssue') -> dict or None:
+        """
+        Return the transitions Jira offers an issue in its current status. They are learned from the first issue that
+        needs them and remembered for the rest of the run for each workflow and status. Issues of the same type in a
+        project share a workflow.
+        :param issue: The issue to ask Jira about
+        :return: dict with the ID of the transition to each status, by status name, or None if Jira didn't list them
+        """
+        return self.lookup(('transitions', issue.issue_type, issue.remote_status),
+                           lambda: self._get_transitions(issue.jira_key))
+
+    def _get_transitions(self, key: str) -> dict or None:
+        content = self.api_call(requests.get, f'issue/{key}/transitions')
+        if not isinstance(content, dict) or 'transitions' not in content:
+            logger.debug(f'Cannot get the transitions of Jira issue {key}: {content}')
+            return None
+        return {transition['to']['name']: int(transition['id']) for transition in content['transitions']}
+
+    def transition_path(self, issue_type: str, status: str, target: str) -> list or None:
+        """
+        Find the shortest series of transitions between two statuses of a workflow, through the transitions learned so
+        far; see get_transitions. Workflows that don't allow every transition from every status then take as many steps
+        as they need.
+        :param issue_type: The issue type, which identifies the workflow in this project
+        :param status: The status to start from
+        :param target: The status to end in
+        :return: (transition ID, status it leads to) of each step, or None if no path is known
+        """
+        with self.lookups_lock:
+            graph = {key[2]: transitions for key, transitions in self.lookups.items()
+                     if key[:2] == ('transitions', issue_type) and transitions}
+        paths = {status: []}
+        queue = deque([status])
+        while queue:  # Breadth-first, so the first path found is a shortest one
+            current = queue.popleft()
+            for to, transition_id in graph.get(current, {}).items():
+                if to not in paths:
+                    paths[to] = paths[current] + [(transition_id, to)]
+                    if to == target:
+                        return paths[to]
+                    queue.append(to)
+        return None
+
+    def _post_to_sprint(self, sprint_id: int, keys: list) -> bool:
+        """Make the request that adds issues to a sprint, and return whether it succeeded"""
+
+        content = self.api_call(requests.post, f'sprint/{sprint_id}/issue', url_head=self.alt_url,
+                                json={'issues': keys}, success_code=204)
+        return content == {}  # Successful requests have no content, failed ones describe the error
+
 
 class JiraIssue(Issue):
 
@@ -61,7 +231,7 @@ class JiraIssue(Issue):
         self.repo = repo
 
         if key:
-            json = self.repo.api_call(requests.get, f'search?jql=id={key}')
+            json = self.repo.api_call(requests.get, f'search?jql=id={key}&expand=changelog')
 
             if 'issues' in json.keys():  # If the key doesn't match any issues, this will be an empty list
                 content = json['issues'][0]  # Get the one and only issue in the response
@@ -72,13 +242,13 @@ class JiraIssue(Issue):
         self.issue_type = content['fields']['issuetype']['name']
         self.jira_key = content['key']
         self.status = content['fields']['status']['name']
+        self.remote_status = self.status  # The status the issue is in in Jira, until it is transitioned
 
         self.summary = content['fields']['summary']
 
-        # Convert the timestamps into datetime objects and localize them to PST time
-        self.updated = datetime.datetime.strptime(content['fields']['updated'].split('.')[0],
-                                                  '%Y-%m-%dT%H:%M:%S').replace(
-            tzinfo=JiraIssue.get_utc_offset(content['fields']['updated']))
+        # Convert the timestamps into datetime objects with their UTC offset
+        self.updated = parse_jira_timestamp(content['fields']['updated'])
+        self.field_updated = self.get_field_updated(content)
 
         # Not all issue descriptions have the corresponding github issue listed in them
         # self.github_repo, self.github_key = self.get_github_equivalent() or (None, None)
@@ -104,17 +274,32 @@ class JiraIssue(Issue):
 
         self.pipeline = get_zenhub_pipeline(self)  # This must be done after sprint status is set
 
+    # The synchronized fields by the field ID they have in the changelog, or by their name in changelogs without IDs
+    changelog_fields = {'status': 'status', CustomFieldNames.story_points: 'story_points',
+                        'Story Points': 'story_points', CustomFieldNames.sprint: 'sprint_name', 'Sprint': 'sprint_name'}
+
     @staticmethod
-    def get_utc_offset(timestamp: str):
+    def get_field_updated(content: dict) -> dict:
         """
-        Return a timezone object representing the UTC offset found in the timestamp
-        :param timestamp: a string with a timestamp in the format (+/-)HHMM at the end
+        Find when each synchronized field was last modified, from the changelog that was retrieved with the issue. A
+        field that never changed has been as it is since the issue was created.
+        :param content: The issue as returned by the search API
+        :return: datetime of each of 'status', 'story_points' and 'sprint_name', or an empty dict if the changelog
+                 wasn't retrieved or is incomplete, in which case only the issue's updated time is known
         """
-        offset_direction = timestamp[-5]  # A plus or minus sign
-        offset_hours = int(timestamp[-4:-2])
-        offset_minutes = int(timestamp[-2:])
-        offset_seconds = offset_hours * 3600 + offset_minutes * 60
-        return datetime.timezone(datetime.timedelta(seconds=int(offset_direction + str(offset_seconds))))
+        changelog = content.get('changelog')
+        if not changelog or len(changelog['histories']) < changelog['total']:  # Only the first page of histories
+            return {}
+
+        created = parse_jira_timestamp(content['fields']['created'])
+        field_updated = dict.fromkeys(('status', 'story_points', 'sprint_name'), created)
+        for history in changelog['histories']:
+            for item in history['items']:
+                field = JiraIssue.changelog_fields.get(item.get('fieldId'),
+                                                       JiraIssue.changelog_fields.get(item['field']))
+                if field:
+                    field_updated[field] = max(field_updated[field], parse_jira_timestamp(history['created']))
+        return field_updated
 
     def get_github_equivalent(self):
         """Find the equivalent Github issue key, repository name, milestone name and number if listed in the
@@ -122,49 +307,110 @@ class JiraIssue(Issue):
         have the corresponding GitHub issue listed in them."""
 
         if self.description:
-            match_obj1 = re.search(r'(?<=Repository Name: )(.*?)(?={color})', self.description)
-            match_obj2 = re.search(r'(?<=Issue Number: )(.*?)(?={color})', self.description)
-            match_obj3 = re.search(r'(?<=Milestone: )(.*?)(?={color})', self.description)
-            match_obj4 = re.search(r'(?<=github.com/)(.*?)(?=/)', self.description)
-            if not any([match_obj1, match_obj2, match_obj3, match_obj4]):
+            link = parse_links(self.description)
+            if not link.found():
                 logging.warning(f'No GitHub link information was found in the description of issue {self.jira_key}')
-            self.github_repo = match_obj1.group(0) if match_obj1 else None
-            self.github_key = match_obj2.group(0) if match_obj2 else None
-            self.milestone_name = match_obj3.group(0) if match_obj3 else None
-            self.github_org = match_obj4.group(0) if match_obj4 else None
+            self.github_repo = link.repo
+            self.github_key = link.issue_number
+            self.milestone_name = link.milestone
+            self.github_org = link.org
+
+    def update_remote(self, fields: list = None):
+        """
+        Update the remote issue. The issue must already exist in Jira.
+        :param fields: Optional. Only update these of 'status' and 'story_points'. By default, both are updated.
+        """
+        if fields is None or 'status' in fields:
+            self._update_issue_status()
+        if fields is None or 'story_points' in fields:
+            self._update_issue_points()
 
-    def update_remote(self):
-        """Update the remote issue. The issue must already exist in Jira."""
+    def _update_issue_status(self):
+        """Update the remote issue's status to the one currently held by the Issue object"""
 
+        if self.status == self.remote_status:
+            logger.debug(f'Jira issue {self.jira_key} is already in status {self.status}')
+            return
+        if self.repo.planned('transition', self.jira_key, self.status):
+            return
         logger.debug(f'Updating Jira issue {self.jira_key} status to {self.status}')
-        # Issue status has to be updated as a transition
-        transition = {'transition': {'id': transitions[self.status]}}
-        self.repo.api_call(requests.post, f'issue/{self.jira_key}/transitions', json=transition, success_code=204)
-
+        # Issue status has to be updated as a transition, or a series of them if the workflow has no direct one
+        self.repo.get_transitions(self)
+        path = self.repo.transition_path(self.issue_type, self.remote_status, self.status)
+        if path is None:
+            if self.status not in transitions:
+                logger.warning(f'Cannot update Jira issue {self.jira_key} status from {self.remote_status} to '
+                               f'{self.status}: no transition to it is known')
+                return
+            path = [(transitions[self.status], self.status)]  # Fall back to the one in settings.py
+        for transition_id, status in path[:-1]:
+            content = self.repo.api_call(requests.post, f'issue/{self.jira_key}/transitions',
+                                         json={'transition': {'id': transition_id}}, success_code=204)
+            if content != {}:
+                raise RuntimeError(f'Failed to transition Jira issue {self.jira_key} from {self.remote_status} to '
+                                   f'{status} on the way to {self.status}: {content}')
+            self.remote_status = status
+        # The last transition can be sent along with the fields written to the issue
+        self.write('transition', {'id': path[-1][0]})
+        self.remote_status = self.status
+
+    def _update_issue_points(self):
+        """Update the remote issue's story points to the value currently held by the Issue object"""
+
+        if self.repo.planned('set_points', self.jira_key, self.story_points):
+            return
         logger.debug(f'Updating Jira issue {self.jira_key} story points to {self.story_points}')
         # Issue story points field can be updated from a dictionary
-        try:
-            self.repo.api_call(requests.put, f'issue/{self.jira_key}',
-                               json={'fields': {CustomFieldNames.story_points: self.story_points}}, success_code=204)
-        except RuntimeError as e:
-            logger.warning(f'{repr(e)} error updating issue {self.jira_key} story points. '
-                           f'Check that the issue is not a task')
-
-    def change_epic_membership(self, add: str = None, remove: str = None):
-        """Add or remove given issue from this epic (self). Specify one issue to add or remove as a kwarg"""
-
-        if add and not remove:
-            logger.debug(f'Adding Jira issue {add} to epic {self.jira_key}')
-            epic_name = self.jira_key
-        elif remove and not add:
-            logger.debug(f'Removing Jira issue {remove} from epic {self.jira_key}')
-            epic_name = 'none'
-        else:
-            raise RuntimeError('change_epic_membership must be called with exactly one argument')
+        self.write('fields', {CustomFieldNames.story_points: self.story_points})
 
-        issues = {'issues': [add or remove]}
-        self.repo.api_call(requests.post, url_head=first(self.repo.url.split('api')),
-                           url_tail=f'agile/1.0/epic/{epic_name}/issue', json=issues, success_code=204)
+    def send_writes(self, writes: dict):
+        """
+        Make the requests for writes to this issue. Fields are set along with the transition in one request if both
+        are written. Jira refuses that if a field isn't on the transition's screen, in which case the transition and
+        fields are sent separately, as they are for the rest of the run.
+        :param writes: 'transition' and/or 'fields', as passed to write()
+        """
+        transition, fields = writes.get('transition'), writes.get('fields')
+        if transition and fields and self.repo.transition_fields:
+            content = self.repo.api_call(requests.post, f'issue/{self.jira_key}/transitions',
+                                         json={'transition': transition, 'fields': fields}, success_code=204)
+            if content == {}:
+                return
+            logger.debug(f'Jira refused fields {list(fields)} with a transition of issue {self.jira_key}: {content}')
+            self.repo.transition_fields = False
+
+        if transition:
+            self.repo.api_call(requests.post, f'issue/{self.jira_key}/transitions', json={'transition': transition},
+                               success_code=204)
+        if fields:
+            content = self.repo.api_call(requests.put, f'issue/{self.jira_key}', json={'fields': fields},
+                                         success_code=204)
+            if content != {}:
+                logger.warning(f'{content} error updating issue {self.jira_key} fields {list(fields)}. '
+                               f'Check that the issue is not a task')
+
+    def change_epic_membership(self, add: list = None, remove: list = None):
+        """
+        Add the given issues to this epic (self) and remove others from it, 50 issues per request
+        :param add: Optional. Keys of issues to make children of this epic
+        :param remove: Optional. Keys of issues to remove from this epic
+        """
+        if not add and not remove:
+            raise RuntimeError('change_epic_membership must be called with issues to add or remove')
+        if self.repo.plan is not None:
+            for kind, keys in (('epic_add', add), ('epic_remove', remove)):
+                if keys:
+                    self.repo.planned(kind, self.jira_key, list(keys))
+            return
+
+        # Removing an issue from its epic is done by moving it to the epic called 'none'
+        for epic_name, keys in ((self.jira_key, add or []), ('none', remove or [])):
+            for i in range(0, len(keys), 50):  # The API accepts up to 50 issues at a time
+                logger.debug(f"{'Adding' if epic_name == self.jira_key else 'Removing'} Jira issues {keys[i:i + 50]} "
+                             f"{'to' if epic_name == self.jira_key else 'from'} epic {self.jira_key}")
+                self.repo.api_call(requests.post, url_head=first(self.repo.url.split('api')),
+                                   url_tail=f'agile/1.0/epic/{epic_name}/issue', json={'issues': keys[i:i + 50]},
+                                   success_code=204)
 
     def get_epic_children(self) -> list:
         """If this issue is an epic, get all its children"""
@@ -174,12 +420,14 @@ class JiraIssue(Issue):
 
     def add_to_sprint(self, sprint_id: str):
         """
-        Post this issue to a sprint
+        Add this issue to a sprint, moving it out of any sprint it is already in. The request is held back by the repo
+        so it can be combined with those for other issues going to the same sprint; see JiraRepo.add_to_sprint_later.
         :param sprint_id: Jira ID of the sprint to add this issue to
         """
+        if self.repo.planned('set_sprint', self.jira_key, sprint_id):
+            return
         logger.debug(f'Adding Jira issue {self.jira_key} to sprint {sprint_id}')
-        self.repo.api_call(requests.post, f'sprint/{sprint_id}/issue', url_head=self.repo.alt_url,
-                           json={'issues': [self.jira_key]}, success_code=204)
+        self.repo.add_to_sprint_later(sprint_id, self.jira_key)
 
     def remove_from_sprint(self):
         """Remove this issue from any sprint it may be in"""
@@ -187,14 +435,18 @@ class JiraIssue(Issue):
         logger.debug(f'Removing Jira issue {self.jira_key} from sprint {self.sprint_name}')
         self.sprint_name = None
         self.sprint_id = None
-        self.repo.api_call(requests.put, f'issue/{self.jira_key}',
-                           json={'fields': {CustomFieldNames.sprint: None}}, success_code=204)
+        if self.repo.planned('set_sprint', self.jira_key, None):
+            return
+        self.write('fields', {CustomFieldNames.sprint: None})
 
     def get_sprint_id(self, sprint_title: str) -> int or None:
         """
-        Search for a sprint ID by its name
+        Search for a sprint ID by its name. The answer is remembered by the repo for the rest of the run.
         :param sprint_title: Jira sprint name to look up ID for
         """
+        return self.repo.lookup(('sprint', sprint_title), lambda: self._get_sprint_id(sprint_title))
+
+    def _get_sprint_id(self, sprint_title: str) -> int or None:
         url = f'search?jql=sprint="{sprint_title}"'
         content = self.repo.api_call(requests.get, url)
         try:
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import re
+from typing import NamedTuple
+
+# Unito links a Jira issue and a GitHub issue by adding a footer to the description of each, e.g. in Jira
+#   ┆{color:#707070}Issue is synchronized with a [GitHub issue|https://github.com/org/abc/issues/5]{color}
+#   ┆{color:#707070}Repository Name: abc{color}
+#   ┆{color:#707070}Milestone: Sprint 1{color}
+#   ┆{color:#707070}Issue Number: 5{color}
+# and in GitHub
+#   ┆Issue is synchronized with this [Jira Story](https://org.atlassian.net/browse/ABC-10)
+#   ┆Issue Number: ABC-10
+BLOCK_START = 'Issue is synchronized with'
+FIELDS = re.compile(r'(Repository Name|Issue Number|Milestone): ([^\r\n{]*)|github\.com/([^/\s]+)/')
+JIRA_KEY = re.compile(r'[A-Za-z][A-Za-z0-9_]*-\d+')
+LABELS = {'Repository Name': 'repo', 'Issue Number': 'issue_number', 'Milestone': 'milestone'}
+
+
+class UnitoLink(NamedTuple):
+    """The fields Unito lists in the description of an issue it syncs. Those that aren't listed are None."""
+
+    org: str = None  # GitHub organization, from the link to the GitHub issue
+    repo: str = None  # GitHub repo
+    issue_number: str = None  # Number of the GitHub issue in Jira descriptions, key of the Jira issue in GitHub ones
+    milestone: str = None  # GitHub milestone
+    jira_key: str = None  # The issue number, if it is a Jira key
+
+    def found(self) -> bool:
+        """Return whether any field was listed"""
+
+        return any(self)
+
+
+def parse_links(description: str or None) -> UnitoLink:
+    """
+    Find the fields Unito lists in the footer of an issue description, in one pass over the footer. The footer is at
+    the end of the description, so the text before its first line is skipped. Descriptions whose footer has no first
+    line are searched whole. The first value of each field counts.
+    :param description: The description of a Jira issue or the body of a GitHub issue
+    """
+    if not description:
+        return UnitoLink()
+    start = description.rfind(BLOCK_START)
+    fields = {}
+    for match in FIELDS.finditer(description, max(start, 0)):
+        label, value, org = match.groups()
+        if org:
+            fields.setdefault('org', org)
+        else:
+            fields.setdefault(LABELS[label], value.strip())
+        if len(fields) == 4:
+            break
+
+    number = fields.get('issue_number')
+    key = JIRA_KEY.match(number) if number else None
+    return UnitoLink(jira_key=key.group(0) if key else None, **fields)
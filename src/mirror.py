@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import logging
+from pathlib import Path
+import pytz
+import sqlite3
+import threading
+
+from settings import state_path
+from src.timestamps import parse_utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    repo TEXT NOT NULL,  -- e.g. 'jira ucsc-cgl/TEST' or 'zenhub ucsc-cgp/sync-test'
+    key TEXT NOT NULL,  -- The Jira key of a Jira issue, or the GitHub number of a ZenHub issue
+    jira_key TEXT,
+    github_key TEXT,
+    epic INTEGER NOT NULL,
+    status TEXT,
+    pipeline TEXT,
+    story_points REAL,
+    sprint_name TEXT,
+    milestone_name TEXT,
+    updated TEXT,
+    PRIMARY KEY (repo, key)
+);
+CREATE INDEX IF NOT EXISTS issues_jira_key ON issues (repo, jira_key);
+CREATE INDEX IF NOT EXISTS issues_github_key ON issues (repo, github_key);
+CREATE TABLE IF NOT EXISTS marks (
+    pair TEXT PRIMARY KEY,  -- e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+    last_run TEXT NOT NULL,
+    board TEXT NOT NULL,
+    retry TEXT NOT NULL
+);
+"""
+
+# How a pair is joined, and which of its fields differ when it is out of sync, for each direction of sync. Syncing
+# from Jira sets the ZenHub pipeline, syncing from ZenHub sets the Jira status, and either may happen with -m.
+DIRECTIONS = {
+    '-j': ('z.key = j.github_key', 'j.pipeline IS NOT z.pipeline'),
+    '-z': ('z.jira_key = j.key', 'j.status IS NOT z.status'),
+    '-m': ('z.key = j.github_key', '(j.pipeline IS NOT z.pipeline OR j.status IS NOT z.status)')
+}
+
+
+class Mirror:
+
+    def __init__(self, path: str = state_path['mirror']):
+        """
+        A local SQLite copy of the synchronized fields of Jira issues and of ZenHub issues, which hold their GitHub
+        fields too, kept between synchronization runs. It is refreshed with the issues that changed since the last run,
+        and tells which issue pairs are out of sync without retrieving the rest.
+        :param path: Location of the database. A leading '~' is replaced with the user's home directory.
+        """
+        self.path = path.replace('~', str(Path.home()))
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def store(self, repo: str, issues):
+        """
+        Replace the rows of the given issues with the values they hold now
+        :param repo: 'jira' or 'zenhub', then the organization and repo separated by a forward slash, e.g.
+                     'jira ucsc-cgl/TEST'
+        :param issues: JiraIssue or ZenHubIssue objects of the repo
+        """
+        rows = []
+        for issue in issues:
+            fields = issue.sync_fields()
+            key = issue.jira_key if repo.startswith('jira') else issue.github_key
+            rows.append((repo, str(key), issue.jira_key, issue.github_key and str(issue.github_key), fields['epic'],
+                         fields['status'], fields['pipeline'], fields['story_points'], fields['sprint_name'],
+                         fields['milestone_name'], issue.updated and issue.updated.isoformat()))
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        logger.debug(f'Stored {len(rows)} issues of {repo} in the mirror')
+
+    def compare(self, jira: str, zenhub: str, direction: str) -> tuple:
+        """
+        Find the issue pairs whose synchronized fields differ. Epics are always out of sync, because their membership
+        isn't mirrored.
+        :param jira: Jira organization and repo separated by a forward slash
+        :param zenhub: ZenHub organization and repo separated by a forward slash
+        :param direction: The sync direction flag, '-j', '-z' or '-m'
+        :return: list of the (Jira key, ZenHub key) of each pair that is out of sync, and the number of pairs that
+                 are in sync
+        """
+        join, differs = DIRECTIONS[direction]
+        with self.lock:
+            rows = self.db.execute(
+                f'SELECT j.key, z.key, j.epic OR z.epic OR {differs} '
+                f'OR COALESCE(j.story_points, 0) IS NOT COALESCE(z.story_points, 0) '
+                f'OR j.sprint_name IS NOT z.milestone_name '
+                f'FROM issues j JOIN issues z ON z.repo = ? AND {join} WHERE j.repo = ? ORDER BY j.key',
+                (f'zenhub {zenhub}', f'jira {jira}')).fetchall()
+        pairs = [(jira_key, zenhub_key) for jira_key, zenhub_key, out_of_sync in rows if out_of_sync]
+        logger.info(f'Found {len(pairs)} of {len(rows)} issue pairs out of sync in the mirror')
+        return pairs, len(rows) - len(pairs)
+
+    def mark(self, pair: str) -> dict or None:
+        """
+        Return when the pair of repos was last synced with the mirror, as a dict like that of HighWaterMarkStore, with
+        'since', 'board' and 'retry', or None if it never was
+        :param pair: Name of the Jira repo and ZenHub repo, e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+        """
+        with self.lock:
+            row = self.db.execute('SELECT last_run, board, retry FROM marks WHERE pair = ?', (pair,)).fetchone()
+        if row is None:
+            return None
+        return {'since': parse_utc_timestamp(row[0]),
+                'board': json.loads(row[1]), 'retry': json.loads(row[2])}
+
+    def record(self, pair: str, run_started: datetime.datetime, board: dict, retry: dict):
+        """
+        Remember a run, so that the next one only refreshes what changed since it started
+        :param pair: Name of the Jira repo and ZenHub repo, e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+        :param run_started: The time the run started retrieving issues
+        :param board: ZenHub board snapshot taken during the run, as returned by ZenHubRepo.get_board_snapshot
+        :param retry: Keys of issues that failed, as lists under 'jira' and 'zenhub'
+        """
+        retry = {side: sorted(set(retry.get(side, []))) for side in ('jira', 'zenhub')}
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO marks VALUES (?, ?, ?, ?)',
+                            (pair, run_started.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                             json.dumps(board, sort_keys=True), json.dumps(retry)))
+
+    def close(self):
+        """Close the connection to the database"""
+
+        self.db.close()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+from itertools import groupby
+import json
+import logging
+from pathlib import Path
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Kinds of change, in the order they are made. Issues are converted to and from epics before anything else, since epic
+# membership depends on it, and epic membership is changed last. Everything else is changed one issue at a time, and
+# an issue's milestone is set before its pipeline, since moving it between pipelines sends the writes held back so far.
+PHASES = {'promote': 0, 'demote': 0,
+          'set_milestone': 1, 'set_sprint': 1, 'transition': 1, 'set_points': 1, 'move_pipeline': 1,
+          'epic_add': 2, 'epic_remove': 2}
+ORDER = list(PHASES)
+LISTS = ('epic_add', 'epic_remove')  # Kinds whose value is a list of issue keys, which are merged rather than replaced
+
+
+class Plan:
+
+    def __init__(self, jira: str = None, zenhub: str = None, mutations: list = None):
+        """
+        The changes a synchronization run would make to issues, kept as mutations that can be saved and made later. A
+        mutation is a dict with the 'side' ('jira' or 'zenhub'), the 'kind' of change, the 'key' of the issue and the
+        new 'value', e.g. {'side': 'jira', 'kind': 'transition', 'key': 'TEST-1', 'value': 'Done'}.
+        :param jira: Optional. Jira organization and repo separated by a forward slash
+        :param zenhub: Optional. ZenHub organization and repo separated by a forward slash
+        :param mutations: Optional. Mutations to start with, in the order they were planned
+        """
+        self.jira = jira
+        self.zenhub = zenhub
+        self.mutations = mutations or []
+        self.lock = threading.Lock()  # Issue pairs may be planned in several threads at once
+
+    def add(self, repo: 'Repo', kind: str, key: str, value=None):
+        """
+        Add a mutation to the plan
+        :param repo: The JiraRepo or ZenHubRepo the issue belongs to
+        :param kind: One of the kinds in PHASES
+        :param key: Key of the issue, e.g. 'TEST-1' in Jira or '12' in ZenHub
+        :param value: The new value, e.g. a status, a sprint ID, or a list of keys of children to add to an epic
+        """
+        side = 'jira' if repo.__class__.__name__ == 'JiraRepo' else 'zenhub'
+        logger.debug(f'Planning {kind} of {side} issue {key} to {value}')
+        with self.lock:
+            self.mutations.append({'side': side, 'kind': kind, 'key': key, 'value': value})
+
+    def has(self, repo: 'Repo', kind: str, key: str) -> bool:
+        """Return whether a mutation of the given kind is planned for an issue"""
+
+        side = 'jira' if repo.__class__.__name__ == 'JiraRepo' else 'zenhub'
+        with self.lock:
+            return any((m['side'], m['kind'], m['key']) == (side, kind, key) for m in self.mutations)
+
+    def optimize(self) -> 'Plan':
+        """
+        Return a plan that makes the same changes in fewer requests. Only the last value written to each field of an
+        issue is kept, promoting and demoting an epic cancel out to the last of the two, changes to an epic's children
+        are merged, and the mutations are ordered so that those of one issue are next to each other and can be sent
+        together.
+        """
+        merged = dict()
+        for m in self.mutations:
+            kind = 'promote' if m['kind'] == 'demote' else m['kind']  # The last of the two wins
+            slot = (m['side'], kind, m['key'])
+            if m['kind'] in LISTS and slot in merged:
+                merged[slot]['value'] += [k for k in m['value'] if k not in merged[slot]['value']]
+            else:
+                merged.pop(slot, None)  # Later values replace earlier ones
+                merged[slot] = dict(m, value=list(m['value']) if m['kind'] in LISTS else m['value'])
+
+        mutations = sorted(merged.values(), key=lambda m: (PHASES[m['kind']], m['side'], str(m['key']),
+                                                           ORDER.index(m['kind'])))
+        logger.info(f'Optimized a plan of {len(self.mutations)} changes to {len(mutations)}')
+        return Plan(self.jira, self.zenhub, mutations)
+
+    def execute(self, jira_repo: 'JiraRepo', zenhub_repo: 'ZenHubRepo', done=None) -> dict:
+        """
+        Make the changes in the plan, in its order. The writes to an issue within a phase are sent together.
+        :param jira_repo: JiraRepo holding the Jira issues the plan changes
+        :param zenhub_repo: ZenHubRepo holding the ZenHub issues the plan changes
+        :param done: Optional. Function called with the mutations of an issue once they have been made
+        :return: dict with the number of mutations that were made and skipped, and the keys of issues whose mutations
+                 failed
+        """
+        counts = {'processed': 0, 'skipped': 0, 'failed': []}
+        for (phase, side, key), group in groupby(self.mutations, lambda m: (PHASES[m['kind']], m['side'], m['key'])):
+            group = list(group)
+            issue = (jira_repo if side == 'jira' else zenhub_repo).issues.get(key)
+            if issue is None:
+                logger.warning(f'Skipping changes to {side} issue {key}: the issue could not be retrieved')
+                counts['skipped'] += len(group)
+                continue
+
+            try:
+                with issue.batch_writes():
+                    for m in group:
+                        if m['kind'] not in LISTS:
+                            apply(issue, m['kind'], m['value'])
+                    children = {m['kind']: m['value'] for m in group if m['kind'] in LISTS}
+                    if children:  # Children are added to and removed from an epic together
+                        issue.change_epic_membership(add=children.get('epic_add'), remove=children.get('epic_remove'))
+            except RuntimeError as e:
+                logger.warning(f'Failed to change {side} issue {key}: {repr(e)}')
+                counts['failed'].append(key)
+            else:
+                counts['processed'] += len(group)
+                if done:
+                    done(group)
+
+        counts['failed'].extend(k for k in jira_repo.flush_sprint_assignments() if k not in counts['failed'])
+        logger.info(f"Made {counts['processed']} planned changes, skipped {counts['skipped']}, "
+                    f"failed to change {len(counts['failed'])} issues")
+        return counts
+
+    def save(self, path: str):
+        """Write the plan to a JSON file"""
+
+        with open(path.replace('~', str(Path.home())), 'w') as fh:
+            json.dump({'jira': self.jira, 'zenhub': self.zenhub, 'mutations': self.mutations}, fh, indent=2)
+        logger.info(f'Wrote a plan of {len(self.mutations)} changes to {path}')
+
+    @staticmethod
+    def load(path: str) -> 'Plan':
+        """Read a plan written by save()"""
+
+        with open(path.replace('~', str(Path.home())), 'r') as fh:
+            content = json.load(fh)
+        return Plan(content['jira'], content['zenhub'], content['mutations'])
+
+
+def apply(issue: 'Issue', kind: str, value):
+    """
+    Make one planned change to an issue whose repo isn't being planned. Changes to epic membership are made by
+    Plan.execute, which sends the children added and removed together.
+    :param issue: The JiraIssue or ZenHubIssue to change
+    :param kind: One of the kinds in PHASES
+    :param value: The new value
+    """
+    if kind == 'promote':
+        issue.promote_issue_to_epic()
+    elif kind == 'demote':
+        issue.demote_epic_to_issue()
+    elif kind == 'transition':
+        issue.status = value
+        issue._update_issue_status()
+    elif kind == 'set_points':
+        issue.story_points = value
+        issue._update_issue_points()
+    elif kind == 'move_pipeline':
+        issue.pipeline = value
+        issue._update_issue_pipeline()
+    elif kind == 'set_sprint' and value:
+        issue.add_to_sprint(value)
+    elif kind == 'set_sprint':
+        issue.remove_from_sprint()
+    elif kind == 'set_milestone' and value:
+        issue.add_to_milestone(value)
+    elif kind == 'set_milestone':
+        issue.remove_from_milestone()
+    else:
+        raise ValueError(f'Unknown kind of change {kind}')
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+budgets = dict()  # RateBudget objects keyed by host name. Empty unless configure() is called.
+
+
+class RateBudget:
+
+    def __init__(self, requests: float, seconds: float):
+        """
+        A token bucket that allows bursts of up to a given number of requests, refilled evenly over a given time.
+        Threads share a budget by calling take() on the same object.
+        :param requests: Number of requests allowed per period, e.g. 5000 for GitHub's hourly limit
+        :param seconds: Length of the period in seconds
+        """
+        self.capacity = max(requests, 1)
+        self.rate = requests / seconds  # Tokens added per second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Wait until a request is allowed by the budget, then use up one request"""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            logger.debug(f'Rate budget used up, waiting {wait:.1f} seconds')
+            time.sleep(wait)
+
+
+def configure(limits: dict, share: float = 1):
+    """
+    Set up a rate budget for each host, replacing any that were set up before
+    :param limits: (requests, seconds) keyed by host name, e.g. {'api.github.com': (5000, 3600)}. A host name also
+                   covers its subdomains, e.g. 'atlassian.net' covers 'ucsc-cgl.atlassian.net'.
+    :param share: Fraction of each budget to use, e.g. 0.25 if there are four processes that each have their own
+    """
+    budgets.clear()
+    budgets.update({host: RateBudget(requests * share, seconds) for host, (requests, seconds) in limits.items()})
+
+
+def take(url: str):
+    """
+    Wait until a request to the given URL is allowed by the budget for its host. Hosts without a budget aren't limited.
+    :param url: The full URL of the request
+    """
+    host = urlsplit(url).hostname or ''
+    for name, budget in budgets.items():
+        if host == name or host.endswith(f'.{name}'):
+            budget.take()
+            return
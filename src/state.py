@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import pytz
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where only threads are kept from saving at the same time
+    fcntl = None
+
+from settings import checkpoint_max_age, state_path
+from src.plan import Plan
+from src.timestamps import parse_utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+def own_fields(issue: 'Issue') -> dict:
+    """Return the synchronized fields that a Jira or ZenHub issue holds in its own management system"""
+
+    fields = issue.sync_fields()
+    names = FingerprintStore.jira_fields if issue.__class__.__name__ == 'JiraIssue' else FingerprintStore.zenhub_fields
+    return {name: fields[name] for name in names}
+
+
+class LocalStore:
+
+    save_lock = threading.Lock()  # Stores in different threads may share a file, e.g. when repo pairs run in parallel
+
+    def __init__(self, path: str, section: str = None):
+        """
+        A dictionary that is kept in a local JSON file between synchronization runs
+        :param path: Location of the JSON file. A leading '~' is replaced with the user's home directory.
+        :param section: Optional. If given, this store only changes the value under this key of the dictionary, and
+                        leaves the rest of the file as it is on disk when saving.
+        """
+        self.path = path.replace('~', str(Path.home()))
+        self.section = section
+        self.data = self._load()
+        self.held = False  # While True, save() does nothing, e.g. while the changes this store records aren't made yet
+
+    def _load(self) -> dict:
+        """Read the stored dictionary, or return an empty one if there is nothing stored yet"""
+
+        try:
+            with open(self.path, 'r') as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.warning(f'Ignoring unreadable state file {self.path}')
+            return {}
+
+    def save(self):
+        """
+        Write the dictionary to disk. A temporary file is used so an interrupted write can't corrupt the store. If this
+        store is for one section, the file is read again first, so that sections saved by other stores in the meantime
+        are kept. A lock file keeps other processes from doing the same at the same time.
+        """
+        if self.held:
+            return
+        with self.save_lock, open(f'{self.path}.lock', 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # Released when the lock file is closed
+            data = self.data
+            if self.section is not None:
+                data = self._load()
+                data[self.section] = self.data[self.section]
+
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as fh:
+                json.dump(data, fh, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class FingerprintStore(LocalStore):
+
+    def __init__(self, pair: str, path: str = state_path['fingerprints']):
+        """
+        Remember a hash of the sync-relevant fields of each issue pair as they were when the pair was last synced
+        successfully, so that pairs which haven't changed since then can be skipped.
+        :param pair: Name of the Jira repo and ZenHub repo being synced and the direction of the sync, e.g.
+                     'ucsc-cgl/TEST ucsc-cgp/sync-test -m'. Fingerprints are stored separately for each pair of repos
+                     and direction: a sync can leave fields it couldn't write, like a sprint that doesn't exist in the
+                     destination, and a sync in the other direction would resolve those differently.
+        :param path: Location of the JSON file holding the fingerprints
+        """
+        super().__init__(path, section=pair)
+        self.fingerprints = self.data.setdefault(pair, {})
+
+    # The fields that each side holds in its own management system. The rest are either derived from these, like a
+    # ZenHub issue's Jira status, or copied over in memory from the other side during a sync and never written back.
+    jira_fields = ('epic', 'status', 'story_points', 'sprint_name')
+    zenhub_fields = ('epic', 'pipeline', 'story_points', 'milestone_name')
+
+    @staticmethod
+    def fingerprint(jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue') -> str:
+        """Return a hash of the synchronized fields that each issue holds in its own management system"""
+
+        jira_fields, zenhub_fields = jira_issue.sync_fields(), zenhub_issue.sync_fields()
+        fields = [{k: jira_fields[k] for k in FingerprintStore.jira_fields},
+                  {k: zenhub_fields[k] for k in FingerprintStore.zenhub_fields}]
+        return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()
+
+    def unchanged(self, jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue') -> bool:
+        """
+        Return True if neither issue has changed since the pair was last synced. This must be called before syncing
+        the pair, while the issues still hold the values that were retrieved from the APIs.
+
+        Epics are never considered unchanged because their membership is not part of the fingerprint.
+        """
+        if 'Epic' in (jira_issue.issue_type, zenhub_issue.issue_type):
+            return False
+        key = f'{jira_issue.jira_key}:{zenhub_issue.github_key}'
+        return self.fingerprints.get(key) == self.fingerprint(jira_issue, zenhub_issue)
+
+    def record(self, jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue'):
+        """
+        Remember the fingerprint of a pair that was synced successfully. This must be called after syncing the pair,
+        so that the fingerprint is of the values that were written, which is what the next run will retrieve.
+        """
+        key = f'{jira_issue.jira_key}:{zenhub_issue.github_key}'
+        self.fingerprints[key] = self.fingerprint(jira_issue, zenhub_issue)
+
+    def forget(self, jira_issue: 'JiraIssue'):
+        """Drop the fingerprint of a pair whose sync turned out to fail, so that it is synced again next run"""
+
+        self.fingerprints.pop(f'{jira_issue.jira_key}:{jira_issue.github_key}', None)
+
+
+class WriteLog(LocalStore):
+
+    def __init__(self, pair: str, path: str = state_path['writes']):
+        """
+        Remember what a mirror sync last wrote to each issue and when. Writing moves an issue's updated timestamp
+        forward, so the next sync would take the issue to be the most current and copy it back to its counterpart for
+        nothing. An issue that still holds what was written to it hasn't changed since, whatever its timestamp says.
+        :param pair: Name of the Jira repo and ZenHub repo being synced, e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+        :param path: Location of the JSON file holding the writes
+        """
+        super().__init__(path, section=pair)
+        self.writes = self.data.setdefault(pair, {})
+
+    @staticmethod
+    def resource(issue: 'Issue') -> str:
+        """Return the name an issue's writes are kept under, e.g. 'jira TEST-1' or 'zenhub 25'"""
+
+        if issue.__class__.__name__ == 'JiraIssue':
+            return f'jira {issue.jira_key}'
+        return f'zenhub {issue.github_key}'
+
+    def record(self, issue: 'Issue'):
+        """Remember the fields of an issue that was just written to. This must be called after the write."""
+
+        self.writes[self.resource(issue)] = {'fields': own_fields(issue),
+                                             'time': datetime.datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    def forget(self, jira_issue: 'JiraIssue'):
+        """Drop the writes to both issues of a pair whose sync turned out to fail"""
+
+        self.writes.pop(f'jira {jira_issue.jira_key}', None)
+        self.writes.pop(f'zenhub {jira_issue.github_key}', None)
+
+    def echo(self, issue: 'Issue') -> bool:
+        """Return True if an issue still holds what was last written to it, i.e. only the sync changed it since"""
+
+        write = self.writes.get(self.resource(issue))
+        return write is not None and write['fields'] == own_fields(issue)
+
+    def written(self, issue: 'Issue') -> datetime.datetime or None:
+        """Return when an issue was last written to, or None if it never was"""
+
+        write = self.writes.get(self.resource(issue))
+        if write is None:
+            return None
+        return parse_utc_timestamp(write['time'])
+
+    def unchanged_since(self, issue: 'Issue', since: datetime.datetime) -> bool:
+        """
+        Return True if an issue hasn't been changed by anyone but the sync since the given time: it holds what was
+        last written to it, or it was never written to and hasn't been updated since
+        """
+        if self.resource(issue) in self.writes:
+            return self.echo(issue)
+        return issue.updated <= since
+
+
+class SnapshotStore(LocalStore):
+
+    def __init__(self, pair: str, path: str = state_path['snapshots']):
+        """
+        Remember the synchronized fields that both issues of each pair held when the pair was last synced. This is the
+        base that a three-way merge compares each issue to, to tell which of them changed since; see
+        Sync.merge_with_base.
+        :param pair: Name of the Jira repo and ZenHub repo being synced, e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+        :param path: Location of the JSON file holding the snapshots
+        """
+        super().__init__(path, section=pair)
+        self.snapshots = self.data.setdefault(pair, {})
+
+    def base(self, jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue') -> dict or None:
+        """
+        Return the fields each issue of a pair held when the pair was last synced, as dicts under 'jira' and 'zenhub',
+        or None if it never was
+        """
+        return self.snapshots.get(f'{jira_issue.jira_key}:{zenhub_issue.github_key}')
+
+    def record(self, jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue', keep: list = ()):
+        """
+        Remember the fields of a pair that was synced. This must be called after syncing the pair, so that the snapshot
+        is of the values that were written, which is what the next run will retrieve.
+        :param keep: Optional. (Jira field, ZenHub field) of each conflict found while syncing. Their base is kept as
+                     it was, so that they are still conflicts next time unless someone resolves them.
+        """
+        key = f'{jira_issue.jira_key}:{zenhub_issue.github_key}'
+        snapshot = {'jira': own_fields(jira_issue), 'zenhub': own_fields(zenhub_issue)}
+        for jira_field, zenhub_field in keep:
+            snapshot['jira'][jira_field] = self.snapshots[key]['jira'][jira_field]
+            snapshot['zenhub'][zenhub_field] = self.snapshots[key]['zenhub'][zenhub_field]
+        self.snapshots[key] = snapshot
+
+    def forget(self, jira_issue: 'JiraIssue'):
+        """Drop the snapshot of a pair whose sync turned out to fail, so that it isn't taken as the base next time"""
+
+        self.snapshots.pop(f'{jira_issue.jira_key}:{jira_issue.github_key}', None)
+
+
+class HighWaterMarkStore(LocalStore):
+
+    def __init__(self, pair: str, path: str = state_path['high_water_marks']):
+        """
+        Remember when a pair of repos was last synced, what the ZenHub board looked like then and which issues failed,
+        so that the next run only needs to retrieve those issues and the ones that changed since.
+        :param pair: Name of the Jira repo and ZenHub repo being synced, e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+        :param path: Location of the JSON file holding the high-water marks
+        """
+        super().__init__(path, section=pair)
+        self.mark = self.data.setdefault(pair, {})
+
+    @property
+    def since(self) -> datetime.datetime or None:
+        """The time the last run started, or None if this pair has never been synced"""
+
+        if 'last_run' not in self.mark:
+            return None
+        return parse_utc_timestamp(self.mark['last_run'])
+
+    @property
+    def board(self) -> dict:
+        """The ZenHub board snapshot taken during the last run"""
+
+        return self.mark.get('board', {})
+
+    @property
+    def retry(self) -> dict:
+        """Keys of the Jira and ZenHub issues that failed to sync or to be retrieved during the last run"""
+
+        return self.mark.get('retry', {'jira': [], 'zenhub': []})
+
+    def record(self, run_started: datetime.datetime, board: dict, retry: dict = None):
+        """
+        Remember a run
+        :param run_started: The time the run started retrieving issues. Anything updated after this is retrieved next
+                            time.
+        :param board: ZenHub board snapshot taken during the run, as returned by ZenHubRepo.get_board_snapshot
+        :param retry: Optional. Keys of issues that failed, as lists under 'jira' and 'zenhub'. Since the next run
+                      starts from this run's start time, these would otherwise only be retried once they change again.
+        """
+        self.mark['last_run'] = run_started.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.mark['board'] = board
+        self.mark['retry'] = {side: sorted(set((retry or {}).get(side, []))) for side in ('jira', 'zenhub')}
+
+
+class Journal:
+
+    def __init__(self, pair: str, path: str = state_path['journal']):
+        """
+        A write-ahead log of the changes a run makes. The plan is written before any of its changes are made, and each
+        issue's changes are marked done once they have been made, so that a run that is interrupted can be resumed from
+        the first unfinished change. The journal is removed when the run finishes.
+        :param pair: Name of the Jira repo and ZenHub repo being synced, e.g. 'ucsc-cgl/TEST ucsc-cgp/sync-test'
+        :param path: Location of the journal, with %s where the pair goes
+        """
+        self.path = (path % pair.replace('/', '-').replace(' ', '-')).replace('~', str(Path.home()))
+        self.ids = dict()  # Position of each mutation in the journaled plan, by the id of the mutation's dict
+        self.lock = threading.Lock()
+
+    def start(self, plan: 'Plan'):
+        """Write a plan to the journal, replacing any earlier one, before any of its changes are made"""
+
+        self.ids = {id(m): i for i, m in enumerate(plan.mutations)}
+        self._write({'jira': plan.jira, 'zenhub': plan.zenhub, 'mutations': plan.mutations}, mode='w')
+
+    def done(self, mutations: list):
+        """Mark mutations of the journaled plan as made"""
+
+        self._write({'done': [self.ids[id(m)] for m in mutations]}, mode='a')
+
+    def finish(self):
+        """Remove the journal once the run is over, whether or not every change succeeded"""
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def unfinished(self) -> 'Plan' or None:
+        """
+        Read the journal left by a run that was interrupted
+        :return: A plan of the changes that weren't marked done, in their original order, or None if there is no
+                 journal. Marking these done marks them in this journal.
+        """
+        lines = []
+        try:
+            with open(self.path, 'r') as fh:
+                for line in fh:
+                    lines.append(json.loads(line))
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:  # The last line may have been cut off by the interruption
+            logger.warning(f'Ignoring the unfinished last line of journal {self.path}')
+        if not lines:
+            return None
+
+        plan, done = lines[0], {i for line in lines[1:] for i in line['done']}
+        remaining = [(i, m) for i, m in enumerate(plan['mutations']) if i not in done]
+        self.ids = {id(m): i for i, m in remaining}
+        return Plan(plan['jira'], plan['zenhub'], [m for i, m in remaining])
+
+    def _write(self, content: dict, mode: str):
+        """Write a line to the journal and make sure it is on disk before going on"""
+
+        with self.lock, open(self.path, mode) as fh:
+            fh.write(json.dumps(content) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+class Checkpoint:
+
+    enabled = False  # Checkpoints are only kept once this is set, e.g. by the command line tool
+
+    def __init__(self, name: str, path: str = None, max_age: float = checkpoint_max_age):
+        """
+        The responses to the requests made while loading a repo, appended to a local file as they arrive, so that a
+        run that is interrupted while loading can be restarted without making those requests again. The checkpoint is
+        removed once the repo is loaded, before any issue is changed, so a response is never reused after the sync may
+        have changed what it describes.
+        :param name: Name of the repo being loaded, e.g. 'jira ucsc-cgl/TEST'
+        :param path: Optional. Location of the checkpoint, with %s where the name goes. Defaults to the one in
+                     settings.py.
+        :param max_age: Optional. Seconds for which a checkpointed response is reused
+        """
+        path = path or state_path['checkpoint']
+        self.path = (path % name.replace('/', '-').replace(' ', '-')).replace('~', str(Path.home()))
+        self.lock = threading.Lock()  # Responses may arrive in several threads at once
+        self.responses = self._load(max_age)
+        if self.responses:
+            logger.info(f'Reusing {len(self.responses)} responses checkpointed while loading {name}')
+
+    @classmethod
+    def open(cls, name: str) -> 'Checkpoint' or None:
+        """Return a checkpoint for loading a repo, or None if checkpoints aren't enabled"""
+
+        return cls(name) if cls.enabled else None
+
+    def _load(self, max_age: float) -> dict:
+        """Read the responses that were checkpointed within the last max_age seconds, keyed by URL"""
+
+        responses = dict()
+        try:
+            with open(self.path, 'r') as fh:
+                for line in fh:
+                    response = json.loads(line)
+                    if response['time'] >= time.time() - max_age:
+                        responses[response['url']] = response['content']
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:  # The last line may have been cut off by the interruption
+            logger.warning(f'Ignoring the unfinished last line of checkpoint {self.path}')
+        return responses
+
+    def get(self, url: str):
+        """Return the checkpointed response to a request, or None if there is none that is fresh enough"""
+
+        with self.lock:
+            return self.responses.get(url)
+
+    def put(self, url: str, content):
+        """Checkpoint the response to a request"""
+
+        with self.lock, open(self.path, 'a') as fh:
+            fh.write(json.dumps({'url': url, 'time': time.time(), 'content': content}) + '\n')
+
+    def clear(self):
+        """Remove the checkpoint once the repo is loaded"""
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -1,4 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
 import time
 from tqdm import tqdm
 
@@ -13,36 +15,60 @@ class Sync:
         - Each issue has a counterpart in each management system
         - Each issue's description says the name of the issue it's linked with"""
     @staticmethod
-    def sync_board(source: 'Repo', dest: 'Repo'):
+    def sync_board(source: 'Repo', dest: 'Repo', fingerprints: 'FingerprintStore' = None, workers: int = 1) -> dict:
         """
         For each pair of repos, sync from the issue in the source repo to that in the dest repo.
         Alternative to mirror_sync.
         :param source: This repo's issues will be replicated in the sink repo
         :param dest: This repo's issues will be updated to match those in the source
+        :param fingerprints: Optional. If given, skip issue pairs that haven't changed since they were last synced
+        :param workers: Optional. Number of issue pairs to sync at the same time
+        :return: dict with the number of issue pairs that were processed and skipped, and the keys of source issues
+                 whose pair failed to sync
         """
 
         if source.__class__.__name__ == 'ZenHubRepo' and dest.__class__.__name__ == 'JiraRepo':
-            for key, issue in tqdm(source.issues.items(), desc='syncing'):  # progress bar
+            def sync_pair(key: str, issue: 'ZenHubIssue') -> str or None:
                 try:
                     if issue.jira_key:
+                        dest_issue = dest.issues[issue.jira_key]
+                        if fingerprints and fingerprints.unchanged(dest_issue, issue):
+                            return 'skipped'
+
                         logging.info(f'Syncing from {source.name} issue {key} to issue {issue.jira_key}')
-                        Sync.sync_from_specified_source(issue, dest.issues[issue.jira_key])
+                        Sync.sync_from_specified_source(issue, dest_issue)
+                        if fingerprints:
+                            fingerprints.record(dest_issue, issue)
+                        return 'processed'
                     else:
                         logging.warning(f'Skipping issue {key}: no Jira link found')
 
                 except RuntimeError as e:
                     logging.warning(f'Skipping issue {key}: {repr(e)}')
+                    return 'failed'
 
                 except KeyError as e:
                     logging.warning(repr(e) + f'Skipping this issue - matching issue in Jira not found')
+                    return 'failed'
+
+            finish = Sync._flush_sprint_assignments(dest, fingerprints, lambda issue: issue.github_key)
+            return Sync._sync_pairs(source.issues, sync_pair, lambda issue: dest.issues.get(issue.jira_key),
+                                    fingerprints, workers, finish)
 
         elif source.__class__.__name__ == 'JiraRepo' and dest.__class__.__name__ == 'ZenHubRepo':
-            for key, issue in tqdm(source.issues.items(), desc='syncing'):  # progress bar
+            def sync_pair(key: str, issue: 'JiraIssue') -> str or None:
                 for i in range(number_of_retries):  # Allow for 3 tries
                     try:
                         if issue.github_key:
+                            dest_issue = dest.issues[issue.github_key]
+                            if fingerprints and fingerprints.unchanged(issue, dest_issue):
+                                return 'skipped'
+
                             logging.info(f'Syncing from issue {key} to {dest.name} issue {issue.github_key}')
-                            Sync.sync_from_specified_source(issue, dest.issues[issue.github_key])
+                            Sync.sync_from_specified_source(issue, dest_issue)
+                            if fingerprints:
+                                fingerprints.record(issue, dest_issue)
+                            return 'processed'
                         else:
                             logging.warning(f'Skipping issue {key}: no GitHub link found')
                         break
@@ -54,20 +80,55 @@ class Sync:
                         continue
                     except KeyError as e:
                         logging.warning(repr(e) + f'Issue not found. Going to next issue')
+                        return 'failed'
+                else:  # Every attempt raised a RuntimeError
+                    return 'failed'
+
+            finish = Sync._flush_sprint_assignments(source, fingerprints, lambda issue: issue.jira_key)
+            return Sync._sync_pairs(source.issues, sync_pair, lambda issue: dest.issues.get(issue.github_key),
+                                    fingerprints, workers, finish)
+
+        return {'processed': 0, 'skipped': 0, 'failed': []}
 
     @staticmethod
-    def mirror_sync(jira_repo: 'JiraRepo', zenhub_repo: 'ZenHubRepo'):
+    def mirror_sync(jira_repo: 'JiraRepo', zenhub_repo: 'ZenHubRepo', fingerprints: 'FingerprintStore' = None,
+                    workers: int = 1, writes: 'WriteLog' = None, snapshots: 'SnapshotStore' = None) -> dict:
         """
         For each pair of issues in the repos, sync based on which is most recently updated. Alternative to sync_board.
         :param jira_repo: JiraRepo to use
         :param zenhub_repo: ZenHubRepo to use
+        :param fingerprints: Optional. If given, skip issue pairs that haven't changed since they were last synced
+        :param workers: Optional. Number of issue pairs to sync at the same time
+        :param writes: Optional. If given, updates that only the sync's own writes made are told apart from real ones;
+                       see sync_from_most_current. It is saved once all pairs are done.
+        :param snapshots: Optional. If given, pairs that were synced before are merged against what they held after
+                          that sync instead of by timestamps; see merge_with_base. It is saved once all pairs are done.
+        :return: dict with the number of issue pairs that were processed and skipped, and the keys of source issues
+                 whose pair failed to sync. Pairs with conflicts left for someone to resolve are also listed under
+                 'conflicts'.
         """
 
-        for key, issue in tqdm(jira_repo.issues.items(), desc='syncing'):  # progress bar
+        def sync_pair(key: str, issue: 'JiraIssue') -> str or None:
             for i in range(number_of_retries):  # Allow for a fixed number of tries
                 try:
                     if issue.github_key:
-                        Sync.sync_from_most_current(issue, zenhub_repo.issues[issue.github_key])
+                        zenhub_issue = zenhub_repo.issues[issue.github_key]
+                        if fingerprints and fingerprints.unchanged(issue, zenhub_issue):
+                            return 'skipped'
+
+                        base = snapshots.base(issue, zenhub_issue) if snapshots else None
+                        conflicts = []
+                        if base and 'Epic' not in (issue.issue_type, zenhub_issue.issue_type):
+                            synced, conflicts = Sync.merge_with_base(issue, zenhub_issue, base, writes)
+                        else:
+                            synced = Sync.sync_from_most_current(issue, zenhub_issue, writes)
+                        if fingerprints and not conflicts:  # Pairs with conflicts are checked again next time
+                            fingerprints.record(issue, zenhub_issue)
+                        if snapshots:
+                            snapshots.record(issue, zenhub_issue, keep=conflicts)
+                        if conflicts:
+                            return 'conflict'
+                        return 'processed' if synced else 'skipped'
                     else:
                         logging.warning(f'Skipping issue {key}: no link to matching issue found')
                     break
@@ -79,6 +140,132 @@ class Sync:
                     continue
                 except KeyError as e:
                     logging.warning(repr(e) + f'Issue not found. Going to next issue')
+                    return 'failed'
+            else:  # Every attempt raised a RuntimeError
+                return 'failed'
+
+        flush = Sync._flush_sprint_assignments(jira_repo, fingerprints, lambda issue: issue.jira_key)
+
+        def finish() -> list:
+            failed = flush()
+            for key in failed:  # Their sprint wasn't written, so it mustn't become part of the base
+                if snapshots:
+                    snapshots.forget(jira_repo.issues[key])
+            return failed
+
+        counts = Sync._sync_pairs(jira_repo.issues, sync_pair, lambda issue: zenhub_repo.issues.get(issue.github_key),
+                                  fingerprints, workers, finish)
+        if writes:
+            writes.save()
+        if snapshots:
+            snapshots.save()
+        return counts
+
+    @staticmethod
+    def _sync_pairs(issues: dict, sync_pair, counterpart, fingerprints: 'FingerprintStore' = None,
+                    workers: int = 1, finish=None) -> dict:
+        """
+        Call sync_pair on each issue, one at a time or in a pool of threads, and report the results.
+
+        Issue pairs are independent of each other except for epics, which change the membership of other issues. In
+        the thread pool, pairs where either issue is an epic are therefore synced one after another in a single thread
+        while the other pairs are synced alongside them. Log records made while syncing a pair in the pool are held
+        back and written out together once the pair is done.
+        :param issues: Issues to sync, keyed by issue key
+        :param sync_pair: Function that syncs an issue with its counterpart and returns 'processed', 'skipped',
+                          'failed', 'conflict' or None
+        :param counterpart: Function that returns the counterpart of an issue, or None if it isn't known
+        :param fingerprints: Optional. Fingerprints to save once all pairs are done
+        :param workers: Number of issue pairs to sync at the same time
+        :param finish: Optional. Function called once all pairs are done, e.g. to send writes that were held back. It
+                       returns the keys of source issues whose pair turned out to fail.
+        :return: dict with the number of issue pairs that were processed and skipped, and the keys of source issues
+                 whose pair failed to sync
+        """
+        counts = {'processed': 0, 'skipped': 0, 'failed': []}
+
+        def count(key: str, outcome: str or None):
+            if outcome == 'failed':
+                counts['failed'].append(key)
+            elif outcome == 'conflict':  # The fields that didn't conflict were synced
+                counts['processed'] += 1
+                counts.setdefault('conflicts', []).append(key)
+            elif outcome:
+                counts[outcome] += 1
+
+        if workers <= 1:
+            for key, issue in tqdm(issues.items(), desc='syncing'):  # progress bar
+                count(key, sync_pair(key, issue))
+
+        else:
+            epics, others = [], []
+            for key, issue in issues.items():
+                if 'Epic' in (issue.issue_type, getattr(counterpart(issue), 'issue_type', None)):
+                    epics.append((key, issue))
+                else:
+                    others.append((key, issue))
+
+            with tqdm(total=len(issues), desc='syncing') as progress, _PerPairLogs() as logs:  # progress bar
+
+                def run(pairs: list) -> list:
+                    """Sync the given pairs one after another in a worker thread"""
+                    outcomes = []
+                    for key, issue in pairs:
+                        logs.start_pair()
+                        try:
+                            outcomes.append((key, sync_pair(key, issue)))
+                        finally:
+                            logs.end_pair()
+                            progress.update()
+                    return outcomes
+
+                # Worker threads are named after this one so their log records can be told apart by repo pair
+                prefix = threading.current_thread().name
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=prefix) as pool:
+                    futures = [pool.submit(run, epics)] if epics else []
+                    futures.extend(pool.submit(run, [pair]) for pair in others)
+                    for future in futures:
+                        for key, outcome in future.result():
+                            count(key, outcome)
+
+        for key in finish() if finish else []:
+            if key not in counts['failed']:
+                counts['processed'] -= 1
+                counts['failed'].append(key)
+
+        Sync._report(counts, fingerprints)
+        return counts
+
+    @staticmethod
+    def _flush_sprint_assignments(jira_repo: 'JiraRepo', fingerprints: 'FingerprintStore' = None, source_key=None):
+        """
+        Make a function for _sync_pairs that sends the sprint assignments the Jira repo held back while syncing
+        :param jira_repo: The JiraRepo whose issues may have been added to sprints
+        :param fingerprints: Optional. The fingerprints of pairs whose assignment failed are forgotten
+        :param source_key: Function that returns the key of the source issue paired with a Jira issue
+        :return: Function that returns the keys of source issues whose sprint assignment failed
+        """
+
+        def finish() -> list:
+            failed = [jira_repo.issues[key] for key in jira_repo.flush_sprint_assignments(jira_repo.issues)]
+            for issue in failed:
+                if fingerprints:
+                    fingerprints.forget(issue)
+            return [source_key(issue) for issue in failed]
+
+        return finish
+
+    @staticmethod
+    def _report(counts: dict, fingerprints: 'FingerprintStore' = None):
+        """Log how many issue pairs were synced, skipped and failed, and save the fingerprints of the synced ones"""
+
+        logger.info(f"Synced {counts['processed']} issue pairs, skipped {counts['skipped']} that were unchanged "
+                    f"since the last sync, failed to sync {len(counts['failed'])}")
+        if counts.get('conflicts'):
+            logger.warning(f"Left conflicting changes in {len(counts['conflicts'])} issue pairs for someone to "
+                           f"resolve: {', '.join(counts['conflicts'])}")
+        if fingerprints:
+            fingerprints.save()
 
     @staticmethod
     def sync_from_specified_source(source: 'Issue', dest: 'Issue'):
@@ -93,24 +280,166 @@ class Sync:
             elif source.issue_type != 'Epic' and dest.issue_type == 'Epic':
                 dest.demote_epic_to_issue()
 
-        Sync.sync_sprints(source, dest)
+        with dest.batch_writes():  # e.g. a new milestone and reopening the GitHub issue are one request
+            Sync.sync_sprints(source, dest)
 
-        dest.update_from(source)
-        dest.update_remote()
+            dest.update_from(source)
+            dest.update_remote()
 
         if source.issue_type == 'Epic':  # By this point dest will also be an Epic
             Sync.sync_epics(source, dest)
 
     @staticmethod
-    def sync_from_most_current(a: 'Issue', b: 'Issue'):
-        """Compare timestamps of two issues sync them, using the most recently updated as the source"""
-
-        if a.updated > b.updated:  # a is the most current
+    def sync_from_most_current(a: 'Issue', b: 'Issue', writes: 'WriteLog' = None) -> bool:
+        """
+        Compare timestamps of two issues sync them, using the most recently updated as the source
+        :param writes: Optional. If given, an issue that still holds what the sync last wrote to it is taken to have
+                       changed last when it was written to, however far its timestamp moved since, and the write made
+                       here is recorded in it. A pair that neither side changed since then isn't synced at all.
+        :return: Whether the issues were synced
+        """
+        if a.field_updated and b.field_updated and 'Epic' not in (a.issue_type, b.issue_type):
+            return Sync.merge(a, b, writes)  # Both know when each field was modified, so sync field by field
+
+        if writes and (writes.echo(a) or writes.echo(b)):
+            dest, source = (a, b) if writes.echo(a) else (b, a)
+            if writes.unchanged_since(source, writes.written(dest)):
+                logging.info(f'Skipping {a} and {b}: neither has changed since the sync last wrote to {dest}')
+                return False
+            logging.info(f'Syncing {dest} (written by the sync at {writes.written(dest)}) from {source} (updated at '
+                         f'{source.updated})')
+        elif a.updated > b.updated:  # a is the most current
             logging.info(f'Syncing {b} (updated at {b.updated}) from {a} (updated at {a.updated})')
-            Sync.sync_from_specified_source(a, b)  # use a as the source
+            source, dest = a, b  # use a as the source
         else:
             logging.info(f'Syncing {a} (updated at {a.updated}) from {b} (updated at {b.updated})')
-            Sync.sync_from_specified_source(b, a)
+            source, dest = b, a
+
+        Sync.sync_from_specified_source(source, dest)
+        if writes:
+            writes.record(dest)
+        return True
+
+    # The fields of a Jira issue and of a ZenHub issue that hold the same thing, which merge() syncs separately
+    merged_fields = (('status', 'pipeline'), ('story_points', 'story_points'), ('sprint_name', 'milestone_name'))
+
+    @staticmethod
+    def merge(a: 'Issue', b: 'Issue', writes: 'WriteLog' = None) -> bool:
+        """
+        Sync each field of a Jira issue and a ZenHub issue from the one it was modified in most recently, and write only
+        the fields that differ. Editing e.g. the summary of the Jira issue then doesn't make its older status overwrite
+        a newer pipeline move in ZenHub. Both issues must know when their fields were modified; see Issue.modified.
+        Epics are synced as a whole, since when their membership changed isn't known.
+        :param a: The Jira issue or the ZenHub issue of the pair
+        :param b: The other issue of the pair
+        :param writes: Optional. As for sync_from_most_current: if one issue still holds what the sync last wrote to it,
+                       every field that differs is synced from the other
+        :return: Whether anything was written
+        """
+        jira_issue, zenhub_issue = (a, b) if a.__class__.__name__ == 'JiraIssue' else (b, a)
+        echoes = [issue for issue in (jira_issue, zenhub_issue) if writes and writes.echo(issue)]
+        jira_values, zenhub_values = jira_issue.sync_fields(), zenhub_issue.sync_fields()
+
+        newer = {jira_issue: [], zenhub_issue: []}  # Fields of each issue to sync to the other
+        for jira_field, zenhub_field in Sync.merged_fields:
+            if not Sync._differs(jira_issue, zenhub_issue, jira_field, jira_values, zenhub_values):
+                continue
+            if len(echoes) == 2:
+                break
+            if echoes:
+                source = zenhub_issue if jira_issue in echoes else jira_issue
+            else:  # Ties go to ZenHub, as they do in sync_from_most_current
+                source = jira_issue if jira_issue.modified(jira_field) > zenhub_issue.modified(zenhub_field) \
+                    else zenhub_issue
+            newer[source].append(jira_field)
+
+        if not newer[jira_issue] and not newer[zenhub_issue]:
+            logging.info(f'Skipping {jira_issue} and {zenhub_issue}: no field differs or neither has changed since the '
+                         f'sync last wrote to it')
+            return False
+
+        Sync._write_fields(jira_issue, zenhub_issue, newer, writes)
+        return True
+
+    @staticmethod
+    def merge_with_base(jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue', base: dict,
+                        writes: 'WriteLog' = None) -> tuple:
+        """
+        Three-way merge of a pair against its base, the fields both issues held after the pair was last synced; see
+        SnapshotStore. A field that changed in only one issue since then is synced from it to the other. A field that
+        changed in both to values that don't match is a conflict, and is left as it is for someone to resolve instead
+        of one change overwriting the other. Fields that changed in neither issue are left alone. No timestamps are
+        needed to decide, so ZenHub's events aren't looked up.
+        :param jira_issue: The Jira issue of the pair
+        :param zenhub_issue: The ZenHub issue of the pair
+        :param base: The pair's base, as returned by SnapshotStore.base
+        :param writes: Optional. The issues that are written to are recorded in it; see sync_from_most_current
+        :return: Whether anything was written, and a list with the (Jira field, ZenHub field) of each conflict
+        """
+        jira_values, zenhub_values = jira_issue.sync_fields(), zenhub_issue.sync_fields()
+
+        newer = {jira_issue: [], zenhub_issue: []}  # Fields of each issue to sync to the other
+        conflicts = []
+        for jira_field, zenhub_field in Sync.merged_fields:
+            if not Sync._differs(jira_issue, zenhub_issue, jira_field, jira_values, zenhub_values):
+                continue
+            jira_changed = jira_values[jira_field] != base['jira'][jira_field]
+            zenhub_changed = zenhub_values[zenhub_field] != base['zenhub'][zenhub_field]
+            if jira_changed and zenhub_changed:
+                logging.warning(f'Conflict in {jira_issue} and {zenhub_issue}: {jira_field} was changed to '
+                                f'{jira_values[jira_field]!r} in Jira and {zenhub_field} to '
+                                f'{zenhub_values[zenhub_field]!r} in ZenHub since the last sync. Leaving both as they '
+                                f'are')
+                conflicts.append((jira_field, zenhub_field))
+            elif jira_changed or zenhub_changed:
+                newer[jira_issue if jira_changed else zenhub_issue].append(jira_field)
+            # A field that differs although neither side changed it was left differing by an earlier conflict
+
+        if not newer[jira_issue] and not newer[zenhub_issue]:
+            logging.info(f'Skipping {jira_issue} and {zenhub_issue}: no field changed in only one of them since the '
+                         f'last sync')
+            return False, conflicts
+
+        Sync._write_fields(jira_issue, zenhub_issue, newer, writes)
+        return True, conflicts
+
+    @staticmethod
+    def _differs(jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue', jira_field: str, jira_values: dict,
+                 zenhub_values: dict) -> bool:
+        """Return whether a pair holds different values in one of merged_fields, named by its Jira field"""
+
+        if jira_field == 'status':  # Either side's value is derived from the other's, so both must match
+            return (jira_issue.status, jira_issue.pipeline) != (zenhub_issue.status, zenhub_issue.pipeline)
+        if jira_field == 'story_points':  # ZenHub has no estimate for a Jira issue without story points
+            return (jira_values['story_points'] or 0) != (zenhub_values['story_points'] or 0)
+        return jira_values[jira_field] != zenhub_values[dict(Sync.merged_fields)[jira_field]]
+
+    @staticmethod
+    def _write_fields(jira_issue: 'JiraIssue', zenhub_issue: 'ZenHubIssue', newer: dict, writes: 'WriteLog' = None):
+        """
+        Sync the fields listed for each issue of a pair to the other issue, writing only those fields
+        :param newer: dict with the list of merged_fields, named by their Jira field, to sync from each issue
+        :param writes: Optional. The issues that are written to are recorded in it
+        """
+        for source, dest in ((jira_issue, zenhub_issue), (zenhub_issue, jira_issue)):
+            fields = newer[source]
+            if not fields:
+                continue
+            logging.info(f'Syncing {", ".join(fields)} of {dest} from {source}')
+            update = []
+            with dest.batch_writes():
+                if 'sprint_name' in fields:
+                    Sync.sync_sprints(source, dest)
+                if 'status' in fields:
+                    dest.status, dest.pipeline = source.status, source.pipeline
+                    update.append('pipeline' if dest is zenhub_issue else 'status')
+                if 'story_points' in fields:
+                    dest.story_points = source.story_points or 0 if dest is zenhub_issue else source.story_points
+                    update.append('story_points')
+                if update:
+                    dest.update_remote(update)
+            if writes:
+                writes.record(dest)
 
     @staticmethod
     def sync_epics(source: 'Issue', dest: 'Issue'):
@@ -123,6 +452,7 @@ class Sync:
         source_children = source.get_epic_children()
         sink_children = dest.get_epic_children()
 
+        add = []
         for issue in source_children:  # It could have 0 children
 
             # If a subset of all issues is being synced, it's possible that epics in the subset have children that
@@ -141,7 +471,7 @@ class Sync:
 
             if twin_key:
                 if twin_key not in sink_children:  # issue belongs to this epic in source but not dest yet,
-                    dest.change_epic_membership(add=twin_key)  # so add it as a child of dest
+                    add.append(twin_key)  # so add it as a child of dest
 
                 else:  # issue already belongs to this epic in both source and dest; remove it from the list so we can
                     sink_children.remove(twin_key)  # tell if any are left at the end
@@ -149,8 +479,10 @@ class Sync:
                 logging.warning(f'Cannot update issue {issue} epic membership in other management system - '
                                 f'no link identified')
 
-        for issue in sink_children:  # any issues left in this list do not belong to the epic in source,
-            dest.change_epic_membership(remove=issue)  # so they are removed from the epic in dest.
+        # Any issues left in sink_children do not belong to the epic in source, so they are removed from the epic in
+        # dest. All the changes are made together, in as few requests as the API allows.
+        if add or sink_children:
+            dest.change_epic_membership(add=add, remove=sink_children)
 
     @staticmethod
     def sync_sprints(source: 'Issue', dest: 'Issue'):
@@ -177,6 +509,8 @@ class Sync:
                     if sprint_id:
                         logger.debug(f'Sync sprint: Added issue {dest.jira_key} to sprint {milestone_title}')
                         dest.add_to_sprint(sprint_id)
+                        dest.sprint_name = milestone_title
+                        dest.sprint_id = sprint_id
                     else:
                         logger.warning(
                             f'Sync sprint: No Sprint ID found for {dest.jira_key} and sprint title {milestone_title}')
@@ -186,11 +520,10 @@ class Sync:
                     sprint_id = dest.get_sprint_id(source.milestone_name)
                     if sprint_id is not None:
                         logger.info(f'Sync sprint: Found sprint name {source.milestone_name} in Jira project')
-                        dest.remove_from_sprint()  # old sprint
                         dest.sprint_name = source.milestone_name
                         dest.sprint_id = sprint_id
                         logger.info(f'Jira issue {dest.jira_key} now part of sprint {dest.sprint_name}')
-                        dest.add_to_sprint(sprint_id)  # new sprint
+                        dest.add_to_sprint(sprint_id)  # Moves the issue out of its old sprint
                     else:
                         logger.warning(
                             f'Sync sprint: Cannot find sprint name {source.milestone_name} in the destination. '
@@ -215,6 +548,8 @@ class Sync:
                     if milestone_id:
                         logger.debug(f'Sync sprint: Adding issue {dest.github_key} to sprint {sprint_title}')
                         dest.add_to_milestone(milestone_id)
+                        dest.milestone_name = sprint_title
+                        dest.milestone_id = milestone_id
                     else:
                         logger.warning(
                             f'Sync sprint: No Sprint ID found for {dest.github_key} and sprint title {sprint_title}')
@@ -224,14 +559,63 @@ class Sync:
                     milestone_id = dest.get_milestone_id(source.sprint_name)
                     if milestone_id:
                         logger.info(f'Sync sprint: Found sprint name {source.sprint_name} in GitHub repo')
-                        dest.remove_from_milestone()
                         dest.milestone_name = source.sprint_name
                         dest.milestone_id = milestone_id
                         logger.info(f'GitHub issue {dest.github_key} now part of milestone {dest.milestone_name}')
-                        dest.add_to_milestone(milestone_id)
+                        dest.add_to_milestone(milestone_id)  # Replaces the old milestone
                     else:
                         logger.warning(
                             f'Sync sprint: Cannot find sprint name {source.sprint_name} in the destination. '
                             f'Association of issue {dest.milestone_id} will remain unchanged. Milestone name '
                             f'{dest.milestone_name} does not match sprint name {source.sprint_name} - sprint and '
                             f'milestone names must match!')
+
+
+class _PerPairLogs(logging.Handler):
+
+    def __init__(self):
+        """
+        A logging handler that holds back the records made by a thread while it syncs an issue pair, then passes them
+        on to the root logger's handlers all at once, so the records of pairs synced at the same time aren't
+        interleaved. Use it as a context manager around the thread pool. While it is active, the root logger's handlers
+        are given a filter that lets through only records that aren't being held back, so records made outside of
+        start_pair() and end_pair() are handled as usual.
+        """
+        super().__init__()
+        self.root = logging.getLogger()
+        self.handlers = []
+        self.local = threading.local()
+        self.forwarding = threading.Lock()
+
+    def __enter__(self) -> '_PerPairLogs':
+        self.handlers = list(self.root.handlers)
+        for handler in self.handlers:
+            handler.addFilter(self._not_held)
+        self.root.addHandler(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.root.removeHandler(self)
+        for handler in self.handlers:
+            handler.removeFilter(self._not_held)
+
+    def start_pair(self):
+        """Start holding back records made in this thread"""
+        self.local.records = []
+
+    def end_pair(self):
+        """Pass on the records held back in this thread since start_pair()"""
+        records, self.local.records = getattr(self.local, 'records', None) or [], None
+        with self.forwarding:
+            for record in records:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)  # Applies the handler's own filters, and _not_held lets it through now
+
+    def emit(self, record: logging.LogRecord):
+        records = getattr(self.local, 'records', None)
+        if records is not None:
+            records.append(record)
+
+    def _not_held(self, record: logging.LogRecord) -> bool:
+        return getattr(self.local, 'records', None) is None
@@ -1,11 +1,25 @@
 import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime
 import logging
+import multiprocessing
 import os
 import shlex
 import sys
+import threading
+import time
 sys.path.append('.')
 
+from settings import poll_intervals, rate_budgets, webhook_debounce
+from src import ratelimit
+from src.access import get_access_params
+from src.daemon import WebhookDaemon
+from src.github import GitHubRepo
 from src.jira import JiraIssue, JiraRepo
+from src.mirror import Mirror
+from src.plan import Plan
+from src.state import Checkpoint, FingerprintStore, HighWaterMarkStore, Journal, SnapshotStore, WriteLog
 from src.sync import Sync
 from src.zenhub import ZenHubIssue, ZenHubRepo
 
@@ -34,6 +48,31 @@ def main():
     # If the first argument is 'file', the next and only other argument should be a config file
     file_parser = subparsers.add_parser('file', help='use a config file to run sync commands for one or more repos')
     file_parser.add_argument('config_file', help='specify path to a JSON config file. see README for details')
+    file_parser.add_argument('-p', '--parallel', type=int, default=1,
+                             help='Number of repo pairs to sync at the same time. Defaults to 1.')
+    file_parser.add_argument('--processes', action='store_true',
+                             help='With --parallel, sync repo pairs in separate processes instead of threads')
+
+    # If the first argument is 'serve', keep the repo pairs in a config file in sync as webhooks report changes
+    serve_parser = subparsers.add_parser('serve', help='run a daemon that syncs the repo pairs in a config file as '
+                                                       'webhooks report changes to their issues')
+    serve_parser.add_argument('webhook_config', help='path to a config file listing the repo pairs, as for file')
+    serve_parser.add_argument('--host', default='127.0.0.1',
+                              help='Address to listen for webhooks on. Defaults to 127.0.0.1.')
+    serve_parser.add_argument('--port', type=int, default=8080,
+                              help='Port to listen for webhooks on. Defaults to 8080.')
+    serve_parser.add_argument('--debounce', type=float, default=webhook_debounce,
+                              help='Seconds to wait for an issue pair to stop changing before syncing it. Defaults to '
+                                   f'{webhook_debounce}.')
+
+    # If the first argument is 'poll', keep the repo pairs in a config file in sync by polling each on its own interval
+    poll_parser = subparsers.add_parser('poll', help='keep syncing the repo pairs in a config file, polling busy ones '
+                                                     'more often than idle ones')
+    poll_parser.add_argument('poll_config', help='path to a config file listing the repo pairs, as for file')
+    poll_parser.add_argument('--min-interval', type=float, default=poll_intervals[0],
+                             help=f'Seconds between polls of a busy repo pair. Defaults to {poll_intervals[0]}.')
+    poll_parser.add_argument('--max-interval', type=float, default=poll_intervals[1],
+                             help=f'Seconds between polls of an idle repo pair. Defaults to {poll_intervals[1]}.')
 
     # Alternatively if the first arg is 'repo', there are more options
     no_file_parser = subparsers.add_parser('repo', help='specify one repo to sync in the command line')
@@ -53,73 +92,605 @@ def main():
     filter_group.add_argument('-o', '--open_only', action='store_true', help='Only sync issues that are open in ZenHub')
     filter_group.add_argument('-jql', '--jira_query_language', help='Only sync issues that match this query in Jira')
     filter_group.add_argument('-zi', '--zenhub_issues', help='Only sync this list of ZenHub issues e.g. "1, 5, 3"')
+    filter_group.add_argument('-i', '--incremental', action='store_true',
+                              help='Only sync issues that changed since the last incremental run')
+    filter_group.add_argument('--mirror', action='store_true',
+                              help='Only sync issue pairs that are out of sync in a local mirror of both repos, '
+                                   'refreshed with the issues that changed since the last run with --mirror')
 
+    no_file_parser.add_argument('-w', '--workers', type=int, default=1,
+                                help='Number of issue pairs to sync at the same time. Defaults to 1.')
+    no_file_parser.add_argument('-f', '--force', action='store_true',
+                                help='Sync all issues, including those that are unchanged since they were last synced')
     no_file_parser.add_argument('-v', '--verbose', action='store_true', help='Write all log messages to the log file')
 
+    # These flags split a sync into planning the changes and making them
+    plan_group = no_file_parser.add_mutually_exclusive_group(required=False)
+    plan_group.add_argument('--plan-only', metavar='PLAN_FILE',
+                            help='Write the changes the sync would make to this JSON file instead of making them')
+    plan_group.add_argument('--apply', metavar='PLAN_FILE',
+                            help='Make the changes in a JSON file written by --plan-only instead of syncing')
+    plan_group.add_argument('--journal', action='store_true',
+                            help='Plan all changes first, then make them from a journal that --resume can continue')
+    plan_group.add_argument('--resume', action='store_true',
+                            help='Continue the changes of a run with --journal or --apply that was interrupted')
+
     args = parser.parse_args()  # Get the arguments that were entered
 
     if len(vars(args)) == 0:  # Show help message if no arguments are given
         parser.print_help()
         exit(2)
 
-    if 'config_file' in args:  # Use a config file and parse each command in the list as if entered in the command line
+    Checkpoint.enabled = True  # Let a run that is interrupted while loading repos be restarted from where it stopped
+
+    if 'webhook_config' in args:  # Sync each issue pair of the repo pairs in the config file as webhooks come in
+        with open(args.webhook_config, 'r') as f:
+            commands = [parser.parse_args(shlex.split(command)) for command in f.readlines() if command.strip()]
+        daemon = WebhookDaemon(commands, get_access_params('webhook')['api_token'], debounce=args.debounce)
+        daemon.serve(args.host, args.port)
+    elif 'poll_config' in args:  # Sync the repo pairs in the config file over and over
+        with open(args.poll_config, 'r') as f:
+            commands = [parser.parse_args(shlex.split(command)) for command in f.readlines() if command.strip()]
+        poll(commands, args.min_interval, args.max_interval)
+    elif 'config_file' in args:  # Use a config file and parse each command in it as if entered in the command line
         with open(args.config_file, 'r') as f:
-            for command in f.readlines():  # A list of strings
-                args = parser.parse_args(shlex.split(command))
-                run_synchronization(args)
+            commands = [parser.parse_args(shlex.split(command)) for command in f.readlines() if command.strip()]
+        # Repos synced by more than one command are loaded once. Processes can't share them, so they load their own.
+        shared = {} if args.processes else load_shared_repos(plan_shared_repos(commands))
+        if args.parallel > 1:
+            run_in_parallel(commands, args.parallel, processes=args.processes, shared=shared)
+        else:
+            for command in commands:
+                run_synchronization(command, shared)
     else:
         run_synchronization(args)
 
 
-def run_synchronization(args: 'Namespace'):
+def plan_shared_repos(commands: list) -> dict:
+    """
+    Decide which repos to load once and share between the commands of a config file. A repo is shared if more than one
+    command syncs it, and is loaded in the widest mode that any of them needs: all issues if any command syncs all of
+    them, or else only the open issues of a ZenHub repo if any command uses --open_only. Other commands take the issues
+    they need from the shared repo. Commands with --incremental, --mirror and Jira queries still load their own issues,
+    and commands that plan their changes use repos of their own.
+    :param commands: argparse Namespace objects holding the parsed arguments of each command
+    :return: 'all' or 'open' keyed by ('jira', repo) or ('zenhub', repo), e.g. {('jira', 'ucsc-cgl/TEST'): 'all'}
+    """
+    needs = defaultdict(list)
+    for args in commands:
+        if not (args.incremental or args.mirror or args.plan_only or args.apply or args.journal or args.resume):
+            full = not (args.open_only or args.zenhub_issues or args.jira_query_language)
+            needs[('jira', args.jira)].append('all' if full else None)
+            needs[('zenhub', args.zenhub)].append('all' if full else 'open' if args.open_only else None)
+
+    plan = dict()
+    for repo, modes in needs.items():
+        widest = 'all' if 'all' in modes else 'open' if 'open' in modes else None
+        if len(modes) > 1 and widest:
+            plan[repo] = widest
+    return plan
+
+
+def load_shared_repos(plan: dict) -> dict:
+    """
+    Load the repos that are shared between commands, all at the same time
+    :param plan: Modes to load repos in, as returned by plan_shared_repos
+    :return: JiraRepo and ZenHubRepo objects keyed like the plan
+    """
+    def load(repo: tuple, mode: str) -> 'Repo':
+        side, name = repo
+        org, repo_name = name.split('/')
+        logger.info(f'Loading {side} repo {name} once for all the commands that sync it')
+        if side == 'jira':
+            return JiraRepo(repo_name, org)
+        return ZenHubRepo(repo_name, org, open_only=mode == 'open')
+
+    with ThreadPoolExecutor(max_workers=max(len(plan), 1)) as pool:
+        return dict(zip(plan, pool.map(load, plan.keys(), plan.values())))
+
+
+def add_missing_zenhub_issues(zenhub_repo: 'ZenHubRepo', keys: list):
+    """
+    Retrieve the issues with the given keys that a ZenHub repo doesn't hold yet, e.g. closed issues in a shared repo
+    that was loaded with open issues only
+    :param zenhub_repo: The repo to add the issues to
+    :param keys: Keys of the issues that are needed
+    """
+    missing = [k for k in keys if k not in zenhub_repo.issues]
+    zenhub_repo.github_equivalent.get_issues(missing)
+    for key in missing:
+        try:
+            zenhub_repo.issues[key] = ZenHubIssue(repo=zenhub_repo, key=key)
+        except (RuntimeError, KeyError, ValueError) as e:
+            logger.warning(f'Cannot get information for issue {key}: {repr(e)}')
+
+
+def run_in_parallel(commands: list, parallel: int, processes: bool = False, shared: dict = None) -> list:
+    """
+    Run synchronization for several repo pairs at the same time, then log a summary. The log records of each pair go to
+    a log file of its own, and requests are kept within the rate budgets in settings.py across all pairs.
+    :param commands: argparse Namespace objects holding the parsed arguments for each repo pair
+    :param parallel: Number of repo pairs to sync at the same time
+    :param processes: Optional. Use a pool of processes instead of threads. Processes can't share a rate budget, so
+                      each one gets an equal share of it.
+    :param shared: Optional. Repos loaded once for several commands, as returned by load_shared_repos. Only for threads.
+    :return: list of (repo pair, counts returned by the sync or None, error or None), in the order of the commands
+    """
+    for handler in logging.getLogger().handlers:  # Leave the records of each pair out of the main log
+        handler.addFilter(lambda record: not record.threadName.startswith('pair-'))
+
+    if processes:
+        # Forking keeps the child processes from setting up logging again, which would truncate the main log
+        options = {'mp_context': multiprocessing.get_context('fork')} if sys.version_info >= (3, 7) else {}
+        pool = ProcessPoolExecutor(max_workers=parallel, **options)
+        shares = [1 / parallel] * len(commands)
+    else:
+        ratelimit.configure(rate_budgets)
+        pool = ThreadPoolExecutor(max_workers=parallel)
+        shares = [None] * len(commands)
+
+    with pool:
+        results = list(pool.map(sync_pair_with_own_log, range(len(commands)), commands, shares,
+                                [shared] * len(commands)))
+
+    for pair, counts, error in results:
+        if error:
+            logger.error(f'{pair}: stopped by {error}')
+        else:
+            logger.info(f"{pair}: synced {counts['processed']}, skipped {counts['skipped']}, "
+                        f"failed {len(counts['failed'])} issue pairs")
+    logger.info(f'Synchronized {sum(1 for pair, counts, error in results if not error)} of {len(results)} repo pairs')
+    return results
+
+
+def sync_pair_with_own_log(number: int, args: 'Namespace', share: float = None, shared: dict = None) -> tuple:
+    """
+    Run synchronization for one repo pair in the current thread, writing its log records to a log file of its own
+    :param number: Position of the repo pair in the config file, used to name the log file and threads
+    :param args: an argparse Namespace object holding the values of parsed arguments
+    :param share: Optional. If given, this is a separate process that uses this fraction of the rate budgets
+    :param shared: Optional. Repos loaded once for several commands, as returned by load_shared_repos
+    :return: the repo pair, the counts returned by the sync or None, and the error that stopped it or None
+    """
+    if share is not None:
+        ratelimit.configure(rate_budgets, share)
+
+    pair = f'{args.jira} {args.zenhub}'
+    name = f'pair-{number}'  # Threads started while syncing this pair are named after this one, e.g. pair-3_0
+    thread = threading.current_thread()
+    thread_name, thread.name = thread.name, name
+
+    handler = logging.FileHandler(f"{ROOT_DIR}/sync-agile-boards-{name}-{pair.replace('/', '-').replace(' ', '-')}.log",
+                                  mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    handler.addFilter(lambda record: record.threadName == name or record.threadName.startswith(f'{name}_'))
+    logging.getLogger().addHandler(handler)
+    try:
+        return pair, run_synchronization(args, shared), None
+    except Exception as e:  # One repo pair failing shouldn't stop the others
+        logger.exception(f'Synchronization of {pair} failed')
+        return pair, None, repr(e)
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+        thread.name = thread_name
+
+
+def run_synchronization(args: 'Namespace', shared: dict = None) -> dict:
     """
     Run synchronization as specified in the given command line arguments
     :param args: an argparse Namespace object holding the values of parsed arguments
+    :param shared: Optional. Repos loaded once for several commands, as returned by load_shared_repos. Issues are taken
+                   from these instead of being retrieved again.
+    :return: dict with the number of issue pairs that were processed and skipped, and the keys of source issues whose
+             pair failed to sync
     """
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)  # Show all log messages
 
     logger.info(f"Running synchronization with args {str(vars(args))}")
+    if args.apply or args.resume:
+        journal = Journal(f'{args.jira} {args.zenhub}')
+        if args.apply:
+            plan = Plan.load(args.apply)
+            journal.start(plan)
+        else:
+            plan = journal.unfinished()
+            if plan is None:
+                logger.info(f'Nothing to resume: no unfinished run of {args.jira} {args.zenhub} was found')
+                return {'processed': 0, 'skipped': 0, 'failed': []}
+        return apply_plan(plan, args, journal)
+    if args.plan_only or args.journal:  # Shared repos hold issues of other commands, whose changes would be made
+        shared = None
 
     j_org_name, j_repo_name = args.jira.split('/')
     z_org_name, z_repo_name = args.zenhub.split('/')
     if args.zenhub_issues:
-        zenhub_issues_list = args.zenhub_issues.split(",")
+        zenhub_issues_list = [key.strip() for key in args.zenhub_issues.split(",")]
     else:
         zenhub_issues_list = None
+    shared_jira = (shared or {}).get(('jira', args.jira))
+    shared_zenhub = (shared or {}).get(('zenhub', args.zenhub))
 
     if args.open_only or args.zenhub_issues:  # Only syncing a subset of issues that is defined in ZenHub
         # Get all ZenHub issues that match the filter - are open or are in a given list
-        zenhub_repo = ZenHubRepo(z_repo_name, z_org_name, issues=zenhub_issues_list, open_only=args.open_only)
-        jira_repo = JiraRepo(j_repo_name, j_org_name, empty=True)  # Make a JiraRepo with no issues
-        for issue in zenhub_repo.issues.values():  # Then add in each issue that has a match in the ZenHub subset
-            try:
-                jira_repo.issues[issue.jira_key] = JiraIssue(repo=jira_repo, key=issue.jira_key)
-            except RuntimeError as e:
-                logger.warning(f'Cannot get information for issue {issue.jira_key}: {e}')
+        if shared_zenhub:
+            keys = zenhub_issues_list or [k for k, issue in shared_zenhub.issues.items() if issue.pipeline != 'Closed']
+            add_missing_zenhub_issues(shared_zenhub, keys)
+            zenhub_repo = shared_zenhub.view(keys)
+        else:
+            zenhub_repo = ZenHubRepo(z_repo_name, z_org_name, issues=zenhub_issues_list, open_only=args.open_only)
+
+        if shared_jira:
+            keys = [issue.jira_key for issue in zenhub_repo.issues.values() if issue.jira_key]
+            shared_jira.get_issues([k for k in keys if k not in shared_jira.issues])
+            jira_repo = shared_jira.view(keys)
+        else:
+            jira_repo = JiraRepo(j_repo_name, j_org_name, empty=True)  # Make a JiraRepo with no issues
+            for issue in zenhub_repo.issues.values():  # Then add in each issue that has a match in the ZenHub subset
+                try:
+                    jira_repo.issues[issue.jira_key] = JiraIssue(repo=jira_repo, key=issue.jira_key)
+                except RuntimeError as e:
+                    logger.warning(f'Cannot get information for issue {issue.jira_key}: {e}')
 
     elif args.jira_query_language:  # Only syncing issues that match this Jira query
         # Get all Jira issues in the repo that match the query
         jira_repo = JiraRepo(j_repo_name, j_org_name, jql=args.jira_query_language)
-        zenhub_repo = ZenHubRepo(z_repo_name, z_org_name, issues=[])  # Make a ZenHubRepo with no issues
-        for issue in jira_repo.issues.values():  # Then add in each issue that has a match in the filtered Jira subset
-            try:
-                zenhub_repo.issues[issue.github_key] = ZenHubIssue(repo=zenhub_repo, key=issue.github_key)
-            except RuntimeError as e:
-                logger.warning(f'Cannot get information for issue {issue.github_key}: {e}')
+        if shared_zenhub:
+            keys = [issue.github_key for issue in jira_repo.issues.values() if issue.github_key]
+            add_missing_zenhub_issues(shared_zenhub, keys)
+            zenhub_repo = shared_zenhub.view(keys)
+        else:
+            zenhub_repo = ZenHubRepo(z_repo_name, z_org_name, issues=[])  # Make a ZenHubRepo with no issues
+            for issue in jira_repo.issues.values():  # Then add in each issue that has a match in the Jira subset
+                try:
+                    zenhub_repo.issues[issue.github_key] = ZenHubIssue(repo=zenhub_repo, key=issue.github_key)
+                except RuntimeError as e:
+                    logger.warning(f'Cannot get information for issue {issue.github_key}: {e}')
+
+    elif args.incremental:  # Only syncing issues that changed in either repo since the last incremental run
+        marks = HighWaterMarkStore(pair=f'{args.jira} {args.zenhub}')
+        run_started = datetime.datetime.now(datetime.timezone.utc)
+        if marks.since:
+            jira_repo, zenhub_repo, board, retry = load_changed_issues(args.jira, args.zenhub, marks.since,
+                                                                       marks.board, marks.retry)
+        else:  # The first incremental run has to get everything
+            jira_repo, zenhub_repo = load_repos(lambda: JiraRepo(j_repo_name, j_org_name),
+                                                lambda: ZenHubRepo(z_repo_name, z_org_name))
+            board = zenhub_repo.get_board_snapshot()
+            retry = {'jira': [], 'zenhub': []}
+
+    elif args.mirror:  # Only syncing pairs that are out of sync in the local mirror, once it has been refreshed
+        mirror = Mirror()
+        run_started = datetime.datetime.now(datetime.timezone.utc)
+        jira_repo, zenhub_repo, board, retry, in_sync = load_from_mirror(mirror, args)
+
+    else:  # Syncing all issues in both repos, which shared repos are always loaded with
+        def load_jira() -> 'JiraRepo':
+            return shared_jira.view() if shared_jira else JiraRepo(j_repo_name, j_org_name)
+
+        def load_zenhub() -> 'ZenHubRepo':
+            return shared_zenhub.view() if shared_zenhub else ZenHubRepo(z_repo_name, z_org_name)
 
-    else:  # Syncing all issues in both repos
-        jira_repo = JiraRepo(j_repo_name, j_org_name)
-        zenhub_repo = ZenHubRepo(z_repo_name, z_org_name)
+        jira_repo, zenhub_repo = load_repos(load_jira, load_zenhub)
 
+    # When planning, changes are added to the plan instead of being made
+    plan = Plan(args.jira, args.zenhub) if args.plan_only or args.journal else None
+    jira_repo.plan = zenhub_repo.plan = plan
+
+    # Remember which issue pairs were synced so that unchanged ones can be skipped next time. If the changes are only
+    # planned, nothing is remembered until they are made.
+    direction = '-j' if args.j else '-z' if args.z else '-m'
+    fingerprints = None if args.force or args.plan_only else FingerprintStore(
+        pair=f'{args.jira} {args.zenhub} {direction}')
+    # Remember what a mirror sync writes, so that the next one doesn't take our own writes for changes to sync back
+    writes = WriteLog(pair=f'{args.jira} {args.zenhub}') if fingerprints and direction == '-m' else None
+    # and what each pair held after it, which the next one merges changes against
+    snapshots = SnapshotStore(pair=f'{args.jira} {args.zenhub}') if writes else None
+    for store in (fingerprints, writes, snapshots):
+        if store and plan:
+            store.held = True
+
+    counts, retry_side = sync_repos(args, jira_repo, zenhub_repo, fingerprints, writes, snapshots)
+
+    if args.plan_only:
+        plan.optimize().save(args.plan_only)
+        logger.info("Synchronization finished")
+        return counts
+
+    if args.journal:  # Make the planned changes, journaling each one so that an interruption can be resumed
+        jira_repo.plan = zenhub_repo.plan = None
+        plan = plan.optimize()
+        journal = Journal(f'{args.jira} {args.zenhub}')
+        journal.start(plan)
+        made = plan.execute(jira_repo, zenhub_repo, done=journal.done)
+        journal.finish()
+        for issue in failed_pairs(made['failed'], jira_repo, zenhub_repo):
+            key = issue.github_key if retry_side == 'zenhub' else issue.jira_key
+            if fingerprints:
+                fingerprints.forget(issue)
+            if writes:
+                writes.forget(issue)
+            if snapshots:
+                snapshots.forget(issue)
+            if key not in counts['failed']:
+                counts['processed'] -= 1
+                counts['failed'].append(key)
+        for store in (fingerprints, writes, snapshots):
+            if store:
+                store.held = False
+                store.save()
+
+    if args.mirror and not args.plan_only:  # Mirror the values that were written, which the next run compares
+        mirror.store(f'jira {args.jira}', jira_repo.issues.values())
+        mirror.store(f'zenhub {args.zenhub}', zenhub_repo.issues.values())
+        retry[retry_side].extend(counts['failed'])  # Failed issues are refreshed from the repos next time
+        mirror.record(f'{args.jira} {args.zenhub}', run_started, board, retry)
+        counts['skipped'] += in_sync
+    if args.mirror:
+        mirror.close()
+
+    if args.incremental:  # The next incremental run picks up from when this one started, plus the failed issues
+        retry[retry_side].extend(counts['failed'])
+        marks.record(run_started, board, retry)
+        marks.save()
+    logger.info("Synchronization finished")
+    return counts
+
+
+def sync_repos(args: 'Namespace', jira_repo: 'JiraRepo', zenhub_repo: 'ZenHubRepo',
+               fingerprints: 'FingerprintStore' = None, writes: 'WriteLog' = None,
+               snapshots: 'SnapshotStore' = None) -> tuple:
+    """
+    Sync the issue pairs of two repos in the direction given in the command line arguments
+    :param args: an argparse Namespace object holding the values of parsed arguments
+    :param jira_repo: JiraRepo holding the Jira issues
+    :param zenhub_repo: ZenHubRepo holding the ZenHub issues
+    :param fingerprints: Optional. If given, skip issue pairs that haven't changed since they were last synced
+    :param writes: Optional. If given, a mirror sync tells updates made by its own writes apart from real ones
+    :param snapshots: Optional. If given, a mirror sync merges each pair against what it held after its last sync
+    :return: the counts returned by the sync, and 'jira' or 'zenhub', the side whose keys the failed pairs are given by
+    """
     if args.j:
-        Sync.sync_board(source=jira_repo, dest=zenhub_repo)
+        return Sync.sync_board(source=jira_repo, dest=zenhub_repo, fingerprints=fingerprints,
+                               workers=args.workers), 'jira'
     elif args.z:
-        Sync.sync_board(source=zenhub_repo, dest=jira_repo)
-    else:
-        Sync.mirror_sync(jira_repo=jira_repo, zenhub_repo=zenhub_repo)
+        return Sync.sync_board(source=zenhub_repo, dest=jira_repo, fingerprints=fingerprints,
+                               workers=args.workers), 'zenhub'
+    return Sync.mirror_sync(jira_repo=jira_repo, zenhub_repo=zenhub_repo, fingerprints=fingerprints,
+                            workers=args.workers, writes=writes, snapshots=snapshots), 'jira'
+
+
+def apply_plan(plan: 'Plan', args: 'Namespace', journal: 'Journal') -> dict:
+    """
+    Make the changes in a plan written by --plan-only or left unfinished in a journal. Only the issues the plan changes
+    are retrieved.
+    :param plan: The plan to carry out
+    :param args: an argparse Namespace object holding the values of parsed arguments. The repos must be those the plan
+                 was made for.
+    :param journal: Journal holding the plan, in which each change is marked done once it has been made
+    :return: dict with the number of changes that were made and skipped, and the keys of issues whose changes failed
+    """
+    if (plan.jira, plan.zenhub) != (args.jira, args.zenhub):
+        raise ValueError(f'The plan is for {plan.jira} {plan.zenhub}, not {args.jira} {args.zenhub}')
+
+    j_org_name, j_repo_name = args.jira.split('/')
+    z_org_name, z_repo_name = args.zenhub.split('/')
+    keys = {side: list(dict.fromkeys(m['key'] for m in plan.mutations if m['side'] == side))
+            for side in ('jira', 'zenhub')}
+
+    def load_jira() -> 'JiraRepo':
+        jira_repo = JiraRepo(j_repo_name, j_org_name, empty=True)
+        jira_repo.get_issues(keys['jira'])
+        return jira_repo
+
+    jira_repo, zenhub_repo = load_repos(load_jira, lambda: ZenHubRepo(z_repo_name, z_org_name, issues=[]))
+    add_missing_zenhub_issues(zenhub_repo, keys['zenhub'])
+    counts = plan.execute(jira_repo, zenhub_repo, done=journal.done)
+    journal.finish()
     logger.info("Synchronization finished")
+    return counts
+
+
+def failed_pairs(keys: list, jira_repo: 'JiraRepo', zenhub_repo: 'ZenHubRepo') -> list:
+    """
+    Find the issue pairs that Jira or ZenHub issues whose changes failed belong to
+    :param keys: Keys of Jira and ZenHub issues
+    :param jira_repo: JiraRepo holding the Jira issues
+    :param zenhub_repo: ZenHubRepo holding the ZenHub issues
+    :return: The Jira issue of each pair
+    """
+    pairs = []
+    for key in keys:
+        if key in zenhub_repo.issues:
+            key = zenhub_repo.issues[key].jira_key
+        if key in jira_repo.issues and jira_repo.issues[key] not in pairs:
+            pairs.append(jira_repo.issues[key])
+    return pairs
+
+
+def load_repos(load_jira, load_zenhub) -> tuple:
+    """
+    Load the Jira repo and the ZenHub repo at the same time, and log how long each took. The two are retrieved from
+    different hosts and don't depend on each other, so the wait is that of the slower one rather than of both.
+    :param load_jira: Function that returns a JiraRepo
+    :param load_zenhub: Function that returns a ZenHubRepo
+    :return: the JiraRepo and the ZenHubRepo
+    """
+    def timed(side: str, load) -> 'Repo':
+        started = time.monotonic()
+        repo = load()
+        logger.info(f'Loaded {len(repo.issues)} issues from {side} repo {repo.name} in '
+                    f'{time.monotonic() - started:.1f} seconds')
+        return repo
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix=threading.current_thread().name) as pool:
+        jira_repo = pool.submit(timed, 'Jira', load_jira)
+        zenhub_repo = pool.submit(timed, 'ZenHub', load_zenhub)
+        return jira_repo.result(), zenhub_repo.result()
+
+
+def load_changed_issues(jira: str, zenhub: str, since: datetime.datetime, previous_board: dict,
+                        retry: dict = None, repos: tuple = None) -> tuple:
+    """
+    Get the issues that changed in either repo since the given time, along with their counterparts in the other repo
+    :param jira: Jira organization and repo separated by a forward slash
+    :param zenhub: ZenHub organization and repo separated by a forward slash
+    :param since: Issues updated at or after this time are retrieved
+    :param previous_board: ZenHub board snapshot from the last run, to find pipeline and estimate changes
+    :param retry: Optional. Keys of issues that failed during the last run, as lists under 'jira' and 'zenhub'. These
+                  are retrieved whether or not they changed.
+    :param repos: Optional. A JiraRepo and ZenHubRepo to refresh, e.g. kept from the last poll, so that their repo IDs,
+                  pipelines and lookups don't have to be retrieved again. Their issues are replaced.
+    :return: a JiraRepo, a ZenHubRepo, the current ZenHub board snapshot, and the keys of issues that couldn't be
+             retrieved, as lists under 'jira' and 'zenhub'
+    """
+    j_org_name, j_repo_name = jira.split('/')
+    z_org_name, z_repo_name = zenhub.split('/')
+    retry = retry or {'jira': [], 'zenhub': []}
+
+    if repos:
+        jira_repo, zenhub_repo = repos
+        jira_repo.issues, zenhub_repo.issues = dict(), dict()
+        jira_repo.get_updated_issues(since)
+    else:
+        jira_repo, zenhub_repo = load_repos(lambda: JiraRepo(j_repo_name, j_org_name, updated_since=since),
+                                            lambda: ZenHubRepo(z_repo_name, z_org_name, issues=[]))  # No issues yet
+    jira_repo.get_issues([k for k in retry['jira'] if k not in jira_repo.issues])
+    board = zenhub_repo.get_board_snapshot()
+
+    # Issues edited in GitHub, moved or re-estimated in ZenHub, or whose Jira counterpart changed
+    zenhub_repo.github_equivalent = GitHubRepo(z_repo_name, z_org_name, updated_since=since)
+    changed = set(zenhub_repo.github_equivalent.issues)
+    changed.update(k for k in board.keys() | previous_board.keys() if board.get(k) != previous_board.get(k))
+    changed.update(issue.github_key for issue in jira_repo.issues.values() if issue.github_key)
+    # Adding or removing an epic's child changes neither issue's timestamp nor the board, so epics are always synced
+    changed.update(k for k, (pipeline, estimate, is_epic) in board.items() if is_epic)
+    changed.update(retry['zenhub'])
+    logger.info(f'Found {len(jira_repo.issues)} changed Jira issues and {len(changed)} changed or linked ZenHub issues')
+
+    unavailable = {'jira': [k for k in retry['jira'] if k not in jira_repo.issues], 'zenhub': []}
+    zenhub_repo.github_equivalent.get_issues(list(changed))  # Get the GitHub side of the rest in bulk
+    for key in changed:
+        try:
+            zenhub_repo.issues[key] = ZenHubIssue(repo=zenhub_repo, key=key)
+        except (RuntimeError, KeyError, ValueError) as e:
+            logger.warning(f'Cannot get information for issue {key}: {repr(e)}')
+            unavailable['zenhub'].append(key)
+
+    # Then get the Jira counterparts of ZenHub issues that changed, in as few requests as possible
+    counterparts = [issue.jira_key for issue in zenhub_repo.issues.values()
+                    if issue.jira_key and issue.jira_key not in jira_repo.issues]
+    jira_repo.get_issues(counterparts)
+    unavailable['jira'].extend(k for k in counterparts if k not in jira_repo.issues)
+
+    return jira_repo, zenhub_repo, board, unavailable
+
+
+def poll(commands: list, min_interval: float = poll_intervals[0], max_interval: float = poll_intervals[1]):
+    """
+    Keep repo pairs in sync by polling each one for changes on an interval of its own, forever. A pair that had changes
+    in its last poll is polled again twice as soon, down to min_interval, and one that didn't twice as late, up to
+    max_interval, so busy pairs are synced within seconds while idle ones cost a few requests now and then. Each poll
+    retrieves only the issues that changed since the last one, as --incremental does, and the repos are kept between
+    polls. Requests of all pairs are kept within the rate budgets in settings.py.
+    :param commands: argparse Namespace objects holding the parsed arguments for each repo pair. The filter flags of
+                     each are ignored.
+    :param min_interval: Optional. Seconds between polls of a pair that keeps changing
+    :param max_interval: Optional. Seconds between polls of a pair that doesn't change
+    """
+    ratelimit.configure(rate_budgets)
+    pairs = []
+    for args in commands:
+        direction = '-j' if args.j else '-z' if args.z else '-m'
+        pairs.append({'args': args, 'interval': min_interval, 'due': time.monotonic(), 'mark': None, 'repos': None,
+                      'fingerprints': None if args.force else FingerprintStore(
+                          pair=f'{args.jira} {args.zenhub} {direction}'),
+                      'writes': None if args.force or direction != '-m' else WriteLog(
+                          pair=f'{args.jira} {args.zenhub}'),
+                      'snapshots': None if args.force or direction != '-m' else SnapshotStore(
+                          pair=f'{args.jira} {args.zenhub}')})
+    while True:
+        pair = min(pairs, key=lambda p: p['due'])
+        time.sleep(max(pair['due'] - time.monotonic(), 0))
+        try:
+            changed = poll_pair(pair)
+        except Exception:  # One repo pair failing shouldn't stop the others
+            logger.exception(f"Polling {pair['args'].jira} {pair['args'].zenhub} failed")
+            changed = False
+        pair['interval'] = max(pair['interval'] / 2, min_interval) if changed else \
+            min(pair['interval'] * 2, max_interval)
+        pair['due'] = time.monotonic() + pair['interval']
+        logger.info(f"Polling {pair['args'].jira} {pair['args'].zenhub} again in {pair['interval']:.0f} seconds")
+
+
+def poll_pair(pair: dict) -> bool:
+    """
+    Retrieve the issues of a repo pair that changed since it was last polled, or all of them the first time, and sync
+    them
+    :param pair: The state poll keeps for the pair: its parsed arguments, high-water 'mark', 'repos', 'fingerprints',
+                 'writes' and 'snapshots'
+    :return: Whether any issue changed
+    """
+    args = pair['args']
+    j_org_name, j_repo_name = args.jira.split('/')
+    z_org_name, z_repo_name = args.zenhub.split('/')
+    run_started = datetime.datetime.now(datetime.timezone.utc)
+    if pair['mark']:
+        since, previous_board, retry = pair['mark']
+        jira_repo, zenhub_repo, board, retry = load_changed_issues(args.jira, args.zenhub, since, previous_board,
+                                                                   retry, repos=pair['repos'])
+        # Epics are retrieved every time, whether or not they changed, and issues the last poll wrote to come back
+        # without changing unless someone changed them since
+        writes = pair['writes']
+        changed = any(issue.issue_type != 'Epic' and not (writes and writes.echo(issue))
+                      for repo in (jira_repo, zenhub_repo) for issue in repo.issues.values())
+    else:
+        jira_repo, zenhub_repo = load_repos(lambda: JiraRepo(j_repo_name, j_org_name),
+                                            lambda: ZenHubRepo(z_repo_name, z_org_name))
+        board = zenhub_repo.get_board_snapshot()
+        retry = {'jira': [], 'zenhub': []}
+        changed = True
+
+    counts, retry_side = sync_repos(args, jira_repo, zenhub_repo, pair['fingerprints'], pair['writes'],
+                                    pair['snapshots'])
+    retry[retry_side].extend(counts['failed'])
+    pair['mark'], pair['repos'] = (run_started, board, retry), (jira_repo, zenhub_repo)
+    return changed
+
+
+def load_from_mirror(mirror: 'Mirror', args: 'Namespace') -> tuple:
+    """
+    Refresh the local mirror with the issues that changed in either repo since the last run with --mirror, or with all
+    issues the first time, then get the issue pairs that are out of sync in it
+    :param mirror: The mirror of both repos
+    :param args: an argparse Namespace object holding the values of parsed arguments
+    :return: a JiraRepo and a ZenHubRepo holding the pairs that are out of sync, the current ZenHub board snapshot, the
+             keys of issues that couldn't be retrieved, as lists under 'jira' and 'zenhub', and the number of pairs
+             that are in sync
+    """
+    j_org_name, j_repo_name = args.jira.split('/')
+    z_org_name, z_repo_name = args.zenhub.split('/')
+    mark = mirror.mark(f'{args.jira} {args.zenhub}')
+    if mark:
+        jira_repo, zenhub_repo, board, retry = load_changed_issues(args.jira, args.zenhub, mark['since'],
+                                                                   mark['board'], mark['retry'])
+    else:  # The first run has to get everything
+        jira_repo, zenhub_repo = load_repos(lambda: JiraRepo(j_repo_name, j_org_name),
+                                            lambda: ZenHubRepo(z_repo_name, z_org_name))
+        board = zenhub_repo.get_board_snapshot()
+        retry = {'jira': [], 'zenhub': []}
+    mirror.store(f'jira {args.jira}', jira_repo.issues.values())
+    mirror.store(f'zenhub {args.zenhub}', zenhub_repo.issues.values())
+
+    # Only the pairs that are out of sync are synced, and those that didn't change still have to be retrieved
+    direction = '-j' if args.j else '-z' if args.z else '-m'
+    pairs, in_sync = mirror.compare(args.jira, args.zenhub, direction)
+    jira_keys, zenhub_keys = [j for j, z in pairs], [z for j, z in pairs]
+    jira_repo.get_issues([k for k in jira_keys if k not in jira_repo.issues])
+    add_missing_zenhub_issues(zenhub_repo, zenhub_keys)
+    return jira_repo.view(jira_keys), zenhub_repo.view(zenhub_keys), board, retry, in_sync
 
 
 if __name__ == '__main__':
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import datetime
+from functools import lru_cache
+
+UTC = datetime.timezone.utc
+
+try:
+    _fromisoformat = datetime.datetime.fromisoformat
+except AttributeError:  # Python 3.6
+    def _fromisoformat(timestamp: str) -> datetime.datetime:
+        return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+
+
+@lru_cache(maxsize=None)
+def utc_offset(offset: str) -> datetime.timezone:
+    """
+    Return a timezone object for a UTC offset. There are only a few offsets, so each is made once and shared.
+    :param offset: The offset in the format (+/-)HHMM, e.g. '-0800'
+    """
+    sign = -1 if offset[0] == '-' else 1
+    return datetime.timezone(sign * datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+
+
+def parse_jira_timestamp(timestamp: str) -> datetime.datetime:
+    """
+    Convert a Jira timestamp like '2019-02-05T14:52:11.501-0800' into a datetime object with its UTC offset. The
+    milliseconds are dropped.
+    """
+    return _fromisoformat(timestamp[:19]).replace(tzinfo=utc_offset(timestamp[-5:]))
+
+
+def parse_utc_timestamp(timestamp: str) -> datetime.datetime:
+    """
+    Convert a UTC timestamp like '2019-02-21T19:37:18Z' or '2019-05-08T22:13:43.123Z', as GitHub and ZenHub give them
+    and as the local state is stored, into a datetime object in UTC. The milliseconds are dropped.
+    """
+    return _fromisoformat(timestamp[:19]).replace(tzinfo=UTC)
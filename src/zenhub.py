@@ -1,14 +1,16 @@
 #!/usr/env/python3
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import logging
-import pytz
 import requests
 import sys
+import threading
 from tqdm import tqdm
 
 from src.access import get_access_params
 from src.issue import Repo, Issue
 from src.github import GitHubRepo, GitHubIssue
+from src.timestamps import UTC, parse_utc_timestamp
 from src.utilities import get_jira_status, _get_repo_url
 
 sys.path.append('.')
@@ -33,18 +35,29 @@ class ZenHubRepo(Repo):
 
         self.name = repo_name
         self.org = org
-        self.id = self.get_repo_id()
-        self.pipeline_ids = self._get_pipeline_ids()
-        self.github_equivalent = GitHubRepo(repo_name=self.name, org=self.org, issues=[])
 
-        if issues is not None:  # Only get information for a subset of issues
-            for i in tqdm(issues, desc='getting ZenHub issues'):  # progress bar
-                self.issues[i] = ZenHubIssue(repo=self, key=i)
+        with self.checkpointed(f'zenhub {self.org}/{self.name}'):
+            if issues is None and not open_only:
+                # The GitHub listing of all issues doesn't depend on the ZenHub repo, so get it at the same time
+                with ThreadPoolExecutor(max_workers=1, thread_name_prefix=threading.current_thread().name) as pool:
+                    listing = pool.submit(GitHubRepo, repo_name=self.name, org=self.org)
+                    self.id = self.get_repo_id()
+                    self.pipeline_ids = self._get_pipeline_ids()
+                    self.github_equivalent = listing.result()
+            else:
+                self.id = self.get_repo_id()
+                self.pipeline_ids = self._get_pipeline_ids()
+                self.github_equivalent = GitHubRepo(repo_name=self.name, org=self.org, issues=[])
 
-        elif open_only:
-            self.get_open_issues()  # Only get issues that are open
-        else:
-            self.get_all_issues()  # By default, get all issues in the repo
+            if issues is not None:  # Only get information for a subset of issues
+                self.github_equivalent.get_issues(issues)  # Get the GitHub side of all of them in bulk first
+                for i in tqdm(issues, desc='getting ZenHub issues'):  # progress bar
+                    self.issues[i] = ZenHubIssue(repo=self, key=i)
+
+            elif open_only:
+                self.get_open_issues()  # Only get issues that are open
+            else:
+                self.get_all_issues()  # By default, get all issues in the repo
 
     def get_all_issues(self):
         """Retrieve all issues, open or closed"""
@@ -52,14 +65,17 @@ class ZenHubRepo(Repo):
         # But it can return information about closed issues when queried with their key
         # GitHub's API will return all issues in a repo, open or closed
         # So GitHub is used here to get a list of all issues. Then the ZenHub API is asked about each one individually.
-        g = GitHubRepo(repo_name=self.name, org=self.org)
-        for key, issue in tqdm(g.issues.items(), desc='getting ZenHub issues'):  # progress bar
+        # The GitHub information in the list is kept so it doesn't need to be requested again for each issue. The list
+        # is retrieved in __init__, alongside the ZenHub repo ID and pipelines.
+        for key, issue in tqdm(self.github_equivalent.issues.items(), desc='getting ZenHub issues'):  # progress bar
             self.issues[key] = ZenHubIssue(key=key, repo=self)
 
     def get_open_issues(self):
         """Retrieve all open issues in this repo thru the ZenHub API"""
 
         content = self.api_call(requests.get, f'{self.id}/board')
+        self.github_equivalent.get_issues([str(issue['issue_number']) for pipeline in content['pipelines']
+                                           for issue in pipeline['issues']])
 
         # progress bar, only shows number of pipelines not number of issues
         for pipeline in tqdm(content['pipelines'], desc='getting ZenHub issues by pipeline'):
@@ -67,6 +83,18 @@ class ZenHubRepo(Repo):
                 issue['pipeline'] = {'name': pipeline['name']}  # Add in the pipeline info to the sub-dictionary
                 self.issues[str(issue['issue_number'])] = ZenHubIssue(repo=self, content=issue)
 
+    def get_board_snapshot(self) -> dict:
+        """
+        Return the pipeline, estimate and epic status of every open issue on the board, keyed by issue number.
+
+        ZenHub has no repo-wide list of events, and moving an issue between pipelines or changing its estimate doesn't
+        change its GitHub timestamp. Comparing two snapshots is how changes like these are detected in one request.
+        """
+        content = self.api_call(requests.get, f'{self.id}/board')
+        return {str(issue['issue_number']): [pipeline['name'], issue.get('estimate', {}).get('value'),
+                                             issue.get('is_epic', False)]
+                for pipeline in content['pipelines'] for issue in pipeline['issues']}
+
     def _get_pipeline_ids(self):
         """Determine the valid pipeline IDs for this repo"""
 
@@ -95,6 +123,7 @@ class ZenHubIssue(Issue):
 
         super().__init__()
         self.repo = repo
+        self._updated = self._field_updated = None  # Looked up from the events once needed; see updated
 
         if not content:
             if key:
@@ -117,25 +146,69 @@ class ZenHubIssue(Issue):
         else:
             self.issue_type = 'Story'
 
-        self.github_equivalent = GitHubIssue(key=self.github_key, repo=self.repo.github_equivalent)
+        # Use the GitHub information if it was already retrieved along with other issues, otherwise get it now
+        self.github_equivalent = self.repo.github_equivalent.issues.get(str(self.github_key)) or \
+            GitHubIssue(key=self.github_key, repo=self.repo.github_equivalent)
 
         # Fill in the missing information for this issue that's in GitHub but not ZenHub
         self.update_from(self.github_equivalent)
-
-        # Get the most current update timestamp for this issue, whether in GitHub or ZenHub
-        # Changes to pipeline and estimate are not reflected in GitHub, so ZenHub events must be checked
-        self.updated = max(self.github_equivalent.updated, self.get_most_recent_event())
         self.status = get_jira_status(self)
 
-    def update_remote(self):
-        """Push the changes to the remote issue in ZenHub"""
+    @property
+    def updated(self) -> datetime.datetime:
+        """
+        The most current update timestamp for this issue, whether in GitHub or ZenHub. Changes to pipeline and estimate
+        are not reflected in GitHub, so ZenHub events must be checked. They are only looked up the first time this or
+        field_updated is needed, since a sync that doesn't compare timestamps has no use for them.
+        """
+        if self._updated is None:
+            self._get_event_times()
+        return self._updated
+
+    @updated.setter
+    def updated(self, value: datetime.datetime):
+        self._updated = value
+
+    @property
+    def field_updated(self) -> dict:
+        """When the pipeline, estimate and milestone were last changed; see get_field_updated"""
+
+        if self._field_updated is None:
+            self._get_event_times()
+        return self._field_updated
+
+    @field_updated.setter
+    def field_updated(self, value: dict):
+        self._field_updated = value
 
+    def _get_event_times(self):
+        """Look up the events of this issue and set the timestamps that are derived from them"""
+
+        events = self.get_events()
+        self._updated = max(self.github_equivalent.updated, self.get_most_recent_event(events))
+        self._field_updated = self.get_field_updated(events)
+
+    def batch_writes(self):
+        """Hold back writes to the GitHub issue made inside a with block; see Issue.batch_writes"""
+
+        return self.github_equivalent.batch_writes()
+
+    def update_remote(self, fields: list = None):
+        """
+        Push the changes to the remote issue in ZenHub
+        :param fields: Optional. Only update these of 'story_points' and 'pipeline'. By default, both are updated.
+        """
         # Points and pipeline can be updated thru ZenHub's API
-        self._update_issue_points()
-        self._update_issue_pipeline()
+        if fields is None or 'story_points' in fields:
+            self._update_issue_points()
+        if fields is None or 'pipeline' in fields:
+            self._update_issue_pipeline()
 
     def _update_issue_points(self):
         """Update the remote issue's points estimate to the value currently held by the Issue object"""
+
+        if self.repo.planned('set_points', self.github_key, self.story_points):
+            return
         logger.debug(f"Updating ZenHub issue {self.github_key}'s points value to {self.story_points}")
         json_dict = {'estimate': self.story_points}
         self.repo.api_call(requests.put, f'{self.repo.id}/issues/{self.github_key}/estimate', json=json_dict)
@@ -148,8 +221,11 @@ class ZenHubIssue(Issue):
 
         logger.debug(f'Updating ZenHub issue {self.github_key} pipeline to {self.pipeline}')
         if self.pipeline in self.repo.pipeline_ids:
+            if self.repo.planned('move_pipeline', self.github_key, self.pipeline):
+                return
             if self.pipeline != 'Closed':  # Moving between pipelines doesn't work if the issue is closed
                 self.github_equivalent.open()
+            self.github_equivalent.flush_writes()  # e.g. reopening the issue has to be done before the move
 
             json_dict = {'pipeline_id': self.repo.pipeline_ids[self.pipeline], 'position': 'top'}
             self.repo.api_call(requests.post, f'{self.repo.id}/issues/{self.github_key}/moves', json=json_dict)
@@ -160,6 +236,8 @@ class ZenHubIssue(Issue):
     def promote_issue_to_epic(self):
         """Convert an issue to an epic"""
 
+        if self.repo.planned('promote', self.github_key):
+            return
         logger.debug(f'Promoting ZenHub issue {self.github_key} to epic')
         json_dict = {'issues': [{'repo_id': self.repo.id, 'issue_number': self.github_key}]}
         self.repo.api_call(requests.post, f'{self.repo.id}/issues/{self.github_key}/convert_to_epic', json=json_dict)
@@ -167,6 +245,8 @@ class ZenHubIssue(Issue):
     def demote_epic_to_issue(self):
         """Convert an epic into a regular issue"""
 
+        if self.repo.planned('demote', self.github_key):
+            return
         logger.debug(f'Demoting ZenHub epic {self.github_key} to issue')
         json_dict = {'issues': [{'repo_id': self.repo.id, 'issue_number': self.github_key}]}
         self.repo.api_call(requests.post, f'{self.repo.id}/epics/{self.github_key}/convert_to_issue', json=json_dict)
@@ -174,51 +254,85 @@ class ZenHubIssue(Issue):
     def get_epic_children(self) -> list:
         """Return a list of all issues that belong to this epic. Self must be an epic."""
 
+        if self.repo.plan is not None and self.repo.plan.has(self.repo, 'promote', self.github_key):
+            return []  # Only planned to become an epic, so it has no children yet
         content = self.repo.api_call(requests.get, f'{self.repo.id}/epics/{self.github_key}')
         return [str(i['issue_number']) for i in content['issues']]  # Convert int to str for consistency
 
-    def change_epic_membership(self, add: str = None, remove: str = None):
+    def change_epic_membership(self, add: list = None, remove: list = None):
         """
-        Add a given issue to or remove it from this epic in ZenHub. ZenHub issues can belong to multiple epics.
-        :param add: If specified, add the given issue as a child of self
-        :param remove: If specified, remove the given issue from self epic
+        Add the given issues to this epic in ZenHub and remove others from it, all in one request. ZenHub issues can
+        belong to multiple epics.
+        :param add: Optional. Numbers of issues to make children of self
+        :param remove: Optional. Numbers of issues to remove from self epic
         """
-        if add:
-            logger.debug(f'Adding ZenHub issue {add} to epic {self.github_key}')
-            content = {'add_issues': [{'repo_id': int(self.repo.id), 'issue_number': int(add)}]}
-        elif remove:
-            logger.debug(f'Removing ZenHub issue {remove} from epic {self.github_key}')
-            content = {'remove_issues': [{'repo_id': int(self.repo.id), 'issue_number': int(remove)}]}
-        else:
-            raise ValueError('need to specify an epic to add to or remove from')
-
+        if not add and not remove:
+            raise ValueError('need to specify issues to add to or remove from the epic')
+        if self.repo.plan is not None:
+            for kind, keys in (('epic_add', add), ('epic_remove', remove)):
+                if keys:
+                    self.repo.planned(kind, self.github_key, list(keys))
+            return
+
+        logger.debug(f'Adding ZenHub issues {add or []} to and removing {remove or []} from epic {self.github_key}')
+        content = {field: [{'repo_id': int(self.repo.id), 'issue_number': int(i)} for i in issues]
+                   for field, issues in (('add_issues', add), ('remove_issues', remove)) if issues}
         self.repo.api_call(requests.post, f'{self.repo.id}/epics/{self.github_key}/update_issues', json=content)
 
-    def get_most_recent_event(self) -> datetime:
-        """Look up the list of ZenHub events for this issue and return the timestamp of the most recent one"""
+    def get_events(self) -> list:
+        """Look up the list of ZenHub events for this issue, most recent first"""
+
+        return self.repo.api_call(requests.get, f'{self.repo.id}/issues/{self.github_key}/events')
 
-        content = self.repo.api_call(requests.get, f'{self.repo.id}/issues/{self.github_key}/events')
-        default_tz = pytz.timezone('UTC')
+    def get_most_recent_event(self, events: list = None) -> datetime:
+        """
+        Return the timestamp of the most recent ZenHub event of this issue
+        :param events: Optional. The events, if they were already looked up with get_events
+        """
+        content = self.get_events() if events is None else events
 
         if content:
             # Get the first, most recent event in the list. Get its timestamp and convert to a datetime object,
-            # ignoring the milliseconds and Z after the period and localizing to UTC time.
-            return default_tz.localize(datetime.datetime.strptime(content[0]['created_at'].split('.')[0],
-                                                                  '%Y-%m-%dT%H:%M:%S'))
+            # ignoring the milliseconds.
+            return parse_utc_timestamp(content[0]['created_at'])
         else:  # This issue has no events. Return the minimum datetime value so the GitHub timestamp will always be used
-            return default_tz.localize(datetime.datetime.min)
+            return datetime.datetime.min.replace(tzinfo=UTC)
+
+    # The synchronized field each kind of ZenHub event changes
+    event_fields = {'transferIssue': 'pipeline', 'estimateIssue': 'story_points'}
+
+    def get_field_updated(self, events: list) -> dict:
+        """
+        Find when the pipeline and estimate were last changed, from the ZenHub events of this issue. A field without
+        events has been as it is since the issue was created. GitHub doesn't say when the milestone changed, so only
+        the GitHub issue's updated time is known for it.
+        :param events: The events, as returned by get_events
+        :return: datetime of each of 'pipeline', 'story_points' and 'milestone_name'
+        """
+        created = self.github_equivalent.created or datetime.datetime.min.replace(tzinfo=UTC)
+        field_updated = {'pipeline': created, 'story_points': created, 'milestone_name': self.github_equivalent.updated}
+        for event in reversed(events or []):  # Oldest first, so the most recent event of each field is kept
+            field = self.event_fields.get(event['type'])
+            if field:
+                field_updated[field] = parse_utc_timestamp(event['created_at'])
+        return field_updated
 
     def add_to_milestone(self, milestone_id):
         """
-        Add this issue to a milestone.
+        Add this issue to a milestone, replacing any milestone it is already in.
         :param milestone_id: ZenHub/GitHub ID of milestone to add to
         """
+        if self.repo.planned('set_milestone', self.github_key, milestone_id):
+            return
         self.github_equivalent.add_to_milestone(milestone_id)
 
     def remove_from_milestone(self):
         """Remove this issue from any milestone it may be in."""
 
-        self.github_equivalent.remove_from_milestone()
+        if not self.repo.planned('set_milestone', self.github_key, None):
+            self.github_equivalent.remove_from_milestone()
+        self.milestone_name = None
+        self.milestone_id = None
 
     def get_milestone_id(self, milestone_name: str) -> int:
         """
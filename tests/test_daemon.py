@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+from argparse import Namespace
+import hashlib
+import hmac
+import json
+import requests
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src.daemon import DebounceQueue, WebhookDaemon
+
+# Recorded webhook payloads, cut down to the fields that are used
+GITHUB_PAYLOAD = json.dumps({'action': 'edited', 'issue': {'number': 25, 'title': 'Test 1'},
+                             'repository': {'full_name': 'org/abc'}}).encode()
+JIRA_PAYLOAD = json.dumps({'webhookEvent': 'jira:issue_updated',
+                           'issue': {'id': '15546', 'key': 'TEST-1', 'self': 'https://org.atlassian.net/rest/api/2/'
+                                                                                'issue/15546',
+                                     'fields': {'project': {'key': 'TEST'}}}}).encode()
+ZENHUB_PAYLOAD = b'type=issue_transfer&github_url=https%3A%2F%2Fgithub.com%2Forg%2Fabc%2Fissues%2F25&organization=org' \
+                 b'&repo=abc&user_name=someone&issue_number=25&issue_title=Test+1&to_pipeline_name=Done' \
+                 b'&from_pipeline_name=In+Progress'
+
+
+class TestWebhookDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.command = Namespace(jira='org/TEST', zenhub='org/abc', j=False, z=True, m=False)
+        self.other = Namespace(jira='org/OTHER', zenhub='org/xyz', j=True, z=False, m=False)
+        self.daemon = WebhookDaemon([self.command, self.other], secret='s3cret')
+
+    def signed(self, body: bytes) -> dict:
+        """Return the headers GitHub sends with a payload"""
+
+        return {'X-GitHub-Event': 'issues',
+                'X-Hub-Signature-256': 'sha256=' + hmac.new(b's3cret', body, hashlib.sha256).hexdigest()}
+
+    def queued(self) -> list:
+        """Return the item of each task waiting in the daemon's queue"""
+
+        return [task['item'] for task in self.daemon.events.pending.values()]
+
+    def test_receive(self):
+        self.assertEqual(self.daemon.receive('github', self.signed(GITHUB_PAYLOAD), GITHUB_PAYLOAD), 202)
+        self.assertEqual(self.daemon.receive('jira', {}, JIRA_PAYLOAD, 'secret=s3cret'), 202)
+        self.assertEqual(self.daemon.receive('zenhub', {}, ZENHUB_PAYLOAD, 'secret=s3cret'), 202)
+        # The GitHub and ZenHub events are about the same issue, so they are merged
+        self.assertEqual(self.queued(), [(self.command, 'zenhub', '25'), (self.command, 'jira', 'TEST-1')])
+        self.assertEqual(self.daemon.events.stats()['events'], 3)
+
+    def test_pairs_coalesced(self):
+        self.daemon.pairs[(0, 'jira', 'TEST-1')] = (0, 'zenhub', '25')  # Known once the pair has been synced
+        self.daemon.receive('zenhub', {}, ZENHUB_PAYLOAD, 'secret=s3cret')
+        self.daemon.receive('jira', {}, JIRA_PAYLOAD, 'secret=s3cret')
+        self.assertEqual(self.queued(), [(self.command, 'zenhub', '25')])
+
+    def test_unverified(self):
+        headers = self.signed(GITHUB_PAYLOAD)
+        self.assertEqual(self.daemon.receive('github', headers, GITHUB_PAYLOAD.replace(b'25', b'26')), 401)
+        self.assertEqual(self.daemon.receive('jira', {}, JIRA_PAYLOAD, 'secret=guess'), 401)
+        self.assertEqual(self.daemon.receive('zenhub', {}, ZENHUB_PAYLOAD), 401)
+        self.assertEqual(self.queued(), [])
+
+    def test_ignored(self):
+        ping = b'{"zen": "Design for failure."}'
+        self.assertEqual(self.daemon.receive('github', dict(self.signed(ping), **{'X-GitHub-Event': 'ping'}), ping),
+                         200)
+        other_repo = GITHUB_PAYLOAD.replace(b'org/abc', b'org/unsynced')
+        self.assertEqual(self.daemon.receive('github', self.signed(other_repo), other_repo), 200)
+        self.assertEqual(self.daemon.receive('jira', {}, b'not json', 'secret=s3cret'), 400)
+        self.assertEqual(self.daemon.receive('favicon.ico', {}, b''), 404)
+        self.assertEqual(self.queued(), [])
+
+    @patch('src.daemon.ZenHubIssue')
+    @patch('src.daemon.Sync')
+    def test_sync(self, sync, zenhub_issue):
+        jira_repo, zenhub_repo = MagicMock(issues={}), MagicMock(issues={}, github_equivalent=MagicMock(issues={}))
+        jira_repo.get_issues.side_effect = lambda keys: jira_repo.issues.update({k: MagicMock(jira_key=k)
+                                                                                 for k in keys})
+        zenhub_issue.return_value = MagicMock(jira_key='TEST-1', github_key='25')
+        self.daemon.repos[0] = (jira_repo, zenhub_repo)
+
+        self.daemon.sync(self.command, 'zenhub', '25')
+
+        zenhub_issue.assert_called_once_with(repo=zenhub_repo, key='25')
+        jira_repo.get_issues.assert_called_once_with(['TEST-1'])
+        jira_repo.view.assert_called_once_with(['TEST-1'])
+        sync.sync_board.assert_called_once_with(source=zenhub_repo.view.return_value, dest=jira_repo.view.return_value)
+
+    def test_server(self):
+        """Recorded payloads can be posted to a daemon running locally"""
+        with self.daemon.server('127.0.0.1', 0) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                url = f'http://127.0.0.1:{server.server_address[1]}'
+                self.assertEqual(requests.post(f'{url}/jira?secret=s3cret', data=JIRA_PAYLOAD).status_code, 202)
+                self.assertEqual(requests.post(f'{url}/jira', data=JIRA_PAYLOAD).status_code, 401)
+            finally:
+                server.shutdown()
+                thread.join()
+        self.assertEqual(self.queued(), [(self.command, 'jira', 'TEST-1')])
+
+    def test_stats_endpoint(self):
+        with self.daemon.server('127.0.0.1', 0) as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                stats = requests.get(f'http://127.0.0.1:{server.server_address[1]}/stats').json()
+            finally:
+                server.shutdown()
+                thread.join()
+        self.assertEqual(stats['depth'], 0)
+
+    def test_secret_required(self):
+        with self.assertRaises(ValueError):
+            WebhookDaemon([self.command], secret=None)
+
+
+class TestDebounceQueue(unittest.TestCase):
+
+    def test_debounce(self):
+        events = DebounceQueue(window=0.1, max_delay=10)
+        started = time.monotonic()
+        for change in ('status', 'estimate', 'sprint'):
+            events.put('TEST-1', change)
+            time.sleep(0.05)  # Each event comes before the window is over
+        events.put('TEST-2', 'status')
+
+        task = events.get()
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual((task['item'], task['events']), ('status', 3))
+        events.done(task)
+        self.assertEqual(events.get()['item'], 'status')
+
+        stats = events.stats()
+        self.assertEqual((stats['depth'], stats['events'], stats['tasks'], stats['coalescing_ratio']), (0, 4, 2, 2))
+        self.assertGreaterEqual(stats['max_latency'], 0.2)
+
+    def test_max_delay(self):
+        events = DebounceQueue(window=0.1, max_delay=0.2)
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(events.get()))
+        thread.start()
+        started = time.monotonic()
+        while time.monotonic() - started < 0.5 and not taken:  # Events keep coming
+            events.put('TEST-1', 'status')
+            time.sleep(0.02)
+        thread.join(timeout=5)
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(len(taken), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
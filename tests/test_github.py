@@ -1,18 +1,27 @@
 import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
 import pytz
+import re
+import threading
 import unittest
 from unittest.mock import patch
 
+from settings import urls
 from src.github import GitHubIssue, GitHubRepo
 
 
+LONG_LISTING = 1500  # Number of pages in a listing that is longer than the recursion limit
+
+
 def mocked_response(*args, **kwargs):
     """A class to mock a response from a GitHub API call"""
 
     class MockResponse:
-        def __init__(self, json_data):
+        def __init__(self, json_data, headers=None):
             self.json_data = json_data
             self.status_code = 200
+            self.headers = headers or {}
 
         def json(self):
             return self.json_data
@@ -49,6 +58,31 @@ def mocked_response(*args, **kwargs):
              'user': {'login': 'unito-bot'}}
         )
 
+    elif args == ('https://mockapi.github.com/repos/SOME_ORG/REPO/issues?state=all&per_page=100'
+                  '&since=2019-02-21T03:00:00Z&page=1',):
+        issue = mocked_response('https://mockapi.github.com/repos/SOME_ORG/REPO/issues/REAL-ISSUE').json()
+        return MockResponse([issue])
+
+    elif args == ('https://mockapi.github.com/repos/SOME_ORG/REPO/issues?state=all&per_page=2&page=1',):
+        issue = mocked_response('https://mockapi.github.com/repos/SOME_ORG/REPO/issues/REAL-ISSUE').json()
+        pull_request = dict(issue, number=101, pull_request={'url': 'https://api.github.com/repos/SOME_ORG/pulls/101'})
+        return MockResponse([issue, pull_request], headers={'Link': '<https://mockapi.github.com/repos/SOME_ORG/REPO/'
+                                                                    'issues?state=all&per_page=2&page=2>; rel="next"'})
+
+    elif args == ('https://mockapi.github.com/repos/SOME_ORG/REPO/issues?state=all&per_page=2&page=2',):
+        issue = mocked_response('https://mockapi.github.com/repos/SOME_ORG/REPO/issues/REAL-ISSUE').json()
+        return MockResponse([dict(issue, number=102)])
+
+    elif re.search(r'SOME_ORG/REPO/issues\?state=all&per_page=1&page=\d+$', args[0]):  # One issue per page
+        page = int(args[0].split('=')[-1])
+        issue = mocked_response('https://mockapi.github.com/repos/SOME_ORG/REPO/issues/REAL-ISSUE').json()
+        headers = {'Link': f'<{args[0][:-len(str(page))]}{page + 1}>; rel="next"'} if page < LONG_LISTING else {}
+        return MockResponse([dict(issue, number=page)], headers=headers)
+
+    elif re.search(r'SOME_ORG/REPO/issues/\d+$', args[0]):  # Any other numbered issue
+        issue = mocked_response('https://mockapi.github.com/repos/SOME_ORG/REPO/issues/REAL-ISSUE').json()
+        return MockResponse(dict(issue, number=int(args[0].split('/')[-1])))
+
     elif args == ('https://mockapi.github.com/repos/SOME_ORG/REPO/issues/NONEXISTENT-ISSUE',):
         return MockResponse(
             {'documentation_url': 'https://developer.github.com/v3/issues/#get-a-single-issue',
@@ -58,6 +92,99 @@ def mocked_response(*args, **kwargs):
         raise RuntimeError(args, kwargs)
 
 
+class StandInGraphQLServer:
+    """A local stand-in for GitHub's GraphQL API that answers aliased issue lookups from a dictionary of issues"""
+
+    def __init__(self, issues: dict, available: bool = True):
+        """
+        :param issues: GraphQL issue objects keyed by issue number
+        :param available: If False, answer every query as if the token can't be used with GraphQL
+        """
+        self.queries = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+                server.queries.append(query)
+                if available:
+                    lookups = re.findall(r'(i\d+): issue\(number: (\d+)\)', query)
+                    body = {'data': {'repository': {alias: issues.get(int(n)) for alias, n in lookups}}}
+                    status = 200
+                else:
+                    body = {'message': 'Bad credentials'}
+                    status = 401
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode())
+
+            def log_message(self, *args):  # Keep the test output quiet
+                pass
+
+        self.httpd = HTTPServer(('localhost', 0), Handler)
+        self.url = f'http://localhost:{self.httpd.server_port}/graphql'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def graphql_issue(number: int) -> dict:
+    """Return an issue in the format of a GraphQL response"""
+
+    return {'number': number, 'title': f'Issue {number}', 'body': f'Issue Number: ABC-{number}',
+            'updatedAt': '2019-02-21T19:37:18Z', 'milestone': {'title': 'sprint1', 'number': 1} if number % 2 else None,
+            'assignees': {'nodes': [{'login': 'aaaaa'}]}}
+
+
+class TestGitHubGraphQL(unittest.TestCase):
+
+    def setUp(self):
+        self.patch_token = patch('src.github.get_access_params', return_value={
+            'options': {'server': 'https://mockapi.github.com/repos/'}, 'api_token': 'mock token'}).start()
+        self.patch_get = patch('src.github.requests.get', side_effect=mocked_response).start()
+        self.repo = GitHubRepo(repo_name='REPO', org='SOME_ORG', issues=[])
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_get_issues(self):
+        """Issues are fetched 100 per query. Numbers that aren't issues are looked up through REST."""
+        server = StandInGraphQLServer({n: graphql_issue(n) for n in range(1, 151)})
+        try:
+            with patch.dict(urls, {'github_graphql': server.url}):
+                self.repo.get_issues([str(n) for n in range(1, 152)])
+        finally:
+            server.close()
+
+        self.assertEqual(len(server.queries), 2)
+        self.assertEqual(len(self.repo.issues), 151)
+        self.assertEqual(self.patch_get.call_count, 1)  # Only issue 151 is missing from GraphQL
+
+        issue = self.repo.issues['7']
+        self.assertEqual((issue.github_key, issue.summary, issue.jira_key), ('7', 'Issue 7', 'ABC-7'))
+        self.assertEqual((issue.milestone_name, issue.milestone_id), ('sprint1', 1))
+        self.assertEqual(issue.assignees, ['aaaaa'])
+        self.assertEqual(issue.updated, datetime.datetime(2019, 2, 21, 19, 37, 18, tzinfo=pytz.timezone('UTC')))
+        self.assertIsNone(self.repo.issues['8'].milestone_name)
+
+    def test_rest_fallback(self):
+        """If GraphQL can't be used, issues are fetched through REST, and GraphQL isn't tried again"""
+        server = StandInGraphQLServer({}, available=False)
+        try:
+            with patch.dict(urls, {'github_graphql': server.url}):
+                self.repo.get_issues(['1', '2'])
+                self.repo.get_issues(['3'])
+        finally:
+            server.close()
+
+        self.assertEqual(len(server.queries), 1)
+        self.assertEqual(list(self.repo.issues), ['1', '2', '3'])
+        self.assertEqual(self.patch_get.call_count, 3)
+
+
 class TestGitHubIssue(unittest.TestCase):
 
     @patch('src.github.get_access_params')
@@ -88,6 +215,44 @@ class TestGitHubIssue(unittest.TestCase):
         with self.assertRaises(ValueError):
             GitHubIssue(key='NONEXISTENT-ISSUE', repo=self.github_repo)
 
+    @patch('src.github.get_access_params')
+    @patch('src.github.requests.get', side_effect=mocked_response)
+    def test_get_issues_skips_missing(self, get_mocked_response, mock_access_params):
+        mock_access_params.return_value = {'options': {'server': 'https://mockapi.github.com/repos/'},
+                                           'api_token': 'mock token'}
+        with self.assertLogs('src.github', level='WARNING'):
+            repo = GitHubRepo(repo_name='REPO', org='SOME_ORG', issues=['NONEXISTENT-ISSUE', 'REAL-ISSUE'])
+        self.assertEqual(list(repo.issues), ['REAL-ISSUE'])
+
+    @patch('src.github.get_access_params')
+    @patch('src.github.requests.get', side_effect=mocked_response)
+    def test_updated_since(self, get_mocked_response, mock_access_params):
+        mock_access_params.return_value = {'options': {'server': 'https://mockapi.github.com/repos/'},
+                                           'api_token': 'mock token'}
+        since = pytz.timezone('America/Los_Angeles').localize(datetime.datetime(2019, 2, 20, 19))
+        repo = GitHubRepo(repo_name='REPO', org='SOME_ORG', updated_since=since)
+        self.assertEqual(list(repo.issues), ['100'])
+
+    @patch('src.github.get_access_params')
+    @patch('src.github.requests.get', side_effect=mocked_response)
+    def test_list_all_issues(self, get_mocked_response, mock_access_params):
+        """All pages of the issues listing are retrieved, and pull requests are left out"""
+        mock_access_params.return_value = {'options': {'server': 'https://mockapi.github.com/repos/'},
+                                           'api_token': 'mock token'}
+        repo = GitHubRepo(repo_name='REPO', org='SOME_ORG', per_page=2)
+        self.assertEqual(list(repo.issues), ['100', '102'])
+        self.assertEqual(get_mocked_response.call_count, 2)
+
+    @patch('src.github.get_access_params')
+    @patch('src.github.requests.get', side_effect=mocked_response)
+    def test_list_many_pages(self, get_mocked_response, mock_access_params):
+        """A listing with more pages than the recursion limit is retrieved in full"""
+        mock_access_params.return_value = {'options': {'server': 'https://mockapi.github.com/repos/'},
+                                           'api_token': 'mock token'}
+        repo = GitHubRepo(repo_name='REPO', org='SOME_ORG', per_page=1)
+        self.assertEqual(len(repo.issues), LONG_LISTING)
+        self.assertEqual(get_mocked_response.call_count, LONG_LISTING)
+
     def test_get_jira_equivalent(self):
         self.assertEqual(self.g.get_jira_equivalent(), 'ABC-10')
 
@@ -1,8 +1,12 @@
+import copy
 import datetime
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from src.jira import JiraRepo, JiraIssue
+from src.state import Checkpoint
 
 
 def mocked_response(*args, **kwargs):
@@ -17,7 +21,8 @@ def mocked_response(*args, **kwargs):
             return self.json_data
 
     # Careful, args needs to be a tuple, and that always ends with a ',' character in Python!!
-    if args == ('https://mock-org.atlassian.net/search?jql=project=TEST AND issuekey=ISSUE-WITH-BLANKS&startAt=0',):
+    if args == ('https://mock-org.atlassian.net/search?jql=project=TEST AND issuekey=ISSUE-WITH-BLANKS'
+                '&expand=changelog&startAt=0',):
         return MockResponse(
         {'issues':  # A condensed API response for an issue
             [{'fields': {
@@ -36,7 +41,26 @@ def mocked_response(*args, **kwargs):
           'total': 1,
           'maxResults': 50})
 
-    elif args == ('https://mock-org.atlassian.net/search?jql=id=NONEXISTENT-ISSUE',):
+    elif args == ('https://mock-org.atlassian.net/search?jql=project=TEST AND updated >= -11m'
+                  '&expand=changelog&startAt=0',):
+        return mocked_response('https://mock-org.atlassian.net/search?jql=project=TEST AND issuekey=ISSUE-WITH-BLANKS'
+                               '&expand=changelog&startAt=0')
+
+    elif args == ('https://mock-org.atlassian.net/search?jql=key in (REAL-ISSUE-1,REAL-ISSUE-2)'
+                  '&expand=changelog&startAt=0',):
+        return mocked_response('https://mock-org.atlassian.net/search?jql=project=TEST&expand=changelog&startAt=0')
+
+    elif args == ('https://mock-org.atlassian.net/search?jql=key in (REAL-ISSUE-1,NONEXISTENT-ISSUE)'
+                  '&expand=changelog&startAt=0',):
+        return MockResponse({'errorMessages': ["The issue key 'NONEXISTENT-ISSUE' for field 'key' is invalid."],
+                             'warningMessages': []}, status_code=400)
+
+    elif args == ('https://mock-org.atlassian.net/search?jql=id=REAL-ISSUE-1&expand=changelog',):
+        content = mocked_response('https://mock-org.atlassian.net/search?jql=project=TEST'
+                                  '&expand=changelog&startAt=0').json()
+        return MockResponse({'issues': content['issues'][:1]})
+
+    elif args == ('https://mock-org.atlassian.net/search?jql=id=NONEXISTENT-ISSUE&expand=changelog',):
         return MockResponse(
             {'errorMessages': ['An issue with key "TEST-100" does not exist for field '
                                '"id".'],
@@ -44,7 +68,7 @@ def mocked_response(*args, **kwargs):
             }
         )
 
-    elif args == ('https://mock-org.atlassian.net/search?jql=project=TEST&startAt=0',):
+    elif args == ('https://mock-org.atlassian.net/search?jql=project=TEST&expand=changelog&startAt=0',):
         return MockResponse(
             {'total': 2,
              'maxResults': 50,
@@ -136,6 +160,26 @@ class TestJiraIssue(unittest.TestCase):
         with self.assertRaises(ValueError):
             JiraIssue(key='NONEXISTENT-ISSUE', repo=self.board)
 
+    def test_get_field_updated(self):
+        """When each synchronized field last changed is read from the changelog, and is the creation time otherwise"""
+        content = {'fields': {'created': '2019-02-05T14:52:11.501-0800'},
+                   'changelog': {'startAt': 0, 'maxResults': 2, 'total': 2, 'histories': [
+                       {'created': '2019-02-06T09:00:00.000-0800',
+                        'items': [{'field': 'status', 'fieldId': 'status', 'toString': 'In Progress'},
+                                  {'field': 'Story Points', 'fieldId': 'customfield_10014', 'toString': '3'}]},
+                       {'created': '2019-02-07T09:00:00.000-0800',
+                        'items': [{'field': 'summary', 'fieldId': 'summary', 'toString': 'Renamed'},
+                                  {'field': 'status', 'toString': 'Done'}]}]}}  # Older changelogs have no IDs
+        pst = datetime.timezone(datetime.timedelta(hours=-8))
+        self.assertEqual(JiraIssue.get_field_updated(content),
+                         {'status': datetime.datetime(2019, 2, 7, 9, tzinfo=pst),
+                          'story_points': datetime.datetime(2019, 2, 6, 9, tzinfo=pst),
+                          'sprint_name': datetime.datetime(2019, 2, 5, 14, 52, 11, tzinfo=pst)})
+
+        content['changelog']['total'] = 150  # Only the first page of histories came with the issue
+        self.assertEqual(JiraIssue.get_field_updated(content), {})
+        self.assertEqual(self.j.modified('status'), self.j.updated)  # No changelog, so only the updated time is known
+
     def test_get_github_equivalent(self):
         self.j.get_github_equivalent()
         self.assertEqual(self.j.github_key, '25')
@@ -147,6 +191,143 @@ class TestJiraIssue(unittest.TestCase):
         self.assertEqual(self.k.story_points, 7.0)
         self.assertEqual(self.k.status, 'Done')
 
+    @patch('src.jira.get_access_params')
+    @patch('src.jira.requests.get', side_effect=mocked_response)
+    def test_updated_since(self, get_mocked_response, get_mocked_token):
+        get_mocked_token.return_value = {'options': {'server': 'https://mock-%s.atlassian.net/',
+                                                     'alt_server': 'https://mock-%s.atlassian.net/rest/agile/1.0/'},
+                                         'api_token': 'mock token'}
+        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=10)
+        board = JiraRepo(repo_name='TEST', jira_org='org', updated_since=since)
+        self.assertEqual(list(board.issues), ['ISSUE-WITH-BLANKS'])
+
+        board = JiraRepo(repo_name='TEST', jira_org='org', empty=True)  # e.g. kept from the last poll
+        board.get_updated_issues(since)
+        self.assertEqual(list(board.issues), ['ISSUE-WITH-BLANKS'])
+
+    @patch('src.jira.get_access_params')
+    @patch('src.jira.requests.get', side_effect=mocked_response)
+    def test_get_issues(self, jira_get, get_mocked_token):
+        get_mocked_token.return_value = {'options': {'server': 'https://mock-%s.atlassian.net/',
+                                                     'alt_server': 'https://mock-%s.atlassian.net/rest/agile/1.0/'},
+                                         'api_token': 'mock token'}
+        board = JiraRepo(repo_name='TEST', jira_org='org', empty=True)
+        board.get_issues(['REAL-ISSUE-1', 'REAL-ISSUE-2'])
+        self.assertEqual(list(board.issues), ['REAL-ISSUE-1', 'REAL-ISSUE-2'])
+        self.assertEqual(jira_get.call_count, 1)
+
+        # If one key doesn't exist the search fails, so the others are retrieved one at a time
+        board.issues = {}
+        board.get_issues(['REAL-ISSUE-1', 'NONEXISTENT-ISSUE'])
+        self.assertEqual(list(board.issues), ['REAL-ISSUE-1'])
+
+    @patch('src.jira.get_access_params')
+    @patch('src.jira.requests.get')
+    def test_pages_checkpointed(self, jira_get, get_mocked_token):
+        """Every page of results is retrieved, and a restarted run reuses the pages that were checkpointed"""
+        get_mocked_token.return_value = {'options': {'server': 'https://mock-%s.atlassian.net/',
+                                                     'alt_server': 'https://mock-%s.atlassian.net/rest/agile/1.0/'},
+                                         'api_token': 'mock token'}
+        issues = mocked_response('https://mock-org.atlassian.net/search?jql=project=TEST'
+                                 '&expand=changelog&startAt=0').json()['issues']
+
+        def page(url, **kwargs):
+            start = int(url.rsplit('=', 1)[1])
+            if jira_get.interrupt and start == 1:
+                raise ConnectionError('network outage')
+            return Mock(status_code=200, json=lambda: {'total': 2, 'maxResults': 1, 'issues': issues[start:start + 1]})
+        jira_get.side_effect = page
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(Checkpoint, 'enabled', True), \
+                patch.dict('src.state.state_path', checkpoint=os.path.join(tmp, 'checkpoint-%s.jsonl')):
+            jira_get.interrupt = True
+            with self.assertRaises(ConnectionError):
+                JiraRepo(repo_name='TEST', jira_org='org')
+
+            jira_get.interrupt = False
+            jira_get.reset_mock()
+            board = JiraRepo(repo_name='TEST', jira_org='org')
+            self.assertEqual(os.listdir(tmp), [])  # Removed once the repo is loaded
+
+        self.assertEqual(list(board.issues), ['REAL-ISSUE-1', 'REAL-ISSUE-2'])
+        self.assertEqual([c[0][0] for c in jira_get.call_args_list],
+                         ['https://mock-org.atlassian.net/search?jql=project=TEST&expand=changelog&startAt=1'])
+
+    def test_change_epic_membership(self):
+        """Children are added to and removed from an epic 50 at a time"""
+        with patch.object(self.board, 'api_call') as api_call:
+            self.j.change_epic_membership(add=[f'TEST-{i}' for i in range(120)], remove=['TEST-500'])
+
+        self.assertEqual([c[1]['url_tail'] for c in api_call.call_args_list],
+                         ['agile/1.0/epic/REAL-ISSUE-1/issue'] * 3 + ['agile/1.0/epic/none/issue'])
+        self.assertEqual([len(c[1]['json']['issues']) for c in api_call.call_args_list], [50, 50, 20, 1])
+
+    def test_add_to_sprint_later(self):
+        """Issues going to the same sprint are added 50 at a time, and failures are reported per issue"""
+        def api_call(action, url_tail, url_head=None, json=None, success_code=200):
+            if 'BROKEN-1' in json['issues']:
+                return {'errorMessages': ['Issue BROKEN-1 cannot be moved']}
+            return {}
+
+        with patch.object(self.board, 'api_call', side_effect=api_call) as mocked:
+            for i in range(120):
+                self.board.add_to_sprint_later(42, f'TEST-{i}')
+            self.assertEqual(mocked.call_count, 2)  # The first 100 are sent as soon as there are 50 of them
+            self.assertEqual(self.board.flush_sprint_assignments(), [])
+            self.assertEqual([len(c[1]['json']['issues']) for c in mocked.call_args_list], [50, 50, 20])
+            self.assertEqual({c[0][1] for c in mocked.call_args_list}, {'sprint/42/issue'})
+
+            mocked.reset_mock()
+            for key in ('TEST-1', 'BROKEN-1', 'TEST-2'):
+                self.board.add_to_sprint_later(42, key)
+            self.assertEqual(self.board.view().flush_sprint_assignments(['BROKEN-1']), ['BROKEN-1'])
+            self.assertEqual(mocked.call_count, 4)  # The failed request is retried one issue at a time
+            self.assertEqual(self.board.flush_sprint_assignments(), [])
+
+    def test_view(self):
+        view = self.board.view(['REAL-ISSUE-2', 'NOT-IN-BOARD'])
+        self.assertEqual(list(view.issues), ['REAL-ISSUE-2'])
+        self.assertIs(view.issues['REAL-ISSUE-2'], self.k)  # Issue objects are shared, not copied
+        self.assertIs(view.lookups, self.board.lookups)
+        self.assertEqual((view.name, view.url), (self.board.name, self.board.url))
+        self.assertEqual(len(self.board.view().issues), len(self.board.issues))
+        self.assertIn('REAL-ISSUE-1', self.board.issues)  # The repo itself is left as it is
+
+    def test_transition_path(self):
+        """Transitions are learned per workflow and status, and other statuses are reached in several steps"""
+        workflow = {'To Do': {'In Progress': '21'}, 'In Progress': {'In Review': '41', 'To Do': '11'},
+                    'In Review': {'Done': '31', 'In Progress': '21'}}
+        repo = self.board.view([])
+        repo.lookups = dict()  # Nothing learned yet
+        issues = {}
+        for key, status in (('TEST-1', 'To Do'), ('TEST-2', 'In Progress'), ('TEST-3', 'In Review')):
+            issues[key] = copy.copy(self.j)
+            issues[key].__dict__.update(repo=repo, jira_key=key, status=status, remote_status=status)
+
+        def api_call(action, url_tail, url_head=None, json=None, success_code=200):
+            if url_tail.endswith('/transitions') and json is None:
+                transitions = workflow[issues[url_tail.split('/')[1]].remote_status]
+                return {'transitions': [{'id': i, 'to': {'name': to}} for to, i in transitions.items()]}
+            return {}
+
+        with patch.object(repo, 'api_call', side_effect=api_call) as mocked:
+            for key in ('TEST-2', 'TEST-3'):  # Other issues were transitioned earlier in the run
+                repo.get_transitions(issues[key])
+            issue = issues['TEST-1']
+            issue.status = 'Done'
+            issue.update_remote(['status'])
+
+            self.assertEqual(repo.transition_path('Story', 'To Do', 'Done'),
+                             [(21, 'In Progress'), (41, 'In Review'), (31, 'Done')])
+            self.assertEqual([c[1]['json']['transition']['id'] for c in mocked.call_args_list if c[1].get('json')],
+                             [21, 41, 31])
+            self.assertEqual(issue.remote_status, 'Done')
+            self.assertEqual(len([c for c in mocked.call_args_list if not c[1].get('json')]), 3)  # One per status
+
+            mocked.reset_mock()
+            issue.update_remote(['status'])  # Already in that status
+            mocked.assert_not_called()
+
     @patch('src.jira.requests.get', side_effect=mocked_response)
     def test_get_sprint_id(self, jira_get):
 
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from src.links import UnitoLink, parse_links
+
+JIRA_DESCRIPTION = ('Steps to reproduce: see Issue Number: 99 in the old tracker, https://github.com/other/repo\r\n\r\n'
+                    '┆{color:#707070}Issue is synchronized with a [GitHub issue|'
+                    'https://github.com/ucsc-cgp/abc/issues/5]{color}\r\n'
+                    '┆{color:#707070}Repository Name: abc{color}\r\n'
+                    '┆{color:#707070}Milestone: testsprint1{color}\n'
+                    '┆{color:#707070}Issue Number: 5{color}\r\n')
+GITHUB_BODY = ('Something is broken.\n\n'
+               '┆Issue is synchronized with this [Jira Story](https://ucsc-cgl.atlassian.net/browse/TEST-10)\n'
+               '┆Issue Number: TEST-10\n')
+
+
+class TestParseLinks(unittest.TestCase):
+
+    def test_jira_description(self):
+        """Only the Unito footer is read, not text about other issues before it"""
+        self.assertEqual(parse_links(JIRA_DESCRIPTION),
+                         UnitoLink(org='ucsc-cgp', repo='abc', issue_number='5', milestone='testsprint1'))
+
+    def test_github_body(self):
+        link = parse_links(GITHUB_BODY)
+        self.assertEqual((link.issue_number, link.jira_key), ('TEST-10', 'TEST-10'))
+        self.assertIsNone(link.org)
+
+    def test_no_footer_line(self):
+        """Descriptions whose footer lacks its first line are searched whole"""
+        link = parse_links('Repository Name: abc{color}\n┆{color:#707070}Issue Number: 27{color}\n')
+        self.assertEqual((link.repo, link.issue_number, link.jira_key), ('abc', '27', None))
+        self.assertEqual(parse_links('Issue Number: ABC-10').jira_key, 'ABC-10')
+
+    def test_not_found(self):
+        for description in (None, '', 'no issue key here'):
+            self.assertFalse(parse_links(description).found())
+        self.assertTrue(parse_links(JIRA_DESCRIPTION).found())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import datetime
+import os
+import pytz
+import tempfile
+import unittest
+
+from src.issue import Issue
+from src.mirror import Mirror
+
+
+def make_issue(**fields) -> 'Issue':
+    """Make a bare Issue object with the given fields set"""
+
+    issue = Issue()
+    issue.__dict__.update(fields)
+    return issue
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.mirror = Mirror(path=os.path.join(self.dir.name, 'mirror.sqlite3'))
+
+        self.jira = [make_issue(jira_key=f'TEST-{i}', github_key=str(i), status='In Progress', pipeline='In Progress',
+                                story_points=3.0, issue_type='Story') for i in range(1, 4)]
+        self.zen = [make_issue(jira_key=f'TEST-{i}', github_key=str(i), status='In Progress', pipeline='In Progress',
+                               story_points=3, issue_type='Story') for i in range(1, 4)]
+
+    def tearDown(self):
+        self.mirror.close()
+        self.dir.cleanup()
+
+    def test_compare(self):
+        self.zen[1].story_points = 5
+        self.zen[2].__dict__.update(status='Done', pipeline='Closed')
+        self.mirror.store('jira org/TEST', self.jira)
+        self.mirror.store('zenhub org/abc', self.zen)
+
+        self.assertEqual(self.mirror.compare('org/TEST', 'org/abc', '-m'), ([('TEST-2', '2'), ('TEST-3', '3')], 1))
+
+        self.jira[2].status = 'Done'  # Syncing from ZenHub only sets the status
+        self.mirror.store('jira org/TEST', self.jira[2:])
+        self.assertEqual(self.mirror.compare('org/TEST', 'org/abc', '-z'), ([('TEST-2', '2')], 2))
+        self.assertEqual(self.mirror.compare('org/TEST', 'org/abc', '-j'), ([('TEST-2', '2'), ('TEST-3', '3')], 1))
+        self.assertEqual(self.mirror.compare('org/OTHER', 'org/abc', '-j'), ([], 0))
+
+    def test_epics_are_never_in_sync(self):
+        self.jira[0].issue_type = self.zen[0].issue_type = 'Epic'
+        self.mirror.store('jira org/TEST', self.jira[:1])
+        self.mirror.store('zenhub org/abc', self.zen[:1])
+        self.assertEqual(self.mirror.compare('org/TEST', 'org/abc', '-j'), ([('TEST-1', '1')], 0))
+
+    def test_record(self):
+        self.assertIsNone(self.mirror.mark('org/TEST org/abc'))
+        started = pytz.timezone('America/Los_Angeles').localize(datetime.datetime(2019, 5, 1, 9, 30))
+        self.mirror.record('org/TEST org/abc', started, {'1': ['Backlog', 2, False]}, {'jira': ['TEST-2', 'TEST-2']})
+
+        other = Mirror(path=self.mirror.path)  # Read back from disk
+        mark = other.mark('org/TEST org/abc')
+        other.close()
+        self.assertEqual(mark, {'since': started, 'board': {'1': ['Backlog', 2, False]},
+                                'retry': {'jira': ['TEST-2'], 'zenhub': []}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from src.plan import Plan
+
+
+class JiraRepo:
+    """Stands in for src.jira.JiraRepo, which the plan tells apart from a ZenHubRepo by its class name"""
+
+
+class ZenHubRepo:
+    """Stands in for src.zenhub.ZenHubRepo"""
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.jira, self.zenhub = JiraRepo(), ZenHubRepo()
+        self.plan = Plan('org/TEST', 'org/abc')
+
+    def test_optimize(self):
+        self.plan.add(self.zenhub, 'epic_add', '3', ['1'])
+        self.plan.add(self.jira, 'set_points', 'TEST-1', 2)
+        self.plan.add(self.zenhub, 'promote', '3')
+        self.plan.add(self.jira, 'transition', 'TEST-1', 'In Progress')
+        self.plan.add(self.zenhub, 'demote', '4')
+        self.plan.add(self.jira, 'set_points', 'TEST-1', 5)  # Replaces the first value
+        self.plan.add(self.zenhub, 'epic_add', '3', ['1', '2'])  # Merged with the first list
+        self.plan.add(self.zenhub, 'promote', '4')  # Cancels out the demotion
+
+        self.assertEqual([(m['side'], m['kind'], m['key'], m['value']) for m in self.plan.optimize().mutations],
+                         [('zenhub', 'promote', '3', None),
+                          ('zenhub', 'promote', '4', None),
+                          ('jira', 'transition', 'TEST-1', 'In Progress'),
+                          ('jira', 'set_points', 'TEST-1', 5),
+                          ('zenhub', 'epic_add', '3', ['1', '2'])])
+        self.assertEqual(len(self.plan.mutations), 8)  # The plan itself is left as it is
+
+    def test_save_and_load(self):
+        self.plan.add(self.jira, 'set_sprint', 'TEST-1', 42)
+        self.plan.add(self.zenhub, 'set_milestone', '1', None)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'plan.json')
+            self.plan.save(path)
+            loaded = Plan.load(path)
+
+        self.assertEqual((loaded.jira, loaded.zenhub), ('org/TEST', 'org/abc'))
+        self.assertEqual(loaded.mutations, self.plan.mutations)
+
+    def test_execute(self):
+        issues = {'TEST-1': MagicMock(), 'TEST-2': MagicMock()}
+        jira_repo = MagicMock(issues=issues)
+        jira_repo.flush_sprint_assignments.return_value = []
+        self.plan.add(self.jira, 'transition', 'TEST-1', 'Done')
+        self.plan.add(self.jira, 'epic_add', 'TEST-2', ['TEST-1'])
+        self.plan.add(self.jira, 'epic_remove', 'TEST-2', ['TEST-3'])
+        self.plan.add(self.jira, 'set_points', 'TEST-9', 1)  # Not retrieved
+        issues['TEST-2'].change_epic_membership.side_effect = RuntimeError('rate limit')
+
+        done = []
+        counts = self.plan.optimize().execute(jira_repo, MagicMock(issues={}), done=done.extend)
+
+        self.assertEqual(counts, {'processed': 1, 'skipped': 1, 'failed': ['TEST-2']})
+        self.assertEqual(issues['TEST-1'].status, 'Done')
+        issues['TEST-1']._update_issue_status.assert_called_once_with()
+        issues['TEST-2'].change_epic_membership.assert_called_once_with(add=['TEST-1'], remove=['TEST-3'])
+        self.assertEqual([m['key'] for m in done], ['TEST-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from src import ratelimit
+from src.ratelimit import RateBudget
+
+
+class TestRateBudget(unittest.TestCase):
+
+    def tearDown(self):
+        ratelimit.budgets.clear()
+
+    def test_burst_then_wait(self):
+        budget = RateBudget(requests=3, seconds=0.3)  # Bursts of 3, then one every 0.1 seconds
+        started = time.monotonic()
+        for i in range(3):
+            budget.take()
+        self.assertLess(time.monotonic() - started, 0.05)
+
+        budget.take()
+        budget.take()
+        self.assertGreaterEqual(time.monotonic() - started, 0.18)
+
+    def test_shared_between_threads(self):
+        budget = RateBudget(requests=2, seconds=0.2)
+        started = time.monotonic()
+        threads = [threading.Thread(target=budget.take) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertGreaterEqual(time.monotonic() - started, 0.38)  # 2 right away, then 4 more at 0.1 second intervals
+
+    def test_take_by_host(self):
+        ratelimit.configure({'api.zenhub.io': (100, 60), 'atlassian.net': (600, 60)}, share=0.5)
+        self.assertEqual(ratelimit.budgets['api.zenhub.io'].capacity, 50)
+
+        with patch.object(RateBudget, 'take') as take:
+            ratelimit.take('https://ucsc-cgl.atlassian.net/rest/api/latest/search')
+            ratelimit.take('https://api.zenhub.io/p1/repositories/123/board')
+            ratelimit.take('https://api.github.com/repos/ucsc-cgp/abc/issues')  # No budget for this host
+        self.assertEqual(take.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
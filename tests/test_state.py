@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+import datetime
+import os
+import pytz
+import tempfile
+import time
+import unittest
+
+from src.issue import Issue
+from src.plan import Plan
+from src.jira import JiraIssue
+from src.state import Checkpoint, FingerprintStore, HighWaterMarkStore, Journal, LocalStore, SnapshotStore, WriteLog
+
+
+def make_issue(**fields) -> 'Issue':
+    """Make a bare Issue object with the given fields set"""
+
+    issue = Issue()
+    issue.__dict__.update(fields)
+    return issue
+
+
+class TestFingerprintStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'fingerprints.json')
+
+        self.jira = make_issue(jira_key='TEST-1', github_key='1', status='In Progress', story_points=3.0,
+                               issue_type='Story')
+        self.zen = make_issue(jira_key='TEST-1', github_key='1', pipeline='In Progress', story_points=3,
+                              issue_type='Story')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_unchanged_after_record(self):
+        store = FingerprintStore(pair='org/TEST org/abc', path=self.path)
+        self.assertFalse(store.unchanged(self.jira, self.zen))  # Never synced before
+        store.record(self.jira, self.zen)
+        store.save()
+
+        store = FingerprintStore(pair='org/TEST org/abc', path=self.path)  # Read back from disk
+        self.assertTrue(store.unchanged(self.jira, self.zen))
+
+        self.zen.pipeline = 'Done'  # A change on either side is detected
+        self.assertFalse(store.unchanged(self.jira, self.zen))
+
+    def test_synced_pair_is_unchanged_next_run(self):
+        store = FingerprintStore(pair='org/TEST org/abc -j', path=self.path)
+        self.jira.__dict__.update(status='Done', pipeline='Done', story_points=5.0, issue_type='Bug')
+        self.assertFalse(store.unchanged(self.jira, self.zen))
+
+        self.zen.update_from(self.jira)  # Sync from Jira to ZenHub, which also copies Jira's exact issue type
+        store.record(self.jira, self.zen)
+        store.save()
+
+        # The next run retrieves the values that were written
+        zen = make_issue(jira_key='TEST-1', github_key='1', status='Done', pipeline='Done', story_points=5,
+                         issue_type='Story')
+        store = FingerprintStore(pair='org/TEST org/abc -j', path=self.path)
+        self.assertTrue(store.unchanged(self.jira, zen))
+
+    def test_pairs_of_repos_are_separate(self):
+        store = FingerprintStore(pair='org/TEST org/abc', path=self.path)
+        store.unchanged(self.jira, self.zen)
+        store.record(self.jira, self.zen)
+        store.save()
+
+        store = FingerprintStore(pair='org/OTHER org/abc', path=self.path)
+        self.assertFalse(store.unchanged(self.jira, self.zen))
+
+    def test_epics_are_never_unchanged(self):
+        self.jira.issue_type = self.zen.issue_type = 'Epic'
+        store = FingerprintStore(pair='org/TEST org/abc', path=self.path)
+        store.unchanged(self.jira, self.zen)
+        store.record(self.jira, self.zen)
+        self.assertFalse(store.unchanged(self.jira, self.zen))
+
+    def test_pairs_saved_at_the_same_time(self):
+        # Stores for two pairs of repos are loaded before either is saved, as when repo pairs are synced in parallel
+        first = FingerprintStore(pair='org/TEST org/abc -j', path=self.path)
+        second = FingerprintStore(pair='org/OTHER org/abc -j', path=self.path)
+        first.record(self.jira, self.zen)
+        second.record(self.jira, self.zen)
+        first.save()
+        second.save()
+
+        for pair in ('org/TEST org/abc -j', 'org/OTHER org/abc -j'):
+            self.assertTrue(FingerprintStore(pair=pair, path=self.path).unchanged(self.jira, self.zen))
+
+    def test_forget(self):
+        store = FingerprintStore(pair='org/TEST org/abc', path=self.path)
+        store.record(self.jira, self.zen)
+        store.forget(self.jira)  # e.g. the pair's sprint assignment failed once all pairs were done
+        self.assertFalse(store.unchanged(self.jira, self.zen))
+
+    def test_held_saves(self):
+        store = FingerprintStore(pair='org/TEST org/abc', path=self.path)
+        store.record(self.jira, self.zen)
+        store.held = True  # e.g. while the changes of the sync are planned but not made yet
+        store.save()
+        self.assertFalse(os.path.exists(self.path))
+
+        store.held = False
+        store.save()
+        self.assertTrue(FingerprintStore(pair='org/TEST org/abc', path=self.path).unchanged(self.jira, self.zen))
+
+    def test_unreadable_file(self):
+        with open(self.path, 'w') as fh:
+            fh.write('not json')
+        self.assertEqual(LocalStore(self.path).data, {})
+
+
+class TestWriteLog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'writes.json')
+
+        self.jira = JiraIssue.__new__(JiraIssue)  # Only the fields are needed
+        self.jira.__dict__.update(jira_key='TEST-1', github_key='1', status='Done', pipeline='Done', story_points=3,
+                                  issue_type='Story', sprint_name=None, milestone_name=None,
+                                  updated=pytz.utc.localize(datetime.datetime(2019, 5, 1, 9, 30)))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_echo(self):
+        writes = WriteLog(pair='org/TEST org/abc', path=self.path)
+        self.assertFalse(writes.echo(self.jira))  # Never written to
+        writes.record(self.jira)
+        writes.save()
+
+        writes = WriteLog(pair='org/TEST org/abc', path=self.path)  # Read back from disk
+        self.jira.updated = datetime.datetime.now(pytz.utc)  # Moved forward by the write
+        self.assertTrue(writes.echo(self.jira))
+        self.assertLessEqual(writes.written(self.jira), self.jira.updated)
+
+        self.jira.pipeline = 'Closed'  # Derived from the status, so not what was written
+        self.assertTrue(writes.echo(self.jira))
+        self.jira.status = 'In Progress'  # Changed by someone since
+        self.assertFalse(writes.echo(self.jira))
+
+    def test_unchanged_since(self):
+        writes = WriteLog(pair='org/TEST org/abc', path=self.path)
+        since = pytz.utc.localize(datetime.datetime(2019, 5, 2))
+        self.assertTrue(writes.unchanged_since(self.jira, since))  # Updated before then, and never written to
+        writes.record(self.jira)
+        self.jira.story_points = 5
+        self.assertFalse(writes.unchanged_since(self.jira, since))  # Changed since it was written to
+
+        writes.forget(self.jira)
+        self.assertIsNone(writes.written(self.jira))
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'snapshots.json')
+
+        fields = dict(jira_key='TEST-1', github_key='1', status='Done', pipeline='Done', story_points=3,
+                      issue_type='Story', sprint_name=None, milestone_name=None)
+        self.jira = JiraIssue.__new__(JiraIssue)  # Only the fields are needed
+        self.jira.__dict__.update(fields)
+        self.zenhub = Issue.__new__(Issue)
+        self.zenhub.__dict__.update(fields)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_record(self):
+        snapshots = SnapshotStore(pair='org/TEST org/abc', path=self.path)
+        self.assertIsNone(snapshots.base(self.jira, self.zenhub))  # Never synced
+        snapshots.record(self.jira, self.zenhub)
+        snapshots.save()
+
+        snapshots = SnapshotStore(pair='org/TEST org/abc', path=self.path)  # Read back from disk
+        base = snapshots.base(self.jira, self.zenhub)
+        self.assertEqual(base['jira'], {'epic': False, 'status': 'Done', 'story_points': 3.0, 'sprint_name': None})
+        self.assertEqual(base['zenhub'], {'epic': False, 'pipeline': 'Done', 'story_points': 3.0,
+                                          'milestone_name': None})
+
+        snapshots.forget(self.jira)
+        self.assertIsNone(snapshots.base(self.jira, self.zenhub))
+
+    def test_conflicts_kept(self):
+        snapshots = SnapshotStore(pair='org/TEST org/abc', path=self.path)
+        snapshots.record(self.jira, self.zenhub)
+        self.jira.story_points, self.zenhub.story_points = 5, 8  # Changed differently in each
+        self.jira.status = 'In Progress'  # Synced
+        snapshots.record(self.jira, self.zenhub, keep=[('story_points', 'story_points')])
+
+        base = snapshots.base(self.jira, self.zenhub)
+        self.assertEqual((base['jira']['story_points'], base['zenhub']['story_points']), (3.0, 3.0))
+        self.assertEqual(base['jira']['status'], 'In Progress')
+
+
+class TestHighWaterMarkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'marks.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_record(self):
+        marks = HighWaterMarkStore(pair='org/TEST org/abc', path=self.path)
+        self.assertIsNone(marks.since)
+        self.assertEqual(marks.board, {})
+
+        started = pytz.timezone('America/Los_Angeles').localize(datetime.datetime(2019, 5, 1, 9, 30))
+        marks.record(started, {'1': ['Backlog', 2, False]})
+        marks.save()
+
+        marks = HighWaterMarkStore(pair='org/TEST org/abc', path=self.path)
+        self.assertEqual(marks.since, started)
+        self.assertEqual(marks.board, {'1': ['Backlog', 2, False]})
+        self.assertEqual(marks.retry, {'jira': [], 'zenhub': []})
+
+    def test_record_retry(self):
+        marks = HighWaterMarkStore(pair='org/TEST org/abc', path=self.path)
+        marks.record(datetime.datetime.now(pytz.utc), {}, {'jira': ['TEST-2', 'TEST-1', 'TEST-2'], 'zenhub': ['7']})
+        marks.save()
+
+        marks = HighWaterMarkStore(pair='org/TEST org/abc', path=self.path)
+        self.assertEqual(marks.retry, {'jira': ['TEST-1', 'TEST-2'], 'zenhub': ['7']})
+
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'journal-%s.jsonl')
+        self.plan = Plan('org/TEST', 'org/abc', [{'side': 'jira', 'kind': 'transition', 'key': f'TEST-{i}',
+                                                 'value': 'Done'} for i in range(4)])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_resume(self):
+        journal = Journal('org/TEST org/abc', path=self.path)
+        self.assertIsNone(journal.unfinished())
+        journal.start(self.plan)
+        journal.done(self.plan.mutations[:2])
+        self.assertTrue(os.path.exists(self.path % 'org-TEST-org-abc'))
+
+        # The run is interrupted here. The next one picks up from the first unfinished change.
+        journal = Journal('org/TEST org/abc', path=self.path)
+        plan = journal.unfinished()
+        self.assertEqual((plan.jira, plan.zenhub), ('org/TEST', 'org/abc'))
+        self.assertEqual([m['key'] for m in plan.mutations], ['TEST-2', 'TEST-3'])
+
+        journal.done(plan.mutations[1:])  # Marked in the same journal, by position in the original plan
+        plan = Journal('org/TEST org/abc', path=self.path).unfinished()
+        self.assertEqual([m['key'] for m in plan.mutations], ['TEST-2'])
+
+        journal.finish()
+        self.assertIsNone(journal.unfinished())
+
+    def test_cut_off_line(self):
+        journal = Journal('org/TEST org/abc', path=self.path)
+        journal.start(self.plan)
+        journal.done(self.plan.mutations[:1])
+        with open(self.path % 'org-TEST-org-abc', 'a') as fh:
+            fh.write('{"done": [1')  # Interrupted while writing
+        self.assertEqual(len(Journal('org/TEST org/abc', path=self.path).unfinished().mutations), 3)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'checkpoint-%s.jsonl')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_restart(self):
+        checkpoint = Checkpoint('jira org/TEST', path=self.path)
+        self.assertIsNone(checkpoint.get('search?startAt=0'))
+        checkpoint.put('search?startAt=0', {'issues': [1]})
+        checkpoint.put('events', [])
+
+        # The run is interrupted here. The next one reuses what was retrieved.
+        checkpoint = Checkpoint('jira org/TEST', path=self.path)
+        self.assertEqual(checkpoint.get('search?startAt=0'), {'issues': [1]})
+        self.assertEqual(checkpoint.get('events'), [])
+
+        checkpoint.clear()
+        self.assertIsNone(Checkpoint('jira org/TEST', path=self.path).get('events'))
+
+    def test_stale_and_cut_off_lines(self):
+        with open(self.path % 'jira-org-TEST', 'w') as fh:
+            fh.write(f'{{"url": "old", "time": {time.time() - 7200}, "content": {{}}}}\n')
+            fh.write(f'{{"url": "new", "time": {time.time()}, "content": {{}}}}\n')
+            fh.write('{"url": "cut off", "ti')  # Interrupted while writing
+        checkpoint = Checkpoint('jira org/TEST', path=self.path, max_age=3600)
+        self.assertEqual(list(checkpoint.responses), ['new'])
+
+    def test_disabled(self):
+        self.assertIsNone(Checkpoint.open('jira org/TEST'))  # Only the command line tool enables checkpoints
+
+
+if __name__ == '__main__':
+    unittest.main()
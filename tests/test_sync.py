@@ -1,10 +1,19 @@
+import datetime
+import logging
+import os
+import pytz
 import re
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch, call
+from unittest.mock import Mock, patch, call
 from more_itertools import last
 
 
 from src.jira import JiraRepo, JiraIssue
+from src.plan import Plan
+from src.state import FingerprintStore, SnapshotStore, WriteLog
 from src.sync import Sync
 from src.zenhub import ZenHubIssue, ZenHubRepo
 
@@ -757,7 +766,7 @@ def mock_response(url, *args, **kwargs):
                                            {'id': '700', 'name': 'Done'}]})
 
     # Mock Jira issue information
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=project=TEST&startAt=0':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=project=TEST&expand=changelog&startAt=0':
         return MockResponse({'issues': [
             {'fields': {
                 'assignee': None,
@@ -826,22 +835,22 @@ def mock_response(url, *args, **kwargs):
         'total': 4,
         'maxResults': 50})
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=project=JIRA&startAt=0':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=project=JIRA&expand=changelog&startAt=0':
         return MockResponse(JIRA_ISSUES)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-5':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-5&expand=changelog':
         return MockResponse(JIRA_5)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-6':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-6&expand=changelog':
         return MockResponse(JIRA_6)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-7':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-7&expand=changelog':
         return MockResponse(JIRA_7)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-8':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-8&expand=changelog':
         return MockResponse(JIRA_8)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-9':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-9&expand=changelog':
         return MockResponse(JIRA_9)
 
     elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/issue/JIRA-9':
@@ -850,10 +859,10 @@ def mock_response(url, *args, **kwargs):
     elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/issue/JIRA-11':
         return MockResponse(JIRA_11_remove_10010, status_code=204)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-10':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-10&expand=changelog':
         return MockResponse(JIRA_10)
 
-    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-11':
+    elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=id=JIRA-11&expand=changelog':
         return MockResponse(JIRA_11)
 
     elif url == 'https://ucsc-cgl.atlassian.net/rest/api/latest/search?jql=sprint="testsprint1"':
@@ -946,6 +955,10 @@ def mock_response(url, *args, **kwargs):
             [{'title': 'testsprint1', 'number': 1}, {'title': 'testsprint2', 'number': 2},
              {'title': 'testsprint3', 'number': 3}], status_code=200)
 
+    # The GraphQL API is unavailable, so GitHub issues are retrieved through the REST API
+    elif url == 'https://api.github.com/graphql':
+        return MockResponse({'message': 'Bad credentials'}, status_code=401)
+
     # Mock response for getting repo id
     elif url == 'https://api.github.com/repos/ucsc-cgp/abc':
         return MockResponse({'id': 123})
@@ -1000,12 +1013,12 @@ class TestSync(unittest.TestCase):
         z_epic = self.ZENHUB_REPO.issues['2']
 
         Sync.sync_epics(j_epic, z_epic)  # test syncing from Jira to ZenHub
-        self.assertEqual(change_zen_epic.call_args_list, [call(add='1'), call(remove='4')])
+        self.assertEqual(change_zen_epic.call_args_list, [call(add=['1'], remove=['4'])])
 
         zen_children.return_value = ['3', '4']  # Not sure why but this needs to be reset
 
         Sync.sync_epics(z_epic, j_epic)  # test syncing from ZenHub to Jira
-        self.assertEqual(change_jira_epic.call_args_list, [call(add='TEST-4'), call(remove='TEST-1')])
+        self.assertEqual(change_jira_epic.call_args_list, [call(add=['TEST-4'], remove=['TEST-1'])])
 
     @patch('src.jira.requests.put', side_effect=mock_response)
     @patch('src.jira.requests.post', side_effect=mock_response)
@@ -1015,29 +1028,69 @@ class TestSync(unittest.TestCase):
 
         Sync.sync_board(self.ZENHUB_REPO, self.JIRA_REPO)
 
+        # Each issue's status and story points are set in one request, and TEST-4, which is already in progress, is
+        # not transitioned
+        self.assertEqual([c[1]['json'] for c in jira_put.call_args_list], [{'fields': {'customfield_10014': 2}}])
+
         # TEST-1 is updated
-        self.assertEqual(jira_post.call_args_list[0][1]['json'], {'transition': {'id': 61}})  # TEST-1 to new issue
-        self.assertEqual(jira_put.call_args_list[0][1]['json'],
-                         {'fields': {'customfield_10014': None}})
+        self.assertEqual(jira_post.call_args_list[0][1]['json'],
+                         {'transition': {'id': 61}, 'fields': {'customfield_10014': None}})  # TEST-1 to new issue
 
         # TEST-2 is updated
-        self.assertEqual(jira_post.call_args_list[1][1]['json'], {'transition': {'id': 21}})
-        self.assertEqual(jira_put.call_args_list[1][1]['json'],
-                         {'fields': {'customfield_10014': 5}})
+        self.assertEqual(jira_post.call_args_list[1][1]['json'],
+                         {'transition': {'id': 21}, 'fields': {'customfield_10014': 5}})
 
-        # TEST-1 and TEST-3 are added to epic TEST-2
-        self.assertEqual(jira_post.call_args_list[2][1]['json'], {'issues': ['TEST-1']})
-        self.assertEqual(jira_post.call_args_list[3][1]['json'], {'issues': ['TEST-3']})
+        # TEST-1 and TEST-3 are added to epic TEST-2 in one request
+        self.assertEqual(jira_post.call_args_list[2][1]['json'], {'issues': ['TEST-1', 'TEST-3']})
 
         # TEST-3 is updated to Story, causing TEST-2 and TEST-4 to no longer be its children
-        self.assertEqual(jira_post.call_args_list[4][1]['json'], {'transition': {'id': 41}})
-        self.assertEqual(jira_put.call_args_list[2][1]['json'],
-                         {'fields': {'customfield_10014': 2}})
+        self.assertEqual(jira_post.call_args_list[3][1]['json'],
+                         {'transition': {'id': 41}, 'fields': {'customfield_10014': 2}})
+        self.assertEqual(jira_post.call_count, 4)
+
+    @patch('src.jira.requests.put', side_effect=mock_response)
+    @patch('src.jira.requests.post', side_effect=mock_response)
+    def test_sync_board_zen_to_jira_planned(self, jira_post, jira_put):
+        """Planning a sync makes no changes, and carrying out the plan makes the same ones as syncing would"""
+
+        plan = Plan('ucsc-cgl/TEST', 'ucsc-cgp/abc')
+        self.ZENHUB_REPO.plan = self.JIRA_REPO.plan = plan
+        Sync.sync_board(self.ZENHUB_REPO, self.JIRA_REPO)
+        self.assertEqual((jira_post.call_count, jira_put.call_count), (0, 0))
+        self.assertIn({'side': 'jira', 'kind': 'epic_add', 'key': 'TEST-2', 'value': ['TEST-1', 'TEST-3']},
+                      plan.mutations)
+
+        self.ZENHUB_REPO.plan = self.JIRA_REPO.plan = None
+        counts = plan.optimize().execute(self.JIRA_REPO, self.ZENHUB_REPO)
+        self.assertEqual(counts, {'processed': 8, 'skipped': 0, 'failed': []})
+        self.assertEqual([c[1]['json'] for c in jira_put.call_args_list], [{'fields': {'customfield_10014': 2}}])
+        self.assertEqual([c[1]['json'] for c in jira_post.call_args_list],
+                         [{'transition': {'id': 61}, 'fields': {'customfield_10014': None}},
+                          {'transition': {'id': 21}, 'fields': {'customfield_10014': 5}},
+                          {'transition': {'id': 41}, 'fields': {'customfield_10014': 2}},
+                          {'issues': ['TEST-1', 'TEST-3']}])  # Epic membership is changed last
+
+    @patch('src.jira.requests.put', side_effect=mock_response)
+    @patch('src.jira.requests.post')
+    def test_sync_board_zen_to_jira_fields_refused(self, jira_post, jira_put):
+        """If Jira refuses fields along with a transition, they are sent separately for the rest of the run"""
+
+        def refuse_fields(url, headers=None, json=None):
+            if 'fields' in json:
+                refused = {'errorMessages': [], 'errors': {'customfield_10014': 'not on screen'}}
+                return Mock(status_code=400, json=lambda: refused)
+            return mock_response(url, headers=headers, json=json)
+        jira_post.side_effect = refuse_fields
 
-        # TEST-4 is updated
-        self.assertEqual(jira_post.call_args_list[5][1]['json'], {'transition': {'id': 21}})
-        self.assertEqual(jira_put.call_args_list[3][1]['json'],
-                         {'fields': {'customfield_10014': 2}})
+        Sync.sync_board(self.ZENHUB_REPO, self.JIRA_REPO)
+
+        self.assertFalse(self.JIRA_REPO.transition_fields)
+        self.assertEqual([c[1]['json'] for c in jira_post.call_args_list[:3]],
+                         [{'transition': {'id': 61}, 'fields': {'customfield_10014': None}},  # refused
+                          {'transition': {'id': 61}},
+                          {'transition': {'id': 21}}])
+        self.assertEqual([c[1]['json'] for c in jira_put.call_args_list[:2]],
+                         [{'fields': {'customfield_10014': None}}, {'fields': {'customfield_10014': 5}}])
 
     @patch('src.github.requests.patch', side_effect=mock_response)
     @patch('src.zenhub.requests.put', side_effect=mock_response)
@@ -1062,12 +1115,12 @@ class TestSync(unittest.TestCase):
         self.assertEqual(zenhub_post.call_args_list[4][1]['json'], {'pipeline_id': '700', 'position': 'top'})
         self.assertEqual(zenhub_put.call_args_list[2][1]['json'], {'estimate': 3.0})
 
-        # 2 and 4 are added to epic 3 through ZenHub
-        self.assertEqual(zenhub_post.call_args_list[5][1]['json'], {'add_issues': [{'repo_id': 123, 'issue_number': 2}]})
-        self.assertEqual(zenhub_post.call_args_list[6][1]['json'], {'add_issues': [{'repo_id': 123, 'issue_number': 4}]})
+        # 2 and 4 are added to epic 3 through ZenHub in one request
+        self.assertEqual(zenhub_post.call_args_list[5][1]['json'],
+                         {'add_issues': [{'repo_id': 123, 'issue_number': 2}, {'repo_id': 123, 'issue_number': 4}]})
 
         # 4 is updated in ZenHub and GitHub
-        self.assertEqual(zenhub_post.call_args_list[7][1]['json'], {'pipeline_id': '200', 'position': 'top'})
+        self.assertEqual(zenhub_post.call_args_list[6][1]['json'], {'pipeline_id': '200', 'position': 'top'})
         self.assertEqual(zenhub_put.call_args_list[3][1]['json'], {'estimate': 4.0})
 
     @patch('src.sync.Sync.sync_from_specified_source')
@@ -1081,6 +1134,177 @@ class TestSync(unittest.TestCase):
                     ('ZenHubIssue', 'JiraIssue')]
         self.assertEqual(called_with, expected)
 
+    @patch('src.sync.Sync.sync_from_specified_source')
+    def test_mirror_sync_ignores_own_writes(self, sync):
+        """Assert that issues the sync wrote to aren't synced back next time unless someone changed them since."""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'writes.json')
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, writes=WriteLog('TEST abc', path=path))
+            self.assertEqual(counts, {'processed': 4, 'skipped': 0, 'failed': []})
+
+            # The issues that were written to now have later timestamps, but still hold what was written
+            for source, dest in (call[0] for call in sync.call_args_list):
+                dest.updated = datetime.datetime.now(pytz.utc)
+            sync.reset_mock()
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, writes=WriteLog('TEST abc', path=path))
+            self.assertEqual(counts, {'processed': 0, 'skipped': 4, 'failed': []})
+            sync.assert_not_called()
+
+            # Someone changes an issue that was the source last time, so it is synced to the one that was written to
+            zenhub_issue = self.ZENHUB_REPO.issues['4']
+            zenhub_issue.story_points = 8
+            zenhub_issue.updated = datetime.datetime.now(pytz.utc) + datetime.timedelta(minutes=1)
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, writes=WriteLog('TEST abc', path=path))
+            self.assertEqual(counts, {'processed': 1, 'skipped': 3, 'failed': []})
+            sync.assert_called_once_with(zenhub_issue, self.JIRA_REPO.issues['TEST-4'])
+
+    def test_sync_from_most_current_by_field(self):
+        """Assert that each field is synced from the issue it was modified in last, whichever was updated last."""
+
+        jira_issue, zenhub_issue = self.JIRA_REPO.issues['TEST-4'], self.ZENHUB_REPO.issues['4']
+        zenhub_issue.pipeline = zenhub_issue.status = 'Done'
+        jira_issue.updated = pytz.utc.localize(datetime.datetime(2019, 6, 1))  # e.g. its summary was edited since
+        jira_issue.field_updated = {'status': pytz.utc.localize(datetime.datetime(2019, 3, 1)),
+                                    'story_points': pytz.utc.localize(datetime.datetime(2019, 1, 1)),
+                                    'sprint_name': pytz.utc.localize(datetime.datetime(2019, 1, 1))}
+        zenhub_issue.field_updated['pipeline'] = pytz.utc.localize(datetime.datetime(2019, 1, 15))
+        for request in (self.zenhub_post, self.zenhub_put):
+            request.reset_mock()  # Requests were made while loading the repos
+
+        self.assertTrue(Sync.sync_from_most_current(jira_issue, zenhub_issue))
+
+        # The Jira status is newer, so the ZenHub issue is moved; the ZenHub estimate is newer, so it is set in Jira
+        # The Jira and ZenHub mocks patch the same requests functions, so the ZenHub ones see the requests to both APIs
+        self.assertEqual([(c[0][0], c[1]['json']) for c in self.zenhub_post.call_args_list],
+                         [('https://api.zenhub.io/p1/repositories/123/issues/4/moves',
+                           {'pipeline_id': '200', 'position': 'top'})])
+        self.assertEqual([(c[0][0], c[1]['json']) for c in self.zenhub_put.call_args_list],
+                         [('https://ucsc-cgl.atlassian.net/rest/api/latest/issue/TEST-4',
+                           {'fields': {'customfield_10014': 2}})])
+
+        self.assertFalse(Sync.sync_from_most_current(jira_issue, zenhub_issue))  # Nothing differs now
+
+    @patch('src.zenhub.ZenHubIssue.get_events')
+    def test_mirror_sync_merges_with_base(self, get_events):
+        """Assert that only fields changed in one issue since the last sync are written, and conflicts are kept."""
+
+        jira_issue, zenhub_issue = self.JIRA_REPO.issues['TEST-4'], self.ZENHUB_REPO.issues['4']
+        zenhub_issue.status, zenhub_issue.pipeline = jira_issue.status, jira_issue.pipeline  # In sync last time
+        zenhub_issue.story_points, zenhub_issue.milestone_name = jira_issue.story_points, jira_issue.sprint_name
+
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshots = SnapshotStore('TEST abc', path=os.path.join(tmp, 'snapshots.json'))
+            snapshots.record(jira_issue, zenhub_issue)
+
+            jira_issue.story_points = 5  # Changed only in Jira
+            jira_issue.status, zenhub_issue.pipeline = 'In Review', 'Done'  # Changed differently in each
+            for request in (self.zenhub_post, self.zenhub_put):
+                request.reset_mock()  # Requests were made while loading the repos
+
+            with self.assertLogs(level='WARNING') as logs:
+                counts = Sync.mirror_sync(self.JIRA_REPO.view(['TEST-4']), self.ZENHUB_REPO.view(['4']),
+                                          snapshots=snapshots)
+            self.assertEqual(counts, {'processed': 1, 'skipped': 0, 'failed': [], 'conflicts': ['TEST-4']})
+            self.assertTrue(any('Conflict in' in line for line in logs.output))
+
+            # Only the estimate is written; neither the status nor the pipeline is overwritten
+            # The Jira and ZenHub mocks patch the same requests functions, so the ZenHub ones see requests to both
+            self.zenhub_post.assert_not_called()
+            self.assertEqual([(c[0][0], c[1]['json']) for c in self.zenhub_put.call_args_list],
+                             [('https://api.zenhub.io/p1/repositories/123/issues/4/estimate', {'estimate': 5})])
+            get_events.assert_not_called()  # No timestamps were needed
+
+            # The conflict is still reported next time, until someone resolves it
+            self.zenhub_put.reset_mock()
+            counts = Sync.mirror_sync(self.JIRA_REPO.view(['TEST-4']), self.ZENHUB_REPO.view(['4']),
+                                      snapshots=snapshots)
+            self.assertEqual(counts['conflicts'], ['TEST-4'])
+            self.zenhub_put.assert_not_called()
+
+            zenhub_issue.pipeline = jira_issue.pipeline = 'Review/QA'
+            zenhub_issue.status = 'In Review'
+            counts = Sync.mirror_sync(self.JIRA_REPO.view(['TEST-4']), self.ZENHUB_REPO.view(['4']),
+                                      snapshots=snapshots)
+            self.assertEqual(counts, {'processed': 0, 'skipped': 1, 'failed': []})
+
+    @patch('src.sync.Sync.sync_from_most_current')
+    def test_mirror_sync_workers(self, sync):
+        """Assert that all pairs are synced in a thread pool, with epics one after another and logs grouped by pair."""
+
+        events = []  # (start or end, issue key), in the order they happened
+        events_lock = threading.Lock()
+
+        def log_twice(a, b, writes=None):
+            with events_lock:
+                events.append(('start', a.jira_key))
+            logging.info(f'start {a.jira_key}')
+            time.sleep(0.01)  # Give other threads the chance to log in between
+            logging.info(f'end {a.jira_key}')
+            with events_lock:
+                events.append(('end', a.jira_key))
+            return True
+
+        sync.side_effect = log_twice
+        result = dict()
+        with self.assertLogs(level='INFO') as logs:
+            # Run in a separate thread so that a deadlock fails the test instead of hanging the suite
+            runner = threading.Thread(target=lambda: result.update(
+                counts=Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, workers=4)), daemon=True)
+            runner.start()
+            runner.join(timeout=10)
+            self.assertFalse(runner.is_alive(), 'mirror_sync did not finish')
+
+        self.assertEqual(result['counts'], {'processed': 4, 'skipped': 0, 'failed': []})
+        started = sorted(key for event, key in events if event == 'start')
+        self.assertEqual(started, ['TEST-1', 'TEST-2', 'TEST-3', 'TEST-4'])
+
+        # Epics TEST-2 and TEST-3 are synced one after another: one ends before the other starts
+        epic_events = [event for event in events if event[1] in ('TEST-2', 'TEST-3')]
+        self.assertEqual([event for event, key in epic_events], ['start', 'end', 'start', 'end'])
+        self.assertEqual(epic_events[0][1], epic_events[1][1])
+
+        # The records of each pair are written out together
+        messages = [m.split(':')[-1] for m in logs.output if 'start' in m or 'end' in m]
+        self.assertEqual(len(messages), 8)
+        for i in range(0, len(messages), 2):
+            self.assertEqual(messages[i].replace('start', 'end'), messages[i + 1])
+
+    @patch('src.sync.Sync.sync_from_most_current')
+    def test_mirror_sync_reports_failed_pairs(self, sync):
+        """Assert that the keys of pairs that failed to sync are returned, and that their fingerprints aren't kept."""
+
+        def fail_for_test_1(a, b, writes=None):
+            if a.jira_key == 'TEST-1':
+                raise KeyError('TEST-1')
+            return True
+
+        sync.side_effect = fail_for_test_1
+        with tempfile.TemporaryDirectory() as tmp:
+            fingerprints = FingerprintStore('TEST abc', path=os.path.join(tmp, 'fingerprints.json'))
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, fingerprints)
+        self.assertEqual(counts, {'processed': 3, 'skipped': 0, 'failed': ['TEST-1']})
+        self.assertNotIn('TEST-1:1', fingerprints.fingerprints)
+
+    @patch('src.sync.Sync.sync_from_most_current')
+    def test_mirror_sync_skips_unchanged_pairs(self, sync):
+        """Assert that pairs synced in a previous run are skipped if they are unchanged, except for epics."""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'fingerprints.json')
+
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, FingerprintStore('TEST abc', path=path))
+            self.assertEqual(counts, {'processed': 4, 'skipped': 0, 'failed': []})
+
+            sync.reset_mock()
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, FingerprintStore('TEST abc', path=path))
+            self.assertEqual(counts, {'processed': 2, 'skipped': 2, 'failed': []})  # TEST-2 and TEST-3 are epics on one side
+            self.assertEqual([c[0][0].jira_key for c in sync.call_args_list], ['TEST-2', 'TEST-3'])
+
+            self.ZENHUB_REPO.issues['4'].story_points = 8  # A change on one side means the pair is synced again
+            counts = Sync.mirror_sync(self.JIRA_REPO, self.ZENHUB_REPO, FingerprintStore('TEST abc', path=path))
+            self.assertEqual(counts, {'processed': 3, 'skipped': 1, 'failed': []})
+
     @patch('src.github.requests.patch', side_effect=mock_response)
     @patch('src.jira.requests.put', side_effect=mock_response)
     @patch('src.jira.requests.get', side_effect=mock_response)
@@ -1116,6 +1340,8 @@ class TestSync(unittest.TestCase):
         assert zen.milestone_name == 'testsprint1'
         assert jira.sprint_name is None
         Sync.sync_sprints(zen, jira)
+        self.assertEqual(jira_post.call_count, 0)  # Sprint assignments are held back until they are flushed
+        self.assertEqual(self.JIRA_REPO.flush_sprint_assignments(), [])
         self.assertEqual('https://ucsc-cgl.atlassian.net/rest/agile/1.0/sprint/42/issue', jira_post.mock_calls[0][1][0])
         expected = {'headers': {'Authorization': 'Basic token'}, 'json': {'issues': ['JIRA-7']}}
         observed = jira_post.mock_calls[0][2]
@@ -1150,7 +1376,10 @@ class TestSync(unittest.TestCase):
         jira = JiraIssue(repo=self.JIRA_REPO, key='JIRA-10')
         assert jira.sprint_name == 'testsprint1'
         assert jira.sprint_id == 42
-        expected = (27, 1, 1)  # counts of get, post and put calls up to this point
+        # counts of get, post and put calls up to this point. GitHub issues were already retrieved with the repo, the
+        # ID of testsprint2 was already looked up for JIRA-8, and ZenHub events are only looked up to compare
+        # timestamps.
+        expected = (14, 1, 1)
         Sync.sync_sprints(zen, jira)
         observed = (jira_get.call_count, jira_post.call_count, jira_put.call_count)
         self.assertEqual(expected, observed)
@@ -1162,8 +1391,11 @@ class TestSync(unittest.TestCase):
         jira = JiraIssue(repo=self.JIRA_REPO, key='JIRA-11')
         assert jira.sprint_name == 'testsprint3'
         assert jira.sprint_id == 99
-        expected = (32, 2, 2)  # counts of get, post and put calls up to this point
+        # counts of get, post and put calls up to this point; testsprint1's ID is remembered, and adding the issue to
+        # the new sprint moves it out of the old one without a separate request
+        expected = (16, 2, 1)
         Sync.sync_sprints(zen, jira)
+        self.JIRA_REPO.flush_sprint_assignments()
         self.assertEqual('testsprint1', jira.sprint_name)
         self.assertTrue(jira.sprint_name == zen.milestone_name)
         self.assertEqual(42, jira.sprint_id)
@@ -1185,3 +1417,17 @@ class TestSync(unittest.TestCase):
         self.assertEqual(3, zen.milestone_id)
         self.assertEqual('https://api.github.com/repos/ucsc-cgp/abc/issues/11', git_patch.call_args[0][0])
         self.assertEqual({'milestone': 3}, git_patch.call_args[1]['json'])
+        self.assertEqual(git_patch.call_count, 1)  # The milestone is replaced in one request
+
+    @patch('src.github.requests.patch', side_effect=mock_response)
+    def test_sync_writes_coalesced(self, git_patch):
+        """Moving a GitHub issue to another milestone and reopening it for a pipeline move is one request"""
+
+        jira = JiraIssue(repo=self.JIRA_REPO, key='JIRA-11')
+        zen = ZenHubIssue(repo=self.ZENHUB_REPO_SYNC, key='11')
+        Sync.sync_from_specified_source(jira, zen)
+
+        self.assertEqual(git_patch.call_count, 1)
+        self.assertEqual(git_patch.call_args[0][0], 'https://api.github.com/repos/ucsc-cgp/abc/issues/11')
+        self.assertEqual(git_patch.call_args[1]['json'], {'milestone': 3, 'state': 'open'})
+        self.assertIsNone(zen.github_equivalent.pending_writes)
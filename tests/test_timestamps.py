@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import datetime
+import unittest
+
+from src.timestamps import UTC, parse_jira_timestamp, parse_utc_timestamp, utc_offset
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def test_parse_jira_timestamp(self):
+        parsed = parse_jira_timestamp('2019-02-05T14:52:11.501-0800')
+        self.assertEqual(parsed, datetime.datetime(2019, 2, 5, 14, 52, 11,
+                                                   tzinfo=datetime.timezone(datetime.timedelta(hours=-8))))
+        self.assertEqual(parse_jira_timestamp('2019-02-05T14:52:11.501+0530').utcoffset(),
+                         datetime.timedelta(hours=5, minutes=30))
+        self.assertIs(parsed.tzinfo, parse_jira_timestamp('2019-03-01T09:00:00.000-0800').tzinfo)  # Shared
+
+    def test_parse_utc_timestamp(self):
+        expected = datetime.datetime(2019, 5, 8, 22, 13, 43, tzinfo=UTC)
+        self.assertEqual(parse_utc_timestamp('2019-05-08T22:13:43Z'), expected)  # GitHub and the local state
+        self.assertEqual(parse_utc_timestamp('2019-05-08T22:13:43.123Z'), expected)  # ZenHub events
+
+    def test_utc_offset(self):
+        self.assertEqual(utc_offset('-0000'), UTC)
+        self.assertEqual(utc_offset('-0930').utcoffset(None), -datetime.timedelta(hours=9, minutes=30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,6 +62,9 @@ def mocked_response(*args, **kwargs):
             422,
             'Unprocessable Entity'
         )
+    elif args == ('https://api.github.com/graphql',):  # The GraphQL API is unavailable
+        return MockResponse({'message': 'Bad credentials'}, 401, 'Unauthorized')
+
     elif '/board' in args[0]:  # The request used for determining pipeline ids in _get_pipeline_ids().
         return MockResponse({'pipelines': [{'id': 1, 'name': 'Done', 'issues': []}, {'id': 2, 'name': 'Review/QA',
                                                                                      'issues': []}]}, 200, 'OK')
@@ -87,6 +90,7 @@ class TestZenHub(unittest.TestCase):
     def setUp(self):
         self.patch_repo_id = patch('src.zenhub.ZenHubRepo.get_repo_id', return_value='123456789').start()
         self.patch_requests = patch('requests.get', side_effect=mocked_response).start()
+        self.patch_post = patch('requests.post', side_effect=mocked_response).start()
         self.patch_token = patch('src.access._get_token', return_value='99999999').start()
         self.github_patch = patch('src.github.requests.patch', side_effect=mocked_response).start()
 
@@ -156,12 +160,38 @@ class TestZenHub(unittest.TestCase):
         expected_dict.update({'json': {'issues': [{'repo_id': self.board.id, 'issue_number': str(42)}]}})
         self.assertIn(expected_dict, request_args)
 
+    @patch('requests.get')
+    def test_get_board_snapshot(self, get):
+        get.return_value.status_code = 200
+        get.return_value.json.return_value = {'pipelines': [
+            {'id': 1, 'name': 'Backlog', 'issues': [{'issue_number': 42, 'estimate': {'value': 2}, 'is_epic': False}]},
+            {'id': 2, 'name': 'Done', 'issues': [{'issue_number': 43, 'is_epic': True}]}]}
+
+        self.assertEqual(self.board.get_board_snapshot(), {'42': ['Backlog', 2, False], '43': ['Done', None, True]})
+
+    def test_change_epic_membership(self):
+        """All the children added to and removed from an epic are sent in one request"""
+        with patch.object(self.board, 'api_call') as api_call:
+            self.zen.change_epic_membership(add=[str(i) for i in range(1, 201)], remove=['300'])
+
+        self.assertEqual(api_call.call_count, 1)
+        content = api_call.call_args[1]['json']
+        self.assertEqual(len(content['add_issues']), 200)
+        self.assertEqual(content['remove_issues'], [{'repo_id': 123456789, 'issue_number': 300}])
+
     @patch('requests.get', side_effect=mocked_response)
     def test_get_most_recent_event(self, get):
         """Test that get_most_recent_event() gets a correct datetime object from a list of events"""
         expected = datetime.datetime(2019, 5, 8, 22, 13, 43, tzinfo=pytz.timezone('UTC'))
         self.assertEqual(self.zen.get_most_recent_event(), expected)
 
+    def test_get_field_updated(self):
+        """The estimate was changed by the most recent event, and the pipeline never was"""
+        self.assertEqual(self.zen.modified('story_points'),
+                         datetime.datetime(2019, 5, 8, 22, 13, 43, tzinfo=pytz.timezone('UTC')))
+        self.assertEqual(self.zen.modified('pipeline'), self.zen.github_equivalent.created)
+        self.assertEqual(self.zen.modified('milestone_name'), self.zen.github_equivalent.updated)
+
     def tearDown(self):
         patch.stopall()  # Stop all patches started in setUp()
 